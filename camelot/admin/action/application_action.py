@@ -22,6 +22,7 @@
 #
 #  ============================================================================
 
+import collections
 import logging
 
 from PyQt4 import QtGui, QtCore
@@ -248,15 +249,33 @@ Restore the database to disk
 
 class Refresh( Action ):
     """Reload all objects from the database and update all views in the
-    application."""
+    application.
+    
+    The objects in the session are grouped per class, and each group is
+    reloaded with a query per chunk of primary keys.  Objects that are no
+    longer found in the database are considered deleted.
+    
+    .. attribute:: chunk_size
+    
+        the number of objects reloaded with a single query
+    """
     
     verbose_name = _('Refresh')
     shortcut = QtGui.QKeySequence( Qt.Key_F9 )
     icon = Icon('tango/16x16/actions/view-refresh.png')
+    chunk_size = 500
+    
+    def get_identity_groups( self, session ):
+        """:return: a dictionary with for each identity class in the session,
+        a dictionary mapping the primary keys to the objects"""
+        groups = collections.defaultdict( dict )
+        for key, obj in session.identity_map.items():
+            identity_class, primary_key = key[0], key[1]
+            groups[identity_class][primary_key] = obj
+        return groups
     
     def model_run( self, model_context ):
-        import sqlalchemy.exc as sa_exc
-        from camelot.core.orm import Session
+        from camelot.core.orm import Session, refresh_objects
         from camelot.view import action_steps
         from camelot.view.remote_signals import get_signal_handler
         LOGGER.debug('session refresh requested')
@@ -264,32 +283,26 @@ class Refresh( Action ):
         progress_view_message = ugettext('Update screens')
         session = Session()
         signal_handler = get_signal_handler()
-        refreshed_objects = []
+        refreshed_objects = collections.defaultdict( list )
         expunged_objects = []
-        #
-        # Loop over the objects one by one to be able to detect the deleted
-        # objects
-        #
         session_items = len( session.identity_map )
-        for i, (_key, obj) in enumerate( session.identity_map.items() ):
-            try:
-                session.refresh( obj )
-                refreshed_objects.append( obj )
-            except sa_exc.InvalidRequestError:
-                #
-                # this object could not be refreshed, it was probably deleted
-                # outside the scope of this session, so assume it is deleted
-                # from the application its point of view
-                #
-                session.expunge( obj )
-                expunged_objects.append( obj )
-            if i%10 == 0:
+        groups = self.get_identity_groups( session )
+        i = 0
+        for identity_class, objects in groups.items():
+            for refreshed, expunged in refresh_objects( session, 
+                                                        identity_class,
+                                                        objects,
+                                                        self.chunk_size ):
+                for obj in refreshed:
+                    refreshed_objects[type( obj )].append( obj )
+                expunged_objects.extend( expunged )
+                i += len( refreshed ) + len( expunged )
                 yield action_steps.UpdateProgress( i, 
                                                    session_items, 
                                                    progress_db_message )
         yield action_steps.UpdateProgress( text = progress_view_message )
-        for obj in refreshed_objects:
-            signal_handler.sendEntityUpdate( None, obj )
+        for objects in refreshed_objects.values():
+            signal_handler.sendEntitiesUpdate( None, objects )
         for obj in expunged_objects:
             signal_handler.sendEntityDelete( None, obj )
         yield action_steps.Refresh()
@@ -303,9 +316,11 @@ class Exit( Action ):
     tooltip = _('Exit the application')
     
     def gui_run( self, gui_context ):
-        from camelot.view.model_thread import get_model_thread
+        from camelot.view.model_thread import get_model_thread, \
+             stop_worker_threads
         model_thread = get_model_thread()
         gui_context.workspace.close_all_views()
+        stop_worker_threads()
         model_thread.stop()
         QtCore.QCoreApplication.exit(0)
         
@@ -423,7 +438,68 @@ class RuntimeInfo( Action ):
                                               xlwt.__VERSION__,
                                               unicode(sys.path))        
         yield action_steps.PrintHtml( html )
-        
+
+class TaskStatistics( Action ):
+    """Show the time spent by the model threads on each type of task, and
+    the slowest tasks.  This is for debugging purposes, this action is
+    triggered by pressing :kbd:`Ctrl-Alt-T` in the GUI"""
+
+    verbose_name = _('Show task statistics')
+    shortcut = QtGui.QKeySequence( QtCore.Qt.CTRL+QtCore.Qt.ALT+QtCore.Qt.Key_T )
+
+    def model_run( self, model_context ):
+        import cgi
+        from camelot.view import action_steps
+        from camelot.view.model_thread.signal_slot_model_thread import count_live_tasks
+        from camelot.view.model_thread.task_statistics import task_statistics
+
+        statistics = task_statistics.get_statistics()
+        tasks = sorted( statistics['tasks'].items(),
+                        key = lambda item:item[1]['execution_time'],
+                        reverse = True )
+        html = [ u'<em>Tasks:</em><table>',
+                 u'<tr><th>Task</th><th>Count</th><th>Wait</th><th>Max wait</th>'
+                 u'<th>Execution</th><th>Max execution</th><th>Statements</th></tr>' ]
+        for name, task in tasks:
+            html.append( u'<tr><td>%s</td><td>%i</td><td>%.3f</td><td>%.3f</td>'
+                         u'<td>%.3f</td><td>%.3f</td><td>%i</td></tr>'%( cgi.escape( name or '' ),
+                                                                        task['count'],
+                                                                        task['wait_time'],
+                                                                        task['maximum_wait_time'],
+                                                                        task['execution_time'],
+                                                                        task['maximum_execution_time'],
+                                                                        task['statements'] ) )
+        html.append( u'</table><br><em>Tasks slower than %.3fs:</em><table>'%statistics['slow_task_threshold'] )
+        for task in reversed( statistics['slow_tasks'] ):
+            html.append( u'<tr><td>%s</td><td>%.3f</td><td>%i</td></tr>'%( cgi.escape( task['name'] or '' ),
+                                                                            task['execution_time'],
+                                                                            task['statements'] ) )
+        html.append( u'</table>' )
+        if statistics['queue_depths']:
+            depths = [ depth for _time, depth in statistics['queue_depths'] ]
+            html.append( u'<br><em>Queue depth:</em> <b>%i</b>, maximum <b>%i</b>'%( depths[-1],
+                                                                                  max( depths ) ) )
+        html.append( u'<br><em>Live tasks:</em> <b>%i</b>'%count_live_tasks() )
+        yield action_steps.PrintHtml( u''.join( html ) )
+
+class ExportTaskStatistics( Action ):
+    """Export the statistics of the tasks handled by the model threads as
+    a json file, for offline analysis.  This action is triggered by pressing
+    :kbd:`Ctrl-Alt-Shift-T` in the GUI"""
+
+    verbose_name = _('Export task statistics')
+    shortcut = QtGui.QKeySequence( QtCore.Qt.CTRL+QtCore.Qt.ALT+QtCore.Qt.SHIFT+QtCore.Qt.Key_T )
+
+    def model_run( self, model_context ):
+        import json
+        from camelot.view import action_steps
+        from camelot.view.model_thread.signal_slot_model_thread import count_live_tasks
+        from camelot.view.model_thread.task_statistics import task_statistics
+        statistics = task_statistics.get_statistics()
+        statistics['live_tasks'] = count_live_tasks()
+        yield action_steps.OpenString( json.dumps( statistics, indent = 2, sort_keys = True ),
+                                       suffix = '.json' )
+
 class SegmentationFault( Action ):
     """Create a segmentation fault by reading null, this is to test
         the faulthandling functions.  this method is triggered by pressing
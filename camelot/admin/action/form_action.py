@@ -45,6 +45,11 @@ class FormActionModelContext( ApplicationActionModelContext ):
     
         the number of objects that can be reached in the form.
         
+    .. attribute:: collection_count_estimated
+    
+        True if the :attr:`collection_count` is an estimate, because the exact
+        number of objects is still being counted.
+        
     .. attribute:: selection_count
     
         the number of objects displayed in the form, at most 1.
@@ -64,6 +69,7 @@ class FormActionModelContext( ApplicationActionModelContext ):
         self.admin = None
         self.current_row = None
         self.collection_count = 0
+        self.collection_count_estimated = False
         self.selection_count = 1
         
     def get_object( self ):
@@ -126,6 +132,7 @@ class FormActionGuiContext( ApplicationActionGuiContext ):
         context = super( FormActionGuiContext, self ).create_model_context()
         context._model = self.widget_mapper.model()
         context.collection_count = context._model.rowCount()
+        context.collection_count_estimated = context._model.isRowCountEstimated()
         context.current_row = self.widget_mapper.currentIndex()
         return context
         
@@ -50,6 +50,12 @@ class ListActionModelContext( ApplicationActionModelContext ):
     
         the number of rows in the list.
         
+    .. attribute:: collection_count_estimated
+    
+        True if the :attr:`collection_count` is an estimate, because the exact
+        number of rows in the list is still being counted.  The estimate is
+        never larger than the exact number.
+        
     .. attribute:: selected_rows
     
         an ordered list with tuples of selected row ranges.  the range is
@@ -83,32 +89,53 @@ class ListActionModelContext( ApplicationActionModelContext ):
         self.current_row = None
         self.selection_count = 0
         self.collection_count = 0
+        self.collection_count_estimated = False
         self.selected_rows = []
         self.field_attributes = dict()
         
     def get_selection( self, yield_per = None ):
         """
         :param yield_per: an integer number giving a hint on how many objects
-            should fetched from the database at the same time.
+            should fetched from the database at the same time.  When given,
+            the objects are fetched in windows of this size, and the objects
+            of a window might be released once the next window is fetched.
         :return: a generator over the objects selected
         """
-        if self.selection_count == self.collection_count:
+        if self.is_collection_selected():
             # if all rows are selected, take a shortcut
             for obj in self.get_collection( yield_per ):
                 yield obj
         else:
             for (first_row, last_row) in self.selected_rows:
-                for row in range( first_row, last_row + 1 ):
-                    yield self._model._get_object( row )
+                for window in self._model.get_row_windows( first_row,
+                                                           last_row,
+                                                           yield_per ):
+                    for obj in window:
+                        yield obj
+    
+    def is_collection_selected( self ):
+        """
+        :return: True if all rows in the list are selected.  While the number
+            of rows is an estimate, not all rows can be selected.
+        """
+        return self.selection_count == self.collection_count and \
+               not self.collection_count_estimated
     
     def get_collection( self, yield_per = None ):
         """
         :param yield_per: an integer number giving a hint on how many objects
-            should fetched from the database at the same time.
+            should fetched from the database at the same time.  When given,
+            the objects are fetched in windows of this size, and the objects
+            of a window might be released once the next window is fetched.
         :return: a generator over the objects in the list
         """
-        for obj in self._model.get_collection():
-            yield obj
+        if yield_per == None:
+            for obj in self._model.get_collection():
+                yield obj
+        else:
+            for window in self._model.get_windows( yield_per ):
+                for obj in window:
+                    yield obj
             
     def get_object( self ):
         """
@@ -117,6 +144,23 @@ class ListActionModelContext( ApplicationActionModelContext ):
         if self.current_row != None:
             return self._model._get_object( self.current_row )
         
+    def get_query( self ):
+        """
+        :return: the filtered and searched query of which the rows are
+            displayed in the list, or None if the list does not display a
+            query.  Objects that have been added to the list but have not
+            yet been flushed are not part of this query.
+        """
+        return self._model.get_query()
+    
+    def is_cached( self, obj ):
+        """
+        :return: True if the row of obj is in the cache of the list, in which
+            case the list can remove or update the row without reloading
+            the other rows.
+        """
+        return self._model.is_cached( obj )
+        
 class ListActionGuiContext( ApplicationActionGuiContext ):
     """The context for an :class:`Action` on a table view.  On top of the attributes of the 
     :class:`camelot.admin.action.application_action.ApplicationActionGuiContext`, 
@@ -156,6 +200,7 @@ class ListActionGuiContext( ApplicationActionGuiContext ):
         current_row = None
         model = None
         collection_count = 0
+        collection_count_estimated = False
         selection_count = 0
         selected_rows = []
         if self.item_view != None:
@@ -163,6 +208,7 @@ class ListActionGuiContext( ApplicationActionGuiContext ):
             model = self.item_view.model()
             if model != None:
                 collection_count = model.rowCount()
+                collection_count_estimated = model.isRowCountEstimated()
             if self.item_view.selectionModel() != None:
                 selection = self.item_view.selectionModel().selection()
                 for i in range( len( selection ) ):
@@ -172,6 +218,7 @@ class ListActionGuiContext( ApplicationActionGuiContext ):
                     selection_count += ( rows_range[1] - rows_range[0] ) + 1
         context.selection_count = selection_count
         context.collection_count = collection_count
+        context.collection_count_estimated = collection_count_estimated
         context.selected_rows = selected_rows
         context.current_row = current_row
         context._model = model
@@ -325,22 +372,37 @@ class DuplicateSelection( EditAction ):
     
     def model_run( self, model_context ):
         from camelot.view import action_steps
-        for i, obj in enumerate( model_context.get_selection() ):
+        # the copies are appended to the selected query, so the selection
+        # is materialised before the first copy is flushed, or a windowed
+        # iteration would find the copies as well
+        selection = list( model_context.get_selection() )
+        for i, obj in enumerate( selection ):
             yield action_steps.UpdateProgress( i, 
-                                               model_context.selection_count,
+                                               len( selection ),
                                                self.verbose_name )
             new_object = model_context.admin.copy( obj )
             model_context._model.append_object( new_object ) 
         yield action_steps.FlushSession( model_context.session )
             
 class DeleteSelection( EditAction ):
-    """Delete the selected rows in a table"""
+    """Delete the selected rows in a table.
+    
+    Large selections are deleted with a delete statement per chunk of
+    primary keys, without loading the objects, if the admin does not
+    customize the deletion and the database takes care of the related
+    objects.
+    """
     
     shortcut = QtGui.QKeySequence.Delete
     icon = Icon('tango/16x16/places/user-trash.png')
     tooltip = _('Delete')
     verbose_name = _('Delete')
     
+    # selections with less rows are deleted object by object
+    bulk_threshold = 100
+    # the number of rows deleted with a single statement
+    bulk_chunk_size = 500
+    
     def gui_run( self, gui_context ):
         #
         # if there is an open editor on a row that will be deleted, there
@@ -349,9 +411,6 @@ class DeleteSelection( EditAction ):
         #
         gui_context.item_view.close_editor()
         super( DeleteSelection, self ).gui_run( gui_context )
-        # this refresh call could be avoided if the removal of an object
-        # in the collection through the DeleteObject action step handled this
-        gui_context.item_view.model().refresh()
 
     def model_run( self, model_context ):
         from camelot.view import action_steps
@@ -366,8 +425,17 @@ class DeleteSelection( EditAction ):
             response = yield step
             if response == QtGui.QMessageBox.No:
                 raise StopIteration
+        if self.can_delete_in_bulk( model_context ):
+            for step in self.bulk_delete( model_context ):
+                yield step
+            raise StopIteration
         objects_to_remove = list( model_context.get_selection() )
         #
+        # the list removes the rows of the deleted objects in its cache, if
+        # other objects are deleted, the list should be reloaded
+        #
+        all_cached = all( model_context.is_cached( o ) for o in objects_to_remove )
+        #
         # it might be impossible to determine the depending objects once
         # the object has been removed from the collection
         #
@@ -391,12 +459,146 @@ class DeleteSelection( EditAction ):
         for depending_obj in depending_objects:
             yield action_steps.UpdateObject( depending_obj )
         yield action_steps.FlushSession( model_context.session )
+        if not all_cached:
+            yield action_steps.RefreshItemView()
         
     def handle_object( self, model_context, obj ):
         from camelot.view import action_steps
         yield action_steps.DeleteObject( obj )
         model_context.admin.delete( obj )
         
+    def can_delete_in_bulk( self, model_context ):
+        """
+        :return: True if the selection can be deleted without loading
+            the selected objects
+        """
+        from sqlalchemy import orm
+        from sqlalchemy.exc import InvalidRequestError
+        from camelot.admin.entity_admin import EntityAdmin
+        admin = model_context.admin
+        if model_context.selection_count < self.bulk_threshold:
+            return False
+        if not isinstance( admin, EntityAdmin ):
+            return False
+        #
+        # customized deletion needs the objects
+        #
+        if getattr( type( self ).handle_object, 'im_func', None ) is not DeleteSelection.handle_object.im_func:
+            return False
+        for method_name in ( 'delete', 'get_depending_objects' ):
+            method = getattr( getattr( type( admin ), method_name ), 'im_func', None )
+            if method is not getattr( EntityAdmin, method_name ).im_func:
+                return False
+        mapper = admin.mapper
+        if mapper.inherits is not None or mapper.polymorphic_on is not None:
+            return False
+        if len( mapper.primary_key ) != 1:
+            return False
+        #
+        # a delete statement does not cascade to related objects, so this is
+        # only possible if the database does
+        #
+        for prop in mapper.iterate_properties:
+            if isinstance( prop, orm.properties.RelationshipProperty ):
+                if prop.cascade.delete:
+                    return False
+                if prop.direction != orm.interfaces.MANYTOONE and not prop.passive_deletes:
+                    return False
+        #
+        # other tables might refer to the table without a relationship
+        #
+        table = mapper.mapped_table
+        for other_table in table.metadata.tables.values():
+            for foreign_key in other_table.foreign_keys:
+                try:
+                    if not foreign_key.references( table ):
+                        continue
+                except InvalidRequestError:
+                    continue
+                if ( foreign_key.ondelete or '' ).upper() not in ( 'CASCADE', 'SET NULL' ):
+                    return False
+        return True
+    
+    def get_selected_primary_keys( self, model_context ):
+        """
+        :return: a tuple `(primary_keys, new_objects)` with a list of the
+            primary keys of the selected objects, and a list of the selected
+            objects that have no primary key yet.
+        """
+        admin = model_context.admin
+        primary_key_column = admin.mapper.primary_key[0]
+        query = model_context.get_query()
+        if query != None and model_context.is_collection_selected():
+            query = query.order_by( None )
+            if query.count() == model_context.collection_count:
+                return [ primary_key for ( primary_key, ) in query.with_entities( primary_key_column ) ], []
+        primary_keys, new_objects = [], []
+        for obj in model_context.get_selection( yield_per = self.bulk_chunk_size ):
+            primary_key = admin.primary_key( obj )
+            if primary_key == None or None in primary_key:
+                new_objects.append( obj )
+            else:
+                primary_keys.append( primary_key[0] )
+        return primary_keys, new_objects
+        
+    def bulk_delete( self, model_context ):
+        """Delete the selection with a delete statement per chunk of primary
+        keys.  The deleted rows are registered in the memento per chunk, in
+        the same transaction as the delete statement.  The views that
+        display the deleted objects are reloaded once all rows have been
+        deleted."""
+        from sqlalchemy import orm
+        from camelot.core.memento import memento_change
+        from camelot.core.orm import Session
+        from camelot.core.utils import is_deleted
+        from camelot.view import action_steps
+        from camelot.view.remote_signals import get_signal_handler
+        admin = model_context.admin
+        mapper = admin.mapper
+        primary_key_column = mapper.primary_key[0]
+        session = Session()
+        # flush pending changes, since the objects will be expunged
+        session.flush()
+        primary_keys, new_objects = self.get_selected_primary_keys( model_context )
+        for obj in new_objects:
+            admin.delete( obj )
+        memento = admin.get_memento()
+        model = unicode( admin.entity.__name__ )
+        keys = [ prop.key for prop in mapper.iterate_properties if 
+                 isinstance( prop, orm.properties.ColumnProperty ) ]
+        attributes = [ getattr( admin.entity, key ) for key in keys ]
+        signal_handler = get_signal_handler()
+        for i in range( 0, len( primary_keys ), self.bulk_chunk_size ):
+            yield action_steps.UpdateProgress( i, 
+                                               len( primary_keys ),
+                                               _('Removing') )
+            chunk = primary_keys[i:i+self.bulk_chunk_size]
+            chunk_query = session.query( admin.entity ).filter( primary_key_column.in_( chunk ) )
+            with session.begin():
+                if memento != None:
+                    changes = []
+                    for row in chunk_query.with_entities( primary_key_column, *attributes ):
+                        changes.append( memento_change( model = model,
+                                                        memento_type = 'before_delete',
+                                                        primary_key = ( row[0], ),
+                                                        previous_attributes = dict( zip( keys, row[1:] ) ) ) )
+                    memento.register_changes( changes )
+                chunk_query.delete( synchronize_session = False )
+            # the delete statement bypasses the flush, so publish it here
+            signal_handler.publish_changes( [ ( model, [ primary_key ], u'delete' ) for primary_key in chunk ] )
+            for primary_key in chunk:
+                identity_key = mapper.identity_key_from_primary_key( ( primary_key, ) )
+                obj = session.identity_map.get( identity_key )
+                if obj != None:
+                    session.expunge( obj )
+        #
+        # removing the deleted rows one by one from the views would shift
+        # their caches for each row, reload each view once instead
+        #
+        for proxy in signal_handler.get_subscribers( admin.entity ):
+            if not is_deleted( proxy ):
+                proxy.post_refresh()
+        
 class ToPreviousRow( ListContextAction ):
     """Move to the previous row in a table"""
     
@@ -476,13 +678,22 @@ class ToLastRow( ToNextRow ):
         item_view.selectRow( item_view.model().rowCount() - 1 )
 
 class ExportSpreadsheet( ListContextAction ):
-    """Export all rows in a table to a spreadsheet"""
+    """Export all rows in a table to a spreadsheet
+    
+    .. attribute:: max_xls_rows
+    
+        Tables with more rows than this are not exported as a formatted xls
+        file, but written row by row to an xlsx file if openpyxl is
+        available, or to a csv file otherwise.
+    """
     
     icon = Icon('tango/16x16/mimetypes/x-office-spreadsheet.png')
     tooltip = _('Export to MS Excel')
     verbose_name = _('Export to MS Excel')
     
     font_name = 'Arial'
+    # xlwt cannot write more than 65536 rows
+    max_xls_rows = 65000
     
     def model_run( self, model_context ):
         from decimal import Decimal
@@ -514,6 +725,11 @@ class ExportSpreadsheet( ListContextAction ):
             field = getattr( mapping, 'column_%i_field'%i )
             if field != None:
                 columns.append( ( field, all_fields[field] ) )
+        if model_context.collection_count > self.max_xls_rows or \
+           model_context.collection_count_estimated:
+            for step in self.write_rows( model_context, columns ):
+                yield step
+            return
         #
         # setup worksheet
         #
@@ -655,6 +871,53 @@ class ExportSpreadsheet( ListContextAction ):
         workbook.save( filename )
         yield action_steps.UpdateProgress( text = _('Opening file') )
         yield action_steps.OpenFile( filename )
+        
+    def write_rows( self, model_context, columns ):
+        """Write the rows of a table one at a time to a file, without any
+        formatting.  The objects are fetched in windows, so the memory 
+        needed does not depend on the number of rows.
+        
+        :param columns: a list of `(field_name, field_attributes)` tuples
+            with the columns to export.
+        """
+        from decimal import Decimal
+        from camelot.view import action_steps
+        from camelot.view.export_utils import get_streaming_writer_class
+        admin = model_context.admin
+        writer_class = get_streaming_writer_class()
+        filename = action_steps.OpenFile.create_temporary_file( writer_class.suffix )
+        writer = writer_class( filename )
+        try:
+            writer.writerow( [ unicode( field_attributes.get( 'name', name ) ) for 
+                               name, field_attributes in columns ] )
+            field_names = [ name for name, _field_attributes in columns ]
+            for j, obj in enumerate( model_context.get_collection( yield_per = 100 ) ):
+                dynamic_attributes = admin.get_dynamic_field_attributes( obj, 
+                                                                         field_names )
+                if j % 100 == 0:
+                    yield action_steps.UpdateProgress( j, model_context.collection_count )
+                values = []
+                for (_name, attributes), delta_attributes in zip( columns, dynamic_attributes ):
+                    # the attributes of the columns are shared by all rows
+                    attributes = dict( attributes, **delta_attributes )
+                    value = attributes['getter']( obj )
+                    if isinstance( value, Decimal ):
+                        value = float( str( value ) )
+                    elif isinstance( value, (unicode, str) ):
+                        if attributes.get( 'translate_content', False ) == True:
+                            value = ugettext( value )
+                    elif isinstance( value, list ):
+                        value = u'.'.join( value )
+                    elif not isinstance( value, ( type( None ), int, long, float, 
+                                                  datetime.date, datetime.time ) ):
+                        value = unicode( value )
+                    values.append( value )
+                writer.writerow( values )
+            yield action_steps.UpdateProgress( text = _('Saving file') )
+        finally:
+            writer.close()
+        yield action_steps.UpdateProgress( text = _('Opening file') )
+        yield action_steps.OpenFile( filename )
     
 class PrintPreview( ListContextAction ):
     """Print all rows in a table"""
@@ -782,10 +1045,21 @@ class ImportFromFile( EditAction ):
         
 
 class ReplaceFieldContents( EditAction ):
-    """Select a field an change the content for a whole selection"""
+    """Select a field an change the content for a whole selection.
+    
+    When all rows of a query are selected, and the field is a plain column,
+    the field is replaced with a single update statement, without loading
+    the objects.  This is not done if the admin customizes the flush, the
+    defaults or the depending objects, if the field has a validator or
+    setter, or if a column of the table has an onupdate default.
+    """
     
     verbose_name = _('Replace field contents')
     tooltip = _('Replace the content of a field for all rows in a selection')
+    
+    # the number of rows updated with a single statement, and the number of
+    # before images registered in the memento at once
+    bulk_chunk_size = 1000
 
     def model_run( self, model_context ):
         from camelot.view import action_steps
@@ -793,9 +1067,139 @@ class ReplaceFieldContents( EditAction ):
         yield action_steps.UpdateProgress( text = _('Replacing field') )
         if value_getter != None:
             value = value_getter()
+            column = self.get_bulk_column( model_context, field_name )
+            if column != None:
+                rows = self.get_bulk_rows( model_context, column )
+                if rows != None:
+                    for step in self.bulk_replace( model_context, field_name,
+                                                   column, value, rows ):
+                        yield step
+                    return
             for obj in model_context.get_selection():
                 setattr( obj, field_name, value )
             yield action_steps.FlushSession( model_context.session )
+            
+    def get_bulk_column( self, model_context, field_name ):
+        """
+        :return: the column to update if the field can be replaced with a
+            single update statement, None otherwise.
+        """
+        from sqlalchemy import orm, schema
+        from sqlalchemy.exc import InvalidRequestError
+        from sqlalchemy.orm.attributes import QueryableAttribute
+        from camelot.admin.entity_admin import EntityAdmin
+        if not model_context.is_collection_selected():
+            return None
+        query = model_context.get_query()
+        if query == None:
+            return None
+        admin = model_context.admin
+        if not isinstance( admin, EntityAdmin ):
+            return None
+        #
+        # an update statement bypasses customized flushes, validators and
+        # setters, those need the objects
+        #
+        if getattr( type( admin ).flush, 'im_func', None ) is not EntityAdmin.flush.im_func:
+            return None
+        #
+        # nor does it set defaults or update the depending objects
+        #
+        for method_name in ( 'set_defaults', 'get_depending_objects' ):
+            method = getattr( getattr( type( admin ), method_name ), 'im_func', None )
+            if method is not getattr( EntityAdmin, method_name ).im_func:
+                return None
+        mapper = admin.mapper
+        if mapper.inherits is not None or len( mapper.primary_key ) != 1:
+            return None
+        for table_column in mapper.mapped_table.columns:
+            if table_column.onupdate is not None:
+                return None
+        if field_name in mapper.validators:
+            return None
+        if not isinstance( getattr( admin.entity, field_name, None ), QueryableAttribute ):
+            return None
+        try:
+            property = mapper.get_property( field_name )
+        except InvalidRequestError:
+            return None
+        if not isinstance( property, orm.properties.ColumnProperty ):
+            return None
+        if len( property.columns ) != 1:
+            return None
+        column = property.columns[0]
+        if not isinstance( column, schema.Column ) or column.primary_key:
+            return None
+        return column
+    
+    def get_bulk_rows( self, model_context, column ):
+        """Select the primary key and the value of the column of all rows in
+        the query of the model context.  The query might join other tables,
+        so the primary keys of the rows to update are selected first, this
+        avoids an update with a subquery on the same table as well, which
+        some databases reject.
+        
+        :return: a list of `(primary_key, previous_value)` tuples, or None
+            if the query has not as many rows as the collection, because of
+            unflushed rows.
+        """
+        primary_key_column = model_context.admin.mapper.primary_key[0]
+        query = model_context.get_query().order_by( None )
+        # flush pending changes, since the objects will be reloaded
+        query.session.flush()
+        rows = query.with_entities( primary_key_column, column ).all()
+        if len( rows ) != model_context.collection_count:
+            return None
+        return rows
+    
+    def bulk_replace( self, model_context, field_name, column, value, rows ):
+        """Replace the field of all rows in the query of the model context
+        with an update statement per chunk of primary keys, and register the
+        previous values of the field in the memento.  The objects in the
+        session are reloaded and signaled as updated per chunk.
+        
+        :param rows: the rows returned by :meth:`get_bulk_rows`
+        """
+        from camelot.core.memento import memento_change
+        from camelot.view import action_steps
+        from camelot.view.remote_signals import get_signal_handler
+        admin = model_context.admin
+        primary_key_column = admin.mapper.primary_key[0]
+        session = model_context.get_query().session
+        primary_keys, previous_values = [], []
+        for primary_key, previous_value in rows:
+            if previous_value != value:
+                primary_keys.append( primary_key )
+                previous_values.append( previous_value )
+        memento = admin.get_memento()
+        model = unicode( admin.entity.__name__ )
+        signal_handler = get_signal_handler()
+        for i in range( 0, len( primary_keys ), self.bulk_chunk_size ):
+            yield action_steps.UpdateProgress( i, 
+                                               len( primary_keys ),
+                                               _('Replacing field') )
+            chunk = primary_keys[i:i+self.bulk_chunk_size]
+            #
+            # store the before images, before the update, in the same
+            # transaction as the update
+            #
+            with session.begin():
+                if memento != None:
+                    memento.register_changes( [ memento_change( model = model,
+                                                                memento_type = 'before_update',
+                                                                primary_key = ( primary_key, ),
+                                                                previous_attributes = { field_name : previous_value } )
+                                                for primary_key, previous_value in \
+                                                zip( chunk, previous_values[i:i+self.bulk_chunk_size] ) ] )
+                chunk_query = session.query( admin.entity ).filter( primary_key_column.in_( chunk ) )
+                chunk_query.update( { column : value }, synchronize_session = False )
+            changes = [ ( model, [ primary_key ], u'update' ) for primary_key in chunk ]
+            # the update statement bypasses the flush, so publish it here
+            signal_handler.publish_changes( changes )
+            #
+            # the objects already in the session should read the new value
+            #
+            signal_handler.refresh_changed_entities( changes )
         
 class AddExistingObject( EditAction ):
     """Add an existing object to a list if it is not yet in the
@@ -842,5 +1246,5 @@ class RemoveSelection( DeleteSelection ):
     icon = Icon( 'tango/16x16/actions/list-remove.png' )
             
     def handle_object( self, model_context, obj ):
-        model_context._model.remove( obj )
+        model_context._model.remove_object( obj )
         raise StopIteration
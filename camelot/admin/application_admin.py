@@ -95,6 +95,13 @@ methods :
     if this is set to True, present the user with a database selection
     wizard prior to starting the application.  Defaults to :keyword:`False`.
     
+.. attribute:: worker_threads
+
+    The number of additional model threads that handle read only requests,
+    such as counting and fetching the rows of a table view, so a slow query
+    in one view does not block the other views.  Defaults to 0, in which
+    case all requests are handled by the model thread.
+    
 When the same action is returned in the :meth:`get_toolbar_actions` and 
 :meth:`get_main_menu` method, it should be exactly the same object, to avoid
 shortcut confusion and reduce the number of status updates.
@@ -121,6 +128,7 @@ shortcut confusion and reduce the number of status updates.
     actions_changed_signal = QtCore.pyqtSignal()
 
     database_selection = False
+    worker_threads = 0
 
     #
     # actions that will be shared between the toolbar and the main menu
@@ -143,7 +151,9 @@ shortcut confusion and reduce the number of status updates.
                              application_action.Refresh(),
                              form_action.ShowHistory() ]
     hidden_actions = [ application_action.DumpState(),
-                       application_action.RuntimeInfo() ]
+                       application_action.RuntimeInfo(),
+                       application_action.TaskStatistics(),
+                       application_action.ExportTaskStatistics() ]
     
     def __init__(self):
         """Construct an ApplicationAdmin object and register it as the 
@@ -205,6 +215,17 @@ shortcut confusion and reduce the number of status updates.
             self._memento = SqlMemento()
         return self._memento
         
+    def get_notification_backend( self ):
+        """Returns the backend through which the changes made to the database
+        are exchanged with other instances of the application, to keep their
+        views up to date.  This method is called when the application starts.
+        Overwrite this method to return for example a
+        :class:`camelot.view.remote_signals.UdpNotificationBackend`.
+        
+        :return: `None` or a :class:`camelot.view.remote_signals.NotificationBackend`
+        """
+        return None
+        
     def get_application_admin( self ):
         """Get the :class:`ApplicationAdmin` class of this application, this
         method is here for compatibility with the :class:`ObjectAdmin`
@@ -29,7 +29,8 @@ logger = logging.getLogger('camelot.admin.entity_admin')
 
 from camelot.admin.action.list_action import OpenFormView
 from camelot.admin.object_admin import ObjectAdmin
-from camelot.view.model_thread import post, model_function
+from camelot.view.model_thread import post, model_function, \
+     read_only_model_function
 from camelot.view.utils import to_string
 from camelot.core.memento import memento_change
 from camelot.core.utils import ugettext_lazy, ugettext
@@ -168,7 +169,7 @@ It has additional class attributes that customise its behaviour.
             break
         return sql_attributes
     
-    @model_function
+    @read_only_model_function
     def get_query(self):
         """:return: an sqlalchemy query for all the objects that should be
         displayed in the table or the selection view.  Overwrite this method to
@@ -383,6 +384,25 @@ It has additional class attributes that customise its behaviour.
                     attributes['editable'] = False
             yield attributes
 
+    def get_dynamic_field_attributes_batch(self, objects, field_names):
+        """Evaluates the dynamic field attributes of all objects at once, and
+        makes relational fields not editable for the objects that are not yet
+        persisted, as :meth:`get_dynamic_field_attributes`.
+        """
+        field_names = list(field_names)
+        if self._dynamic_field_attributes_overruled(EntityAdmin):
+            return [list(self.get_dynamic_field_attributes(obj, field_names)) for obj in objects]
+        directions = ('onetomany', 'manytomany' )
+        relational_fields = [i for i, field_name in enumerate(field_names) if \
+                             self.get_field_attributes(field_name).get('direction', False) in directions]
+        objects_attributes = self._evaluate_dynamic_field_attributes(objects, field_names)
+        if relational_fields:
+            for obj, object_attributes in zip(objects, objects_attributes):
+                if not self.is_persistent(obj):
+                    for i in relational_fields:
+                        object_attributes[i]['editable'] = False
+        return objects_attributes
+
     @model_function
     def get_filters( self ):
         """Returns the filters applicable for these entities each filter is
@@ -415,6 +435,7 @@ It has additional class attributes that customise its behaviour.
 
         class SelectQueryTableProxy(QueryTableProxy):
             header_icon = Icon('tango/16x16/emblems/emblem-symbolic-link.png')
+            projected_loading = True
 
         class SelectView(admin.TableView):
             table_model = SelectQueryTableProxy
@@ -639,7 +660,7 @@ It has additional class attributes that customise its behaviour.
             return True
         return False
     
-    @model_function
+    @read_only_model_function
     def is_deleted(self, obj):
         """
         :return: True if the object has been deleted from the persistent
@@ -512,6 +512,59 @@ be specified using the verbose_name attribute.
                         dynamic_field_attributes[name] = return_value
             yield dynamic_field_attributes
 
+    def get_dynamic_field_attributes_batch(self, objects, field_names):
+        """
+        Get the dynamic field attributes of a list of objects at once.  This
+        method is called once for each block of rows fetched for a table
+        view.  The functions to evaluate are looked up only once for each
+        field, instead of once for each object.
+
+        :param objects: a list of objects
+        :param field_names: a list of field names
+        :return: a list with for each object the list of its dynamic field
+            attributes, as returned by :meth:`get_dynamic_field_attributes`
+
+        Reimplement this method to evaluate the dynamic field attributes of
+        all objects with a single query.  If only
+        :meth:`get_dynamic_field_attributes` is reimplemented, that method is
+        called for each object.
+        """
+        field_names = list(field_names)
+        if self._dynamic_field_attributes_overruled(ObjectAdmin):
+            return [list(self.get_dynamic_field_attributes(obj, field_names)) for obj in objects]
+        return self._evaluate_dynamic_field_attributes(objects, field_names)
+
+    def _dynamic_field_attributes_overruled(self, admin_class):
+        """:return: True if get_dynamic_field_attributes is reimplemented in
+        a subclass of admin_class"""
+        method = getattr(type(self).get_dynamic_field_attributes, 'im_func', None)
+        return method is not admin_class.get_dynamic_field_attributes.im_func
+
+    def _evaluate_dynamic_field_attributes(self, objects, field_names):
+        """Evaluate the functions of the dynamic field attributes for each
+        object, as in :meth:`ObjectAdmin.get_dynamic_field_attributes`"""
+        functions = []
+        for field_name in field_names:
+            field_attributes = self.get_field_attributes(field_name)
+            functions.append([(name, value) for name, value in field_attributes.items() if \
+                              name in DYNAMIC_FIELD_ATTRIBUTES and name != 'default' and callable(value)])
+        objects_attributes = []
+        for obj in objects:
+            object_attributes = []
+            for field_functions in functions:
+                dynamic_field_attributes = {}
+                for name, function in field_functions:
+                    return_value = None
+                    try:
+                        return_value = function(obj)
+                    except (ValueError, Exception, RuntimeError, TypeError, NameError), exc:
+                        logger.error(u'error in field_attribute function of %s'%name, exc_info=exc)
+                    finally:
+                        dynamic_field_attributes[name] = return_value
+                object_attributes.append(dynamic_field_attributes)
+            objects_attributes.append(object_attributes)
+        return objects_attributes
+
     def get_field_attributes(self, field_name):
         """
         Get the attributes needed to visualize the field field_name.  This
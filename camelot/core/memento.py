@@ -126,10 +126,12 @@ class SqlMemento( object ):
                                'authentication_id':authentication_id,
                                 } )
         if len( rows ):
+            from camelot.core.orm import Session
             table = self._get_memento_table()
             clause = table.insert( creation_date = func.current_timestamp() )
             try:
-                clause.execute( rows )
+                # within the transaction of the session, if it has begun one
+                Session().execute( clause, rows )
             except exc.DatabaseError, e:
                 LOGGER.error( 'Programming Error, could not flush history', exc_info = e )                
     
@@ -43,7 +43,7 @@ import logging
 LOGGER = logging.getLogger('camelot.core.orm')
 
 from camelot.core.sql import metadata
-from sqlalchemy import orm, event
+from sqlalchemy import orm, event, sql
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import scoped_session, sessionmaker, mapper
 
@@ -122,6 +122,49 @@ Entity = declarative_base( cls = EntityBase,
                            constructor = None,
                            name = 'Entity' )
 
+def primary_key_clause( mapper, primary_keys ):
+    """
+    :param mapper: the mapper of the objects
+    :param primary_keys: a list of primary key tuples
+    :return: a clause that selects the rows with those primary keys
+    """
+    primary_key_columns = mapper.primary_key
+    if len( primary_key_columns ) == 1:
+        return primary_key_columns[0].in_( [ pk[0] for pk in primary_keys ] )
+    return sql.or_( *[ sql.and_( *[ column == value for column, value in zip( primary_key_columns, pk ) ] ) for pk in primary_keys ] )
+
+def refresh_objects( session, identity_class, objects, chunk_size = 500 ):
+    """Reload a group of objects from the database, with a query per chunk
+    of primary keys.  Objects that are no longer found in the database are
+    expunged from the session.
+    
+    :param session: the session of the objects
+    :param identity_class: the class used in the identity keys of the objects
+    :param objects: a dictionary mapping primary key tuples to objects
+    :param chunk_size: the number of objects reloaded with a single query
+    :return: a generator of `(refreshed_objects, expunged_objects)` tuples,
+        one for each chunk of objects
+    """
+    mapper = orm.class_mapper( identity_class )
+    primary_keys = objects.keys()
+    for i in range( 0, len( primary_keys ), chunk_size ):
+        chunk = primary_keys[i:i+chunk_size]
+        query = session.query( identity_class ).filter( primary_key_clause( mapper, chunk ) )
+        refreshed_objects = query.populate_existing().all()
+        found = set( tuple( mapper.primary_key_from_instance( obj ) ) for obj in refreshed_objects )
+        expunged_objects = []
+        for pk in chunk:
+            if pk not in found:
+                #
+                # this object could not be refreshed, it was probably deleted
+                # outside the scope of this session, so assume it is deleted
+                # from the application its point of view
+                #
+                obj = objects[pk]
+                session.expunge( obj )
+                expunged_objects.append( obj )
+        yield refreshed_objects, expunged_objects
+        
 def transaction( original_function ):
     """Decorator to make methods transactional with regard to the session
     of the object on which they are called"""
@@ -140,5 +183,5 @@ __all__ = [ obj.__name__  for obj in [ Entity, EntityBase, EntityMeta,
             belongs_to, has_one, has_many, has_and_belongs_to_many,
             ManyToOne, OneToOne, OneToMany, ManyToMany,
             using_options,
-            setup_all, transaction
+            setup_all, transaction, refresh_objects
             ] ] + ['Session', 'entities']
@@ -26,6 +26,8 @@ Some helper functions and classes related
 to threading issues
 '''
 
+import time
+
 from PyQt4 import QtCore
 
 def synchronized( original_function ):
@@ -46,3 +48,91 @@ def synchronized( original_function ):
 
 
 
+
+class RequestCoalescer( QtCore.QObject ):
+    """Collects requests made within the thread of this object into batches,
+    and handles each batch at once.  A batch is handled when its deadline
+    has passed or when it reaches a maximum size, whatever comes first.
+    
+    The requests themselves are not stored by the coalescer, the caller
+    keeps track of them and handles them in the flush function.
+    
+    :param flush: a function without arguments, called when a batch of 
+        requests should be handled.
+    :param delay: the maximum number of milliseconds between the first
+        request of a batch and its handling.  When `0`, the batch is handled
+        as soon as the events that are already queued have been processed.
+    :param max_batch_size: the number of requests after which the batch is
+        handled immediately.
+    
+    The coalescer keeps counters on the handled batches, available through
+    :meth:`get_counters`.
+    """
+    
+    _flush_signal = QtCore.pyqtSignal()
+    
+    def __init__( self, flush, delay = 0, max_batch_size = 100, parent = None ):
+        super( RequestCoalescer, self ).__init__( parent )
+        self._flush = flush
+        self.delay = delay
+        self.max_batch_size = max_batch_size
+        self._batch_size = 0
+        self._batch_start = None
+        self._timer = None
+        if delay:
+            self._timer = QtCore.QTimer( self )
+            self._timer.setSingleShot( True )
+            self._timer.setInterval( delay )
+            self._timer.timeout.connect( self.flush )
+        else:
+            self._flush_signal.connect( self.flush, QtCore.Qt.QueuedConnection )
+        self.batches = 0
+        self.requests = 0
+        self.largest_batch = 0
+        self.total_latency = 0.0
+        self.maximum_latency = 0.0
+        
+    def request( self, count = 1 ):
+        """Add requests to the current batch
+        :param count: the number of requests to add
+        """
+        if self._batch_size == 0:
+            self._batch_start = time.time()
+            if self._timer != None:
+                self._timer.start()
+            else:
+                self._flush_signal.emit()
+        self._batch_size += count
+        if self._batch_size >= self.max_batch_size:
+            self.flush()
+            
+    @QtCore.pyqtSlot()
+    def flush( self ):
+        """Handle the current batch of requests, if there is one"""
+        if self._timer != None:
+            self._timer.stop()
+        if self._batch_size == 0:
+            return
+        latency = ( time.time() - self._batch_start ) * 1000
+        self.batches += 1
+        self.requests += self._batch_size
+        self.largest_batch = max( self.largest_batch, self._batch_size )
+        self.total_latency += latency
+        self.maximum_latency = max( self.maximum_latency, latency )
+        self._batch_size = 0
+        self._batch_start = None
+        self._flush()
+        
+    def get_counters( self ):
+        """:return: a dictionary with the number of batches and requests
+        handled, the size of the largest batch and the average and maximum
+        time in milliseconds between a first request and the handling of
+        its batch"""
+        average_latency = 0.0
+        if self.batches:
+            average_latency = self.total_latency / self.batches
+        return { 'batches' : self.batches,
+                 'requests' : self.requests,
+                 'largest_batch' : self.largest_batch,
+                 'average_latency' : average_latency,
+                 'maximum_latency' : self.maximum_latency }
@@ -40,6 +40,7 @@ class MockModelContext( object ):
         self.admin = None
         self.mode_name = None
         self.collection_count = 1
+        self.collection_count_estimated = False
         self.selection_count = 1
         
     def get_object( self ):
@@ -51,6 +52,15 @@ class MockModelContext( object ):
     def get_collection( self, yield_per = None ):
         return [self.obj]
 
+    def get_query( self ):
+        return None
+
+    def is_collection_selected( self ):
+        return self.selection_count == self.collection_count
+
+    def is_cached( self, obj ):
+        return True
+
     @property
     def session( self ):
         return orm.object_session( self.obj )
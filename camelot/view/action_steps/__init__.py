@@ -26,7 +26,7 @@ from backup import SelectBackup, SelectRestore
 from change_object import ChangeField, ChangeObject, ChangeObjects
 from gui import ( CloseView, MessageBox, OpenFormView, Refresh, ShowChart, 
                   ShowPixmap )
-from item_view import Sort
+from item_view import RefreshItemView, Sort
 from open_file import ( OpenFile, OpenStream, 
                         OpenString, OpenJinjaTemplate, WordJinjaTemplate )
 from orm import CreateObject, DeleteObject, FlushSession, UpdateObject
@@ -57,6 +57,7 @@ __all__ = [
     PrintJinjaTemplate.__name__,
     PrintPreview.__name__,
     Refresh.__name__,
+    RefreshItemView.__name__,
     SelectBackup.__name__,
     SelectFile.__name__,
     SelectObject.__name__,
@@ -31,6 +31,15 @@ from PyQt4.QtCore import Qt
 
 from camelot.admin.action.base import ActionStep
 
+class RefreshItemView( ActionStep ):
+    """Reload all the rows in the item view, when the rows that changed are
+    not known"""
+    
+    def gui_run( self, gui_context ):
+        if gui_context.item_view != None:
+            model = gui_context.item_view.model()
+            model.refresh()
+
 class Sort( ActionStep ):
     
     def __init__( self, column, order = Qt.AscendingOrder ):
@@ -29,19 +29,25 @@ from PyQt4 import QtCore
 from PyQt4.QtCore import Qt
 
 from camelot.view.art import Icon
-from camelot.view.model_thread import post, object_thread, model_function
+from camelot.view.model_thread import post, post_read_only, object_thread, \
+                                      model_function
 from camelot.view.search import create_entity_search_query_decorator
 from camelot.view.controls.decorated_line_edit import DecoratedLineEdit
 
 from camelot.core.utils import ugettext as _
 from camelot.core.utils import variant_to_pyobject
-from camelot.core.utils import create_constant_function
 
 from customeditor import CustomEditor, set_background_color_palette
 
 import logging
 logger = logging.getLogger('camelot.view.controls.editors.many2oneeditor')
 
+def get_entity( entity, primary_key ):
+    """Get an object by its primary key, in the session of the thread
+    calling this function"""
+    from camelot.core.orm import Session
+    return Session().query( entity ).get( primary_key )
+
 
 class Many2OneEditor( CustomEditor ):
     """Widget for editing many 2 one relations"""
@@ -169,15 +175,18 @@ class Many2OneEditor( CustomEditor ):
         def create_search_completion(text):
             return lambda: self.search_completions(text)
 
-        post(
+        post_read_only(
             create_search_completion(unicode(text)),
-            self.display_search_completions
+            self.display_search_completions,
+            key = ( self, 'search_completions' )
         )
         self.completer.complete()
 
     @model_function
     def search_completions(self, text):
-        """Search for object that match text, to fill the list of completions
+        """Search for object that match text, to fill the list of completions.
+        This search might run in a worker thread, so the object getters
+        load the object again in the session of the thread that calls them.
 
         :return: a list of tuples of (object_representation, object_getter)
         """
@@ -186,7 +195,9 @@ class Many2OneEditor( CustomEditor ):
         )
         if search_decorator:
             sresult = [
-                (unicode(e), create_constant_function(e))
+                (unicode(e), partial(get_entity, 
+                                     self.admin.entity, 
+                                     self.admin.primary_key(e)))
                 for e in search_decorator(self.admin.entity.query).limit(20)
             ]
             return text, sresult
@@ -37,7 +37,7 @@ from camelot.core.utils import variant_to_pyobject, ugettext as _
 from camelot.view.proxy.queryproxy import QueryTableProxy
 from camelot.view.controls.view import AbstractView
 from camelot.view.controls.user_translatable_label import UserTranslatableLabel
-from camelot.view.model_thread import post
+from camelot.view.model_thread import post, post_read_only
 from camelot.view.model_thread import object_thread
 from camelot.view.model_thread import model_function
 from camelot.view import register
@@ -283,9 +283,12 @@ class RowsWidget( QtGui.QLabel ):
         assert object_thread( self )
         self.setFont( self._number_of_rows_font )
 
-    def setNumberOfRows( self, rows ):
+    def setNumberOfRows( self, rows, estimated = False ):
         assert object_thread( self )
-        self.setText( _('(%i rows)')%rows )
+        if estimated:
+            self.setText( _('(at least %i rows)')%rows )
+        else:
+            self.setText( _('(%i rows)')%rows )
 
 class HeaderWidget( QtGui.QWidget ):
     """HeaderWidget for a tableview, containing the title, the search widget,
@@ -381,10 +384,10 @@ class HeaderWidget( QtGui.QWidget ):
         else:
             self._expanded_search.hide()
 
-    def setNumberOfRows( self, rows ):
+    def setNumberOfRows( self, rows, estimated = False ):
         assert object_thread( self )
         if self.number_of_rows:
-            self.number_of_rows.setNumberOfRows( rows )
+            self.number_of_rows.setNumberOfRows( rows, estimated )
     
 class TableView( AbstractView  ):
     """
@@ -577,7 +580,8 @@ class TableView( AbstractView  ):
         def get_filters_and_actions():
             return ( admin.get_filters(), admin.get_list_actions() )
 
-        post( get_filters_and_actions,  self.set_filters_and_actions )
+        # the filter options are only read from the database
+        post_read_only( get_filters_and_actions,  self.set_filters_and_actions )
 
     @QtCore.pyqtSlot()
     def on_keyboard_selection_signal(self):
@@ -590,7 +594,8 @@ class TableView( AbstractView  ):
         logger.debug('tableLayoutChanged')
         model = self.table.model()
         if self.header:
-            self.header.setNumberOfRows( model.rowCount() )
+            self.header.setNumberOfRows( model.rowCount(),
+                                         model.isRowCountEstimated() )
         item_delegate = model.getItemDelegate()
         if item_delegate:
             self.table.setItemDelegate( item_delegate )
@@ -648,7 +653,8 @@ class TableView( AbstractView  ):
             query_getter = lambda:query
             return query_getter
 
-        post( rebuild_query, self._set_query )
+        # a query that is still waiting to be rebuild is outdated
+        post( rebuild_query, self._set_query, key = ( self, 'rebuild_query' ) )
 
     @QtCore.pyqtSlot(str)
     def startSearch( self, text ):
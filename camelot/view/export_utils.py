@@ -0,0 +1,117 @@
+#  ============================================================================
+#
+#  Copyright (C) 2007-2012 Conceptive Engineering bvba. All rights reserved.
+#  www.conceptive.be / project-camelot@conceptive.be
+#
+#  This file is part of the Camelot Library.
+#
+#  This file may be used under the terms of the GNU General Public
+#  License version 2.0 as published by the Free Software Foundation
+#  and appearing in the file license.txt included in the packaging of
+#  this file.  Please review this information to ensure GNU
+#  General Public Licensing requirements will be met.
+#
+#  If you are unsure which license is appropriate for your use, please
+#  visit www.python-camelot.com or contact project-camelot@conceptive.be
+#
+#  This file is provided AS IS with NO WARRANTY OF ANY KIND, INCLUDING THE
+#  WARRANTY OF DESIGN, MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+#  For use of this library in commercial applications, please contact
+#  project-camelot@conceptive.be
+#
+#  ============================================================================
+
+"""Utility classes to export large tables from Camelot, the rows are
+written to the file one at a time, instead of keeping the whole table in
+memory.
+"""
+
+import codecs
+import csv
+import cStringIO
+import datetime
+import logging
+
+logger = logging.getLogger('camelot.view.export_utils')
+
+# see http://docs.python.org/library/csv.html
+class UnicodeWriter( object ):
+    """A CSV writer which will write rows to CSV file "f", which is encoded
+    in the given encoding."""
+
+    def __init__(self, f, dialect=csv.excel, encoding='utf-8', **kwds):
+        self.queue = cStringIO.StringIO()
+        self.writer = csv.writer(self.queue, dialect=dialect, **kwds)
+        self.stream = f
+        self.encoder = codecs.getincrementalencoder(encoding)()
+
+    def writerow( self, row ):
+        self.writer.writerow([s.encode('utf-8') for s in row])
+        data = self.queue.getvalue()
+        data = data.decode('utf-8')
+        data = self.encoder.encode(data)
+        self.stream.write(data)
+        self.queue.truncate(0)
+
+class CsvWriter( object ):
+    """Write rows to a CSV file.
+
+    :param filename: the name of the file to write
+    """
+
+    suffix = '.csv'
+
+    def __init__( self, filename ):
+        self.stream = open( filename, 'wb' )
+        self.writer = UnicodeWriter( self.stream )
+
+    def writerow( self, row ):
+        """:param row: a list with the values of the cells in the row"""
+        values = []
+        for value in row:
+            if value == None:
+                value = u''
+            elif isinstance( value, (datetime.date, datetime.time) ):
+                value = value.isoformat()
+            values.append( unicode( value ) )
+        self.writer.writerow( values )
+
+    def close( self ):
+        self.stream.close()
+
+class XlsxWriter( object ):
+    """Write rows to an xlsx file with the write only workbook of openpyxl,
+    which writes the rows to a temporary file as they are appended.
+
+    :param filename: the name of the file to write
+    """
+
+    suffix = '.xlsx'
+
+    def __init__( self, filename ):
+        from openpyxl import Workbook
+        try:
+            self.workbook = Workbook( write_only = True )
+        except TypeError:
+            # openpyxl versions before 2.0
+            self.workbook = Workbook( optimized_write = True )
+        self.worksheet = self.workbook.create_sheet()
+        self.filename = filename
+
+    def writerow( self, row ):
+        """:param row: a list with the values of the cells in the row"""
+        self.worksheet.append( row )
+
+    def close( self ):
+        self.workbook.save( self.filename )
+
+def get_streaming_writer_class():
+    """:return: :class:`XlsxWriter` if openpyxl is available,
+        :class:`CsvWriter` otherwise"""
+    try:
+        import openpyxl
+        return XlsxWriter
+    except ImportError:
+        logger.info( 'openpyxl not available, export to csv' )
+        return CsvWriter
@@ -0,0 +1,253 @@
+#  ============================================================================
+#
+#  Copyright (C) 2007-2012 Conceptive Engineering bvba. All rights reserved.
+#  www.conceptive.be / project-camelot@conceptive.be
+#
+#  This file is part of the Camelot Library.
+#
+#  This file may be used under the terms of the GNU General Public
+#  License version 2.0 as published by the Free Software Foundation
+#  and appearing in the file license.txt included in the packaging of
+#  this file.  Please review this information to ensure GNU
+#  General Public Licensing requirements will be met.
+#
+#  If you are unsure which license is appropriate for your use, please
+#  visit www.python-camelot.com or contact project-camelot@conceptive.be
+#
+#  This file is provided AS IS with NO WARRANTY OF ANY KIND, INCLUDING THE
+#  WARRANTY OF DESIGN, MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+#  For use of this library in commercial applications, please contact
+#  project-camelot@conceptive.be
+#
+#  ============================================================================
+
+"""Module containing the LRU cache used in the collection proxy to store
+the data that is passed between the model and the gui thread"""
+
+import collections
+import sys
+
+from PyQt4 import QtCore
+
+def estimate_size( value ):
+    """Estimate the memory used by a value stored in the cache.
+    
+    :param value: the value stored in the cache
+    :return: the estimated number of bytes used by the value and the
+        elements it directly contains
+    """
+    size = sys.getsizeof( value, 0 )
+    if isinstance( value, (list, tuple) ):
+        for element in value:
+            size += sys.getsizeof( element, 0 )
+    elif isinstance( value, dict ):
+        for key, element in value.iteritems():
+            size += sys.getsizeof( key, 0 ) + sys.getsizeof( element, 0 )
+    return size
+
+class LruCache(object):
+    """LruCache has the same interface as :class:`camelot.view.fifo.Fifo`, it
+    contains a limited set of copies of row data so the data is always 
+    immediately accessible to the gui thread.
+    
+    When the cache is full, the row that was least recently used is removed
+    from the cache.  Getting the data at a row only marks the row as used,
+    when the row is about to be removed, a marked row gets a second chance
+    and is moved to the end of the cache instead.  So rows the user keeps
+    revisiting remain in the cache, while the gui thread does not reorder the
+    cache each time it displays a row.
+    
+    Adding, getting and deleting data take constant time, removing a row
+    takes a time proportional to the number of rows in the cache.  The cache
+    is protected by a mutex, since the gui thread reads the data while the
+    model thread adds data.
+    """
+    
+    def __init__(self, max_entries, max_size=None):
+        """:param max_entries: the maximum entries that will be stored in the
+        cache, if more data is added, the least recently used data gets removed
+        :param max_size: the maximum number of bytes used by the data in the 
+        cache, as estimated by :func:`estimate_size`, `None` if there is no 
+        such limit.
+        """
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.size = 0
+        self._mutex = QtCore.QMutex()
+        # row : (entity, value, size), ordered from least to most recently used
+        self.data_by_rows = collections.OrderedDict()
+        self.rows_by_entity = dict()
+        # the rows of which the data was read since they were added or moved
+        self.used_rows = set()
+        
+    def __unicode__(self):
+        return u','.join(unicode(e) for e, _v, _s in self.data_by_rows.values())
+    
+    def __str__(self):
+        return 'LruCache of %s rows'%(len(self.data_by_rows))
+    
+    def __len__(self):
+        """The number of rows in the cache"""
+        return len( self.data_by_rows )
+    
+    def rows(self):
+        """
+        :return: a interator of the row numbers for which this cache
+        had data
+        """
+        locker = QtCore.QMutexLocker( self._mutex )
+        try:
+            return self.data_by_rows.keys()
+        finally:
+            locker.unlock()
+    
+    def shallow_copy(self, max_entries):
+        """Copy the cache without the actual data but with the references
+        to which object is stored in which row"""
+        new_cache = LruCache(max_entries, self.max_size)
+        locker = QtCore.QMutexLocker( self._mutex )
+        try:
+            # None is to distinguish between a list of data and no data
+            for row, (entity, _value, _size) in self.data_by_rows.iteritems():
+                new_cache.data_by_rows[row] = (entity, None, 0)
+            new_cache.rows_by_entity = dict( self.rows_by_entity )
+        finally:
+            locker.unlock()
+        return new_cache
+        
+    def add_data(self, row, entity, value):
+        """The entity might already be on another row, and this row
+        might already contain an entity"""
+        size = 0
+        if self.max_size != None:
+            size = estimate_size( value )
+        locker = QtCore.QMutexLocker( self._mutex )
+        try:
+            self._delete_row( row )
+            self._delete_entity( entity )
+            self.data_by_rows[row] = (entity, value, size)
+            self.rows_by_entity[entity] = row
+            self.size += size
+            while len( self.data_by_rows ) > self.max_entries:
+                self._evict( row )
+            if self.max_size != None:
+                # keep at least the data that was just added
+                while self.size > self.max_size and len( self.data_by_rows ) > 1:
+                    self._evict( row )
+        finally:
+            locker.unlock()
+            
+    def _evict(self, added_row):
+        """Remove the least recently used row, rows that were used since
+        they were added or moved, and the row that was just added, are moved
+        to the end of the cache instead"""
+        while True:
+            row = next( iter( self.data_by_rows ) )
+            if row in self.used_rows or row == added_row:
+                self.used_rows.discard( row )
+                self.data_by_rows[row] = self.data_by_rows.pop( row )
+            else:
+                self._delete_row( row )
+                return
+        
+    def _delete_row(self, row):
+        """Remove the data at row, without locking the mutex
+        :return: True if there was data at the row"""
+        try:
+            (entity, _value, size) = self.data_by_rows.pop( row )
+        except KeyError:
+            return False
+        self.size -= size
+        self.used_rows.discard( row )
+        if self.rows_by_entity.get( entity ) == row:
+            del self.rows_by_entity[entity]
+        return True
+    
+    def _delete_entity(self, entity):
+        """Remove the data of entity, without locking the mutex
+        :return: the row at which the entity was stored or None"""
+        row = self.rows_by_entity.get( entity )
+        if row != None:
+            self._delete_row( row )
+        return row
+        
+    def delete_by_row(self, row):
+        """Remove the data and the reference to the object at row"""
+        locker = QtCore.QMutexLocker( self._mutex )
+        try:
+            deleted = self._delete_row( row )
+        finally:
+            locker.unlock()
+        if not deleted:
+            raise KeyError( row )
+        return row
+    
+    def remove_row(self, row):
+        """Remove the data at row, and move the data of the rows after it
+        one row up, as when the row is removed from the table.  The order in
+        which the rows were used is kept.  This takes a time proportional to
+        the number of rows in the cache."""
+        locker = QtCore.QMutexLocker( self._mutex )
+        try:
+            self._delete_row( row )
+            data_by_rows = collections.OrderedDict()
+            for cached_row, entry in self.data_by_rows.iteritems():
+                if cached_row > row:
+                    cached_row -= 1
+                data_by_rows[cached_row] = entry
+                self.rows_by_entity[entry[0]] = cached_row
+            self.data_by_rows = data_by_rows
+            self.used_rows = set( used_row - 1 if used_row > row else used_row
+                                  for used_row in self.used_rows )
+        finally:
+            locker.unlock()
+            
+    def delete_by_entity(self, entity):
+        """Remove everything in the cache related to an entity instance
+        returns the row at which the data was stored if the data was in the
+        cache, return None otherwise"""
+        locker = QtCore.QMutexLocker( self._mutex )
+        try:
+            return self._delete_entity( entity )
+        finally:
+            locker.unlock()
+    
+    def has_data_at_row(self, row):
+        """:return: True if there is data in the cache for the row, False if 
+        there isn't"""
+        locker = QtCore.QMutexLocker( self._mutex )
+        try:
+            entry = self.data_by_rows.get( row )
+        finally:
+            locker.unlock()
+        return entry != None and entry[1] != None
+    
+    def get_data_at_row(self, row):
+        """:return: the data at row, and mark the row as used"""
+        locker = QtCore.QMutexLocker( self._mutex )
+        try:
+            entry = self.data_by_rows.get( row )
+            if entry != None:
+                self.used_rows.add( row )
+        finally:
+            locker.unlock()
+        if entry == None:
+            raise KeyError( row )
+        return entry[1]
+    
+    def get_row_by_entity(self, entity):
+        """:return: the row at which an entity is stored"""
+        locker = QtCore.QMutexLocker( self._mutex )
+        try:
+            return self.rows_by_entity[entity]
+        finally:
+            locker.unlock()
+    
+    def get_entity_at_row(self, row):
+        """:return: the entity that is stored at a row"""
+        locker = QtCore.QMutexLocker( self._mutex )
+        try:
+            return self.data_by_rows[row][0]
+        finally:
+            locker.unlock()
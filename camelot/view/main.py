@@ -103,16 +103,23 @@ class Application( QtCore.QObject ):
 
     def start_model_thread(self):
         """Launch the second thread where the model lives"""
-        from camelot.view.model_thread import get_model_thread, construct_model_thread
-        from camelot.view.remote_signals import construct_signal_handler
+        from camelot.view.model_thread import get_model_thread, construct_model_thread, \
+             construct_worker_threads
+        from camelot.view.remote_signals import construct_signal_handler, \
+             get_signal_handler
         from camelot.core.conf import settings
         from camelot.core.sql import metadata
         metadata.bind = settings.ENGINE()
         construct_model_thread()
         construct_signal_handler()
+        notification_backend = self.application_admin.get_notification_backend()
+        if notification_backend != None:
+            get_signal_handler().set_notification_backend( notification_backend )
         mt = get_model_thread()
         mt.setup_exception_signal.connect( self.initialization_exception )
         mt.start()
+        for worker in construct_worker_threads( self.application_admin.worker_threads ):
+            worker.start()
         #import os
         #from camelot.core.auto_reload import auto_reload
         #auto_reload.addPath( os.getcwd() )
@@ -283,11 +283,13 @@ class MainWindow(QtGui.QMainWindow):
             self.navpane = None
 
     def closeEvent( self, event ):
-        from camelot.view.model_thread import get_model_thread
+        from camelot.view.model_thread import get_model_thread, \
+             stop_worker_threads
         model_thread = get_model_thread()
         self.workspace.close_all_views()
         self.write_settings()
         logger.info( 'closing mainwindow' )
+        stop_worker_threads()
         model_thread.stop()
         super( MainWindow, self ).closeEvent( event )
         QtCore.QCoreApplication.exit(0)
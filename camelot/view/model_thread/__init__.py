@@ -23,6 +23,7 @@
 #  ============================================================================
 
 from functools import wraps
+import itertools
 
 from PyQt4 import QtCore
 
@@ -30,10 +31,22 @@ import logging
 logger = logging.getLogger('camelot.view.model_thread')
 
 _model_thread_ = []
+# the optional pool of model threads for read only requests
+_worker_threads_ = []
+_worker_sequence_ = itertools.count()
 
 # this might be set to False, for unittesting purpose
 verify_threads = True
 
+#
+# The priorities of the requests posted to the model thread, requests with
+# a higher priority are handled before those with a lower priority, requests
+# with the same priority are handled in the order they were posted.
+#
+HIGH_PRIORITY = 0
+NORMAL_PRIORITY = 1
+LOW_PRIORITY = 2
+
 class ModelThreadException(Exception):
     pass
 
@@ -56,20 +69,25 @@ def object_thread( self ):
     """
     return self.thread() == QtCore.QThread.currentThread()
     
+def in_model_thread():
+    """return wether current thread is model thread"""
+    from no_thread_model_thread import NoThreadModelThread
+    current_thread = QtCore.QThread.currentThread()
+    model_thread = get_model_thread()
+    return (current_thread==model_thread) or isinstance(
+        model_thread, (NoThreadModelThread,)
+    )
+
+def in_model_or_worker_thread():
+    """return wether current thread is the model thread or one of the
+    worker threads"""
+    return in_model_thread() or in_worker_thread()
+
 def model_function(original_function):
     """Decorator to ensure a function is only called from within the model
     thread. If this function is called in another thread, an exception will be
     thrown"""
 
-    def in_model_thread():
-        """return wether current thread is model thread"""
-        from no_thread_model_thread import NoThreadModelThread
-        current_thread = QtCore.QThread.currentThread()
-        model_thread = get_model_thread()
-        return (current_thread==model_thread) or isinstance(
-            model_thread, (NoThreadModelThread,)
-        )
-
     @wraps(original_function)
     def wrapper(*args, **kwargs):
         assert (not verify_threads) or in_model_thread()
@@ -77,6 +95,18 @@ def model_function(original_function):
 
     return wrapper
 
+def read_only_model_function(original_function):
+    """Decorator to ensure a function that does not modify any data is only
+    called from within the model thread or one of the worker threads. If 
+    this function is called in another thread, an exception will be thrown"""
+
+    @wraps(original_function)
+    def wrapper(*args, **kwargs):
+        assert (not verify_threads) or in_model_or_worker_thread()
+        return original_function(*args, **kwargs)
+
+    return wrapper
+
 def setup_model():
     """Call the setup_model function in the settings"""
     from camelot.core.conf import settings
@@ -131,7 +161,8 @@ class AbstractModelThread(QtCore.QThread):
     all work is done"""
         pass
 
-    def post(self, request, response=None, exception=None, args=()):
+    def post(self, request, response=None, exception=None, args=(),
+             priority=NORMAL_PRIORITY, key=None):
         """Post a request to the model thread, request should be a function
         that takes no arguments. The request function will be called within the
         model thread. When the request is finished, on first occasion, the
@@ -144,6 +175,18 @@ class AbstractModelThread(QtCore.QThread):
         :param exception: a slot that will be called in case request throws an
         exception
         :param args: arguments with which the request function will be called        
+        :param priority: the priority of the request, `HIGH_PRIORITY` for
+        requests the user is waiting for, such as the data of visible rows,
+        `LOW_PRIORITY` for requests that can be done in the background.
+        Requests with the same priority are handled in the order they were
+        posted, so the edits of a proxy and the rows requested after them,
+        both posted with `HIGH_PRIORITY`, are handled in order.
+        :param key: a hashable object identifying the request, when a new
+        request with the same key is posted before this request is handled,
+        this request is cancelled.
+        
+        A request is cancelled as well when the object of its response slot
+        has been deleted before the request is handled.
         """
         raise NotImplemented
 
@@ -167,8 +210,61 @@ def has_model_thread():
 def get_model_thread():
     return _model_thread_[0]
 
-def post(request, response=None, exception=None, args=()):
+def post(request, response=None, exception=None, args=(),
+         priority=NORMAL_PRIORITY, key=None):
     """Post a request and a response to the default model thread"""
     mt = get_model_thread()
-    mt.post(request, response, exception, args)
+    mt.post(request, response, exception, args, priority, key)
+
+def construct_worker_threads(count, *args, **kwargs):
+    """Construct a pool of model threads for read only requests.  Since the
+    session is scoped per thread, each worker uses its own session.  The
+    workers need to be started after construction.
+    
+    :param count: the number of workers in the pool
+    :return: the list of workers
+    """
+    from signal_slot_model_thread import SignalSlotModelThread
+    kwargs.setdefault('setup_thread', lambda:None)
+    for _i in range(count):
+        _worker_threads_.append(SignalSlotModelThread(*args, **kwargs))
+    return list(_worker_threads_)
+
+def stop_worker_threads():
+    """Stop the worker threads and remove them from the pool"""
+    while len(_worker_threads_):
+        _worker_threads_.pop().stop()
+
+def in_worker_thread():
+    """:return: True if the current thread is one of the worker threads"""
+    return QtCore.QThread.currentThread() in _worker_threads_
+
+def get_worker_thread(affinity=None):
+    """:param affinity: an object of which all read only requests should be
+        handled by the same worker, and thus within the same session, such
+        as the proxy that posts the requests.  If None, the workers take turns.
+    :return: a worker thread, or the default model thread if there is no pool
+    """
+    if not len(_worker_threads_):
+        return get_model_thread()
+    if affinity is None:
+        i = _worker_sequence_.next()
+    else:
+        i = hash(affinity)
+    return _worker_threads_[i % len(_worker_threads_)]
+
+def post_read_only(request, response=None, exception=None, args=(),
+                   priority=NORMAL_PRIORITY, key=None, affinity=None):
+    """Post a request that does not modify any data to a worker thread.
+    Since the worker has its own session, the request should not return
+    objects that are used afterwards in the session of the default
+    model thread.
+    
+    When there are no worker threads, the request is posted to the
+    default model thread.
+    
+    :param affinity: see :func:`get_worker_thread`
+    """
+    mt = get_worker_thread(affinity)
+    mt.post(request, response, exception, args, priority, key)
 
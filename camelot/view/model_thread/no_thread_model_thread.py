@@ -32,6 +32,7 @@ logger = logging.getLogger('camelot.view.model_thread.no_thread_model_thread')
 
 from PyQt4 import QtCore
 from signal_slot_model_thread import AbstractModelThread, setup_model
+from camelot.view.model_thread import NORMAL_PRIORITY
 from camelot.view.controls.exception import register_exception
 
 class NoThreadModelThread( AbstractModelThread ):
@@ -48,7 +49,10 @@ class NoThreadModelThread( AbstractModelThread ):
             exc_info = register_exception(logger, 'Exception when setting up the NoThreadModelThread', e)
             self.setup_exception_signal.emit(exc_info)
 
-    def post( self, request, response = None, exception = None, args=() ):
+    def post( self, request, response = None, exception = None, args=(),
+              priority = NORMAL_PRIORITY, key = None ):
+        """Handle the request immediately, so the priority and key of the
+        request are not used"""
         try:
             result = request(*args)
             response( result )
@@ -26,16 +26,24 @@ Created on Sep 9, 2009
 
 @author: tw55413
 '''
+import collections
+import heapq
+import itertools
 import logging
 import sys
+import time
+import weakref
 logger = logging.getLogger('camelot.view.model_thread.signal_slot_model_thread')
 
 from PyQt4 import QtCore
 
-from camelot.core.utils import pyqt
+from camelot.core.utils import pyqt, is_deleted
 from camelot.core.threading import synchronized
 from camelot.view.model_thread import ( AbstractModelThread, object_thread, 
-                                        setup_model )
+                                        setup_model, NORMAL_PRIORITY )
+from camelot.view.model_thread.task_statistics import ( task_statistics,
+                                                        count_statements,
+                                                        install_statement_counter )
 from camelot.view.controls.exception import register_exception
 
 #
@@ -73,25 +81,72 @@ else:
         
         return new_func
 
+#
+# All Task objects that have not yet been garbage collected
+#
+_live_tasks = weakref.WeakSet()
+
+def count_live_tasks():
+    """:return: the number of :class:`Task` objects that have not yet been
+    garbage collected"""
+    return len( _live_tasks )
+
 class Task(QtCore.QObject):
 
     finished = QtCore.pyqtSignal(object)
     exception = QtCore.pyqtSignal(object)
 
-    def __init__(self, request, name='', args=()):
+    def __init__(self, request, name='', args=(), receiver=None):
+        """:param receiver: the object of the response slot, if this object
+        is deleted, the task is cancelled.  Only a weak reference to the
+        receiver is kept, so a queued task does not keep it alive."""
         QtCore.QObject.__init__(self)
         self._request = request
         self._name = name
         self._args = args
+        self._receiver = None
+        if receiver != None:
+            self._receiver = weakref.ref( receiver )
+        self._cancelled = False
+        self._posted = time.time()
+        _live_tasks.add( self )
 
     def clear(self):
         """clear this tasks references to other objects"""
         self._request = None
         self._name = None
         self._args = None
+        self._receiver = None
+
+    def cancel(self):
+        """Prevent the execution of this task"""
+        self._cancelled = True
+
+    def cancelled(self):
+        """:return: True if the task should no longer be executed"""
+        if self._cancelled:
+            return True
+        if self._receiver == None:
+            return False
+        receiver = self._receiver()
+        return receiver == None or is_deleted( receiver )
 
     def execute(self):
+        if self.cancelled():
+            logger.debug('cancelled %s' % (self._name))
+            return
         logger.debug('executing %s' % (self._name))
+        started = time.time()
+        statements = count_statements()
+        try:
+            self._execute()
+        finally:
+            task_statistics.record_task( self._name,
+                                         started - self._posted,
+                                         time.time() - started,
+                                         count_statements() - statements )
+
+    def _execute(self):
         try:
             result = self._request( *self._args )
             self.finished.emit( result )
@@ -121,9 +176,17 @@ class TaskHandler(QtCore.QObject):
     """A task handler is an object that handles tasks that appear in a queue,
     when its handle_task method is called, it will sequentially handle all tasks
     that are in the queue.
+    
+    Once a task is executed, it is scheduled for deletion in the thread in
+    which it was created, after the signals with its result have been 
+    delivered.  The task handler keeps a reference to the task until it has
+    been deleted.  Tasks done are released in the order they were executed,
+    once more than `max_tasks_done` tasks are kept, all deleted tasks are
+    released.
     """
 
     task_handler_busy_signal = QtCore.pyqtSignal(bool)
+    max_tasks_done = 1000
 
     def __init__(self, queue):
         """:param queue: the queue from which to pop a task when handle_task
@@ -131,7 +194,10 @@ class TaskHandler(QtCore.QObject):
         QtCore.QObject.__init__(self)
         self._mutex = QtCore.QMutex()
         self._queue = queue
-        self._tasks_done = []
+        self._tasks_done = collections.deque()
+        # the number of tasks done above which deleted tasks are looked for
+        # in all tasks done, if larger than max_tasks_done
+        self._sweep_size = 0
         self._busy = False
         logger.debug("TaskHandler created.")
 
@@ -150,19 +216,40 @@ class TaskHandler(QtCore.QObject):
             # we keep track of the tasks done to prevent them being garbage collected
             # apparently when they are garbage collected, they are recycled, but their
             # signal slot connections seem to survive this recycling.
-            # @todo: this should be investigated in more detail, since we are causing
-            #        a deliberate memory leak here
             #
             # not keeping track of the tasks might result in corruption
             #
             # see : http://www.riverbankcomputing.com/pipermail/pyqt/2011-August/030452.html
             #
+            # therefor the task is deleted by the event loop of its thread, 
+            # after the events with its result have been delivered, and only
+            # then it is released.
+            #
             task.clear()
+            task.deleteLater()
             self._tasks_done.append(task)
+            self._release_tasks_done()
             task = self._queue.pop()
         self.task_handler_busy_signal.emit( False )
         self._busy = False
 
+    def _release_tasks_done(self):
+        """Release the tasks done that have been deleted.  A task is never
+        released before it is deleted, since PyQt might recycle it while its
+        signal slot connections are still alive."""
+        tasks_done = self._tasks_done
+        while len(tasks_done) and is_deleted(tasks_done[0]):
+            tasks_done.popleft()
+        if len(tasks_done) > max(self._sweep_size, self.max_tasks_done):
+            # tasks created in another thread might be deleted out of order
+            self._tasks_done = collections.deque(t for t in tasks_done if not is_deleted(t))
+            self._sweep_size = 2 * len(self._tasks_done)
+
+    def count_tasks_done(self):
+        """:return: the number of tasks done that are still referenced by
+        this task handler"""
+        return len(self._tasks_done)
+
 class SignalSlotModelThread( AbstractModelThread ):
     """A model thread implementation that uses signals and slots
     to communicate between the model thread and the gui thread
@@ -180,9 +267,14 @@ class SignalSlotModelThread( AbstractModelThread ):
         be done.
         """
         super(SignalSlotModelThread, self).__init__( setup_thread )
+        install_statement_counter()
         self._task_handler = None
         self._mutex = QtCore.QMutex()
+        # a heap of ( priority, sequence number, key, task ) tuples
         self._request_queue = []
+        self._sequence = itertools.count()
+        # the queued tasks that have a key
+        self._tasks_by_key = dict()
         self._connected = False
         self._setup_busy = True
 
@@ -210,17 +302,21 @@ class SignalSlotModelThread( AbstractModelThread ):
         self.thread_busy_signal.emit( busy_state )
 
     @synchronized
-    def post( self, request, response = None, exception = None, args = () ):
+    def post( self, request, response = None, exception = None, args = (),
+              priority = NORMAL_PRIORITY, key = None ):
         if not self._connected and self._task_handler:
             # creating this connection in the model thread throws QT exceptions
             self.task_available.connect( self._task_handler.handle_task, QtCore.Qt.QueuedConnection )
             self._connected = True
         # response should be a slot method of a QObject
+        receiver = None
         if response:
             name = '%s -> %s.%s'%(request.__name__, response.im_self.__class__.__name__, response.__name__)
+            receiver = response.im_self
         else:
             name = request.__name__
-        task = Task( wrap_none( request ), name = name, args = args )
+        task = Task( wrap_none( request ), name = name, args = args,
+                     receiver = receiver )
         # QObject::connect is a thread safe function
         if response:
             assert response.im_self != None
@@ -233,7 +329,14 @@ class SignalSlotModelThread( AbstractModelThread ):
             task.exception.connect( exception, QtCore.Qt.QueuedConnection )
         # task.moveToThread(self)
         # only put the task in the queue when it is completely set up
-        self._request_queue.append(task)
+        if key != None:
+            superseded_task = self._tasks_by_key.get( key, None )
+            if superseded_task != None:
+                superseded_task.cancel()
+            self._tasks_by_key[key] = task
+        heapq.heappush( self._request_queue, 
+                        ( priority, self._sequence.next(), key, task ) )
+        task_statistics.record_queue_depth( len( self._request_queue ) )
         #print 'task created --->', id(task)
         self.task_available.emit()
 
@@ -244,9 +347,14 @@ class SignalSlotModelThread( AbstractModelThread ):
     
     @synchronized
     def pop( self ):
-        """Pop a task from the queue, return None if the queue is empty"""
+        """Pop the task with the highest priority from the queue, return None
+        if the queue is empty.  Cancelled tasks are returned as well, to be
+        disposed of as tasks that have been executed."""
         if len(self._request_queue):
-            task = self._request_queue.pop(0)
+            _priority, _sequence, key, task = heapq.heappop( self._request_queue )
+            task_statistics.record_queue_depth( len( self._request_queue ) )
+            if key != None and self._tasks_by_key.get( key, None ) is task:
+                del self._tasks_by_key[key]
             return task
 
     @synchronized
@@ -0,0 +1,160 @@
+#  ============================================================================
+#
+#  Copyright (C) 2007-2012 Conceptive Engineering bvba. All rights reserved.
+#  www.conceptive.be / project-camelot@conceptive.be
+#
+#  This file is part of the Camelot Library.
+#
+#  This file may be used under the terms of the GNU General Public
+#  License version 2.0 as published by the Free Software Foundation
+#  and appearing in the file license.txt included in the packaging of
+#  this file.  Please review this information to ensure GNU
+#  General Public Licensing requirements will be met.
+#
+#  If you are unsure which license is appropriate for your use, please
+#  visit www.python-camelot.com or contact project-camelot@conceptive.be
+#
+#  This file is provided AS IS with NO WARRANTY OF ANY KIND, INCLUDING THE
+#  WARRANTY OF DESIGN, MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE.
+#
+#  For use of this library in commercial applications, please contact
+#  project-camelot@conceptive.be
+#
+#  ============================================================================
+"""Instrumentation of the tasks handled by the model threads, to find out
+which requests make the application feel slow.
+"""
+
+import collections
+import json
+import logging
+import threading
+import time
+
+from PyQt4 import QtCore
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('camelot.view.model_thread.task_statistics')
+
+#
+# The number of sql statements executed by each thread
+#
+_statements = threading.local()
+_statement_counter_installed_ = []
+
+def _count_statement( conn, cursor, statement, parameters, context, executemany ):
+    _statements.count = getattr( _statements, 'count', 0 ) + 1
+
+def install_statement_counter():
+    """Count the sql statements executed by each thread, this is done
+    once a model thread is constructed, so applications without one don't
+    pay for the counting"""
+    if not len( _statement_counter_installed_ ):
+        event.listen( Engine, 'before_cursor_execute', _count_statement )
+        _statement_counter_installed_.append( True )
+
+def count_statements():
+    """:return: the number of sql statements executed by the current thread,
+    since :func:`install_statement_counter` was called"""
+    return getattr( _statements, 'count', 0 )
+
+class TaskStatistics( object ):
+    """Collects the time tasks wait in the queue of a model thread, the time
+    needed to execute them and the depth of the queue.
+
+    The class has these attributes :
+
+    * slow_task_threshold : the number of seconds after which the execution
+      of a task is considered slow, slow tasks are logged as a warning
+
+    * max_slow_tasks : the number of slow tasks that is kept
+
+    * max_queue_depths : the number of queue depth samples that is kept
+    """
+
+    slow_task_threshold = 1.0
+    max_slow_tasks = 100
+    max_queue_depths = 1000
+
+    def __init__( self ):
+        self._mutex = QtCore.QMutex()
+        self.clear()
+
+    def clear( self ):
+        """Forget all collected statistics"""
+        locker = QtCore.QMutexLocker( self._mutex )
+        self._tasks = collections.defaultdict( lambda:{ 'count' : 0,
+                                                        'wait_time' : 0.0,
+                                                        'maximum_wait_time' : 0.0,
+                                                        'execution_time' : 0.0,
+                                                        'maximum_execution_time' : 0.0,
+                                                        'statements' : 0 } )
+        self._slow_tasks = collections.deque( maxlen = self.max_slow_tasks )
+        self._queue_depths = collections.deque( maxlen = self.max_queue_depths )
+        locker.unlock()
+
+    def record_queue_depth( self, depth ):
+        """:param depth: the number of tasks in the queue at this moment"""
+        locker = QtCore.QMutexLocker( self._mutex )
+        self._queue_depths.append( ( time.time(), depth ) )
+        locker.unlock()
+
+    def record_task( self, name, wait_time, execution_time, statements ):
+        """Record the handling of a task
+
+        :param name: the name of the task
+        :param wait_time: the seconds the task was waiting in the queue
+        :param execution_time: the seconds needed to execute the task
+        :param statements: the number of sql statements executed by the task
+        """
+        locker = QtCore.QMutexLocker( self._mutex )
+        task = self._tasks[name]
+        task['count'] += 1
+        task['wait_time'] += wait_time
+        task['maximum_wait_time'] = max( task['maximum_wait_time'], wait_time )
+        task['execution_time'] += execution_time
+        task['maximum_execution_time'] = max( task['maximum_execution_time'],
+                                              execution_time )
+        task['statements'] += statements
+        slow = execution_time >= self.slow_task_threshold
+        if slow:
+            self._slow_tasks.append( { 'name' : name,
+                                       'time' : time.time(),
+                                       'wait_time' : wait_time,
+                                       'execution_time' : execution_time,
+                                       'statements' : statements } )
+        locker.unlock()
+        if slow:
+            logger.warn( 'slow task %s : %.3fs, %s statements'%( name,
+                                                                 execution_time,
+                                                                 statements ) )
+
+    def get_statistics( self ):
+        """:return: a dictionary with the collected statistics :
+
+        * tasks : a dictionary with for each task name its count, total and
+          maximum wait time, total and maximum execution time and number of
+          sql statements
+
+        * slow_tasks : a list with the slow tasks, most recent last
+
+        * queue_depths : a list of `(time, depth)` tuples
+        """
+        locker = QtCore.QMutexLocker( self._mutex )
+        statistics = { 'slow_task_threshold' : self.slow_task_threshold,
+                       'tasks' : dict( ( name, dict( task ) ) for name, task in self._tasks.items() ),
+                       'slow_tasks' : list( self._slow_tasks ),
+                       'queue_depths' : list( self._queue_depths ) }
+        locker.unlock()
+        return statistics
+
+    def to_json( self ):
+        """:return: the statistics as a json string, for offline analysis"""
+        return json.dumps( self.get_statistics(), indent = 2, sort_keys = True )
+
+#
+# The statistics of all model threads
+#
+task_statistics = TaskStatistics()
@@ -35,17 +35,20 @@ import logging
 
 logger = logging.getLogger( 'camelot.view.proxy.collection_proxy' )
 
-from PyQt4.QtCore import Qt, QThread
+from PyQt4.QtCore import Qt
 from PyQt4 import QtGui, QtCore
 
+from camelot.core.auto_reload import auto_reload
 from camelot.core.exception import log_programming_error
+from camelot.core.threading import RequestCoalescer
 from camelot.core.utils import is_deleted, variant_to_pyobject
 from camelot.view.art import Icon
-from camelot.view.fifo import Fifo
+from camelot.view.lru import LruCache, estimate_size
 from camelot.view.controls import delegates
 from camelot.view.remote_signals import get_signal_handler
 from camelot.view.model_thread import object_thread, \
-                                      model_function, post
+                                      model_function, read_only_model_function, \
+                                      post, HIGH_PRIORITY, LOW_PRIORITY
 
 from camelot.core.files.storage import StoredImage
 
@@ -83,7 +86,7 @@ class DelayedProxy( object ):
                logger.error( 'could not convert object to unicode', exc_info=e )
         return u''
 
-@model_function
+@read_only_model_function
 def strip_data_from_object( obj, columns ):
     """For every column in columns, get the corresponding value from the
     object.  Getting a value from an object is time consuming, so using
@@ -116,7 +119,34 @@ def strip_data_from_object( obj, columns ):
             row_data.append( field_value )
     return row_data
 
-@model_function
+def format_value( field_data ):
+    """:return: the unicode representation of a value without choices or
+    a unicode_format, as used in :func:`stripped_data_to_unicode`"""
+    if isinstance( field_data, list ):
+        return u'.'.join( [unicode( e ) for e in field_data] )
+    elif isinstance( field_data, datetime.datetime ):
+        # datetime should come before date since datetime is a subtype of date
+        if field_data.year >= 1900:
+            return field_data.strftime( '%d/%m/%Y %H:%M' )
+    elif isinstance( field_data, datetime.date ):
+        if field_data.year >= 1900:
+            return field_data.strftime( '%d/%m/%Y' )
+    elif isinstance( field_data, StoredImage):
+        return field_data.checkout_thumbnail(100, 100)
+    elif field_data != None:
+        return unicode( field_data )
+    return u''
+
+def format_choice( field_data, choices ):
+    """:return: the verbose name of field_data in a list of choices, or
+    field_data itself if it is not in the choices"""
+    unicode_data = field_data
+    for key, value in choices:
+        if key == field_data:
+            unicode_data = value
+    return unicode_data
+
+@read_only_model_function
 def stripped_data_to_unicode( stripped_data, obj, static_field_attributes, dynamic_field_attributes ):
     """Extract for each field in the row data a 'visible' form of
     data"""
@@ -132,23 +162,9 @@ def stripped_data_to_unicode( stripped_data, obj, static_field_attributes, dynam
                 if field_data != None:
                     unicode_data = unicode_format( field_data )
             elif choices:
-                unicode_data = field_data
-                for key, value in choices:
-                    if key == field_data:
-                        unicode_data = value
-            elif isinstance( field_data, list ):
-                unicode_data = u'.'.join( [unicode( e ) for e in field_data] )
-            elif isinstance( field_data, datetime.datetime ):
-                # datetime should come before date since datetime is a subtype of date
-                if field_data.year >= 1900:
-                    unicode_data = field_data.strftime( '%d/%m/%Y %H:%M' )
-            elif isinstance( field_data, datetime.date ):
-                if field_data.year >= 1900:
-                    unicode_data = field_data.strftime( '%d/%m/%Y' )
-            elif isinstance( field_data, StoredImage):
-                unicode_data = field_data.checkout_thumbnail(100, 100)
-            elif field_data != None:
-                unicode_data = unicode( field_data )
+                unicode_data = format_choice( field_data, choices )
+            else:
+                unicode_data = format_value( field_data )
         except (Exception, RuntimeError, TypeError, NameError), e:
             log_programming_error( logger,
                                    "Could not get view data for field '%s' with of object of type %s"%( static_attributes['name'],
@@ -159,6 +175,60 @@ def stripped_data_to_unicode( stripped_data, obj, static_field_attributes, dynam
 
     return row_data
 
+def create_formatter( static_field_attributes, max_memo_size = 1000 ):
+    """Choose, once for each column, how the values in the column should be 
+    represented as unicode, the same way :func:`stripped_data_to_unicode`
+    does for each cell.
+    
+    :param static_field_attributes: the static field attributes of the column
+    :param max_memo_size: the maximum number of formatted dates and datetimes
+        remembered, to format recurring values only once
+    :return: a function that takes a value and its dynamic field attributes,
+        and returns the unicode representation of the value
+    """
+    if 'unicode_format' in static_field_attributes:
+        unicode_format = static_field_attributes['unicode_format']
+        
+        def format_unicode( field_data, dynamic_field_attributes ):
+            if field_data != None:
+                return unicode_format( field_data )
+            return u''
+        
+        return format_unicode
+    
+    static_choices = static_field_attributes.get( 'choices', None )
+    verbose_names = None
+    if static_choices:
+        try:
+            verbose_names = dict( static_choices )
+        except TypeError:
+            pass
+    memo = dict()
+    python_type = static_field_attributes.get( 'python_type', None )
+    memoize = python_type in ( datetime.date, datetime.datetime )
+    
+    def format_field( field_data, dynamic_field_attributes ):
+        choices = dynamic_field_attributes.get( 'choices', static_choices )
+        if choices:
+            if choices is static_choices and verbose_names != None:
+                try:
+                    return verbose_names.get( field_data, field_data )
+                except TypeError:
+                    pass
+            return format_choice( field_data, choices )
+        if memoize:
+            try:
+                return memo[field_data]
+            except KeyError:
+                if len( memo ) >= max_memo_size:
+                    memo.clear()
+                unicode_data = format_value( field_data )
+                memo[field_data] = unicode_data
+                return unicode_data
+        return format_value( field_data )
+    
+    return format_field
+
 from camelot.view.proxy import ValueLoading
 
 class EmptyRowData( object ):
@@ -167,6 +237,134 @@ class EmptyRowData( object ):
 
 empty_row_data = EmptyRowData()
 
+class CachedRow( object ):
+    """The data of a single row in the cache of a :class:`CollectionProxy`,
+    one list per role of the data.
+
+    .. attribute:: edit
+
+        the values of the fields, used for the :attr:`Qt.EditRole`
+
+    .. attribute:: display
+
+        the unicode representation of the values, used for the
+        :attr:`Qt.DisplayRole`
+
+    .. attribute:: attributes
+
+        the dynamic field attributes of the fields
+    """
+
+    __slots__ = ( 'edit', 'display', 'attributes' )
+
+    def __init__( self, edit, display, attributes ):
+        self.edit = edit
+        self.display = display
+        self.attributes = attributes
+
+    def __sizeof__( self ):
+        return object.__sizeof__( self ) + sum( estimate_size( data ) for data in ( self.edit,
+                                                                                    self.display,
+                                                                                    self.attributes ) )
+
+empty_cached_row = CachedRow( empty_row_data, empty_row_data, empty_row_data )
+
+class ColumnPlan( object ):
+    """The columns of a :class:`CollectionProxy`, compiled once when the
+    columns are set, so their field attributes need not be looked up each
+    time a row is put in the cache or displayed.
+
+    :param admin: the admin of the objects in the collection
+    :param columns: a list of `(field_name, field_attributes)` tuples
+
+    .. attribute:: columns
+
+        the columns from which the plan was compiled
+
+    .. attribute:: field_names
+
+        the names of the fields of the columns
+
+    .. attribute:: static_field_attributes
+
+        a list with for each column the field attributes that don't depend
+        on the object, these should not be modified
+    """
+
+    def __init__( self, admin, columns ):
+        self.columns = columns
+        self.field_names = [ c[0] for c in columns ]
+        self.static_field_attributes = list( admin.get_static_field_attributes( self.field_names ) )
+        self._formatters = [ create_formatter( attributes ) for attributes in self.static_field_attributes ]
+        self._getters = []
+        for field_name, field_attributes in columns:
+            getter = field_attributes.get( 'getter', None )
+            if getter == None:
+                log_programming_error( logger,
+                                       "no getter for field '%s'"%field_name )
+            elif field_attributes.get( 'python_type', None ) == list:
+                getter = self._create_collection_getter( field_name,
+                                                         field_attributes['admin'] )
+            self._getters.append( getter )
+
+    @staticmethod
+    def _create_collection_getter( field_name, admin ):
+
+        def collection_getter( obj ):
+            return DelayedProxy( admin,
+                                 lambda: getattr( obj, field_name ),
+                                 admin.get_columns )
+
+        return collection_getter
+
+    @read_only_model_function
+    def get_values( self, obj ):
+        """Get the value of each column from an object, as 
+        :func:`strip_data_from_object` does.
+        :return: a list with the value of each column
+        """
+        row_data = []
+        for field_name, getter in zip( self.field_names, self._getters ):
+            field_value = None
+            try:
+                if getter != None:
+                    field_value = getter( obj )
+            except (Exception, RuntimeError, TypeError, NameError), e:
+                message = "could not get field '%s' of object of type %s"%(field_name, obj.__class__.__name__)
+                log_programming_error( logger, 
+                                       message,
+                                       exc_info = e )
+            finally:
+                row_data.append( field_value )
+        return row_data
+
+    @read_only_model_function
+    def format_rows( self, rows, objects, dynamic_field_attributes ):
+        """Represent the values of a block of rows as unicode, column by
+        column.
+        
+        :param rows: a list with for each row the values of its columns
+        :param objects: a list with the object of each row
+        :param dynamic_field_attributes: a list with for each row the
+            dynamic field attributes of its columns
+        :return: a list with for each row the unicode representation of the
+            values of its columns
+        """
+        unicode_rows = [ [] for _row in rows ]
+        for i, formatter in enumerate( self._formatters ):
+            for row_data, obj, row_attributes, unicode_row_data in zip( rows, objects, dynamic_field_attributes, unicode_rows ):
+                unicode_data = u''
+                try:
+                    unicode_data = formatter( row_data[i], row_attributes[i] )
+                except (Exception, RuntimeError, TypeError, NameError), e:
+                    log_programming_error( logger,
+                                           "Could not get view data for field '%s' with of object of type %s"%( self.static_field_attributes[i]['name'],
+                                                                                                                obj.__class__.__name__),
+                                           exc_info = e )
+                finally:
+                    unicode_row_data.append( unicode_data )
+        return unicode_rows
+
 class SortingRowMapper( dict ):
     """Class mapping rows of a collection 1:1 without sorting
     and filtering, unless a mapping has been defined explicitly"""
@@ -186,6 +384,13 @@ class CollectionProxy( QtGui.QProxyModel ):
 
     * header_icon : the icon to be used in the vertical header
 
+    * max_cache_size : the maximum number of bytes used by the cache, None
+      if only the number of rows in the cache is limited
+
+    * prefetch_screens : the maximum number of screens of rows that are
+      fetched ahead in the direction the user is scrolling, 0 to disable
+      fetching ahead
+
     """
 
     _header_font = QtGui.QApplication.font()
@@ -193,9 +398,12 @@ class CollectionProxy( QtGui.QProxyModel ):
     _header_font_required.setBold( True )
 
     header_icon = Icon( 'tango/16x16/places/folder.png' )
+    max_cache_size = None
+    prefetch_screens = 2
 
     item_delegate_changed_signal = QtCore.pyqtSignal()
     row_changed_signal = QtCore.pyqtSignal(int)
+    rows_changed_signal = QtCore.pyqtSignal(int, int)
     exception_signal = QtCore.pyqtSignal(object)
     rows_removed_signal = QtCore.pyqtSignal()
     
@@ -203,6 +411,9 @@ class CollectionProxy( QtGui.QProxyModel ):
     # thread signals
     _rows_about_to_be_inserted_signal = QtCore.pyqtSignal( int, int )
     _rows_inserted_signal = QtCore.pyqtSignal( int, int )
+    _rows_about_to_be_removed_signal = QtCore.pyqtSignal( int, int )
+    _rows_removed_signal = QtCore.pyqtSignal( int, int )
+    _refresh_signal = QtCore.pyqtSignal()
 
     def __init__( self, 
                   admin, 
@@ -245,6 +456,9 @@ position in the query.
         self.logger = logging.getLogger(logger.name + '.%s'%id(self))
         self.logger.debug('initialize query table for %s' % (admin.get_verbose_name()))
         self._mutex = QtCore.QMutex()
+        # the number of rows removed with remove_object, rows loaded before
+        # a removal should not be stored in the cache after it
+        self._removals = 0
         self.admin = admin
         self.settings = self.admin.get_settings()
         self._horizontal_header_height = QtGui.QFontMetrics( self._header_font_required ).height() + 10
@@ -264,45 +478,55 @@ position in the query.
         self.mt = get_model_thread()
         # Set database connection and load data
         self._rows = 0
+        self._row_count_estimated = False
         self._columns = []
-        self._static_field_attributes = []
+        self._columns_getter = columns_getter
+        self._column_plan = ColumnPlan( admin, [] )
         self._max_number_of_rows = max_number_of_rows
         max_cache = 10 * self.max_number_of_rows
         if cache_collection_proxy:
-            cached_entries = len( cache_collection_proxy.display_cache )
+            cached_entries = len( cache_collection_proxy.cache )
             max_cache = max( cached_entries, max_cache )
-            self.display_cache = cache_collection_proxy.display_cache.shallow_copy( max_cache )
-            self.edit_cache = cache_collection_proxy.edit_cache.shallow_copy( max_cache )
-            self.attributes_cache = cache_collection_proxy.attributes_cache.shallow_copy( max_cache )
+            self.cache = cache_collection_proxy.cache.shallow_copy( max_cache )
         else:        
-            self.display_cache = Fifo( max_cache )
-            self.edit_cache = Fifo( max_cache )
-            self.attributes_cache = Fifo( max_cache )
+            self.cache = self._create_cache( max_cache )
         # The rows in the table for which a cache refill is under request
         self.rows_under_request = set()
+        # The last range of rows requested and the direction and distance
+        # of scrolling compared with the range requested before
+        self._requested_range = None
+        self._scroll_direction = 0
+        self._scroll_distance = 0
         self._update_requests = list()
+        # Requests for rows and updates are handled in batches by the
+        # model thread
+        self._row_requests = RequestCoalescer( self._post_row_requests,
+                                               parent = self )
+        self._update_request_batches = RequestCoalescer( self._post_update_requests,
+                                                         parent = self )
         # The rows that have unflushed changes
         self.unflushed_rows = set()
         self._sort_and_filter = SortingRowMapper()
         self.row_changed_signal.connect( self._emit_changes )
+        self.rows_changed_signal.connect( self._emit_rows_changes )
         self._rows_about_to_be_inserted_signal.connect( self._rows_about_to_be_inserted, Qt.QueuedConnection )
         self._rows_inserted_signal.connect( self._rows_inserted, Qt.QueuedConnection )
+        self._rows_about_to_be_removed_signal.connect( self._rows_about_to_be_removed, Qt.QueuedConnection )
+        self._rows_removed_signal.connect( self._rows_removed, Qt.QueuedConnection )
+        self._refresh_signal.connect( self.refresh, Qt.QueuedConnection )
         self.rsh = get_signal_handler()
-        self.rsh.connect_signals( self )
+        self.rsh.connect_signals( self, self.admin.entity )
 
-        def get_columns():
-            self._columns = columns_getter()
-            self._static_field_attributes = list(self.admin.get_static_field_attributes([c[0] for c in self._columns]))
-            return self._columns
-
-        post( get_columns, self.setColumns )
+        self._post( self._get_columns, self.setColumns )
+        # the field attributes change when the source code is reloaded
+        auto_reload.reload.connect( self._reload_columns )
 #    # the initial collection might contain unflushed rows
-        post( self._update_unflushed_rows )
+        self._post( self._update_unflushed_rows )
 #    # in that way the number of rows is requested as well
         if cache_collection_proxy:
             self.setRowCount( cache_collection_proxy.rowCount() )
         else:
-            post( self.getRowCount, self.setRowCount )
+            self._post_request( self.getEstimatedRowCount, self.setRowCount )
         self.logger.debug( 'initialization finished' )
 
     #
@@ -368,6 +592,10 @@ position in the query.
     def get_validator(self):
         return self.validator
 
+    def _create_cache(self, max_entries):
+        """:return: an empty cache to store :class:`CachedRow` objects"""
+        return LruCache( max_entries, self.max_cache_size )
+
     def map_to_source(self, sorted_row_number):
         """Converts a sorted row number to a row number of the source
         collection"""
@@ -389,24 +617,46 @@ position in the query.
         self.logger.debug( 'hasUnflushed rows : %s' % has_unflushed_rows )
         return has_unflushed_rows
 
-    @model_function
+    @read_only_model_function
     def getRowCount( self ):
         # make sure we don't count an object twice if it is twice
         # in the list, since this will drive the cache nuts
         rows = len( set( self.get_collection() ) )
         return rows
 
+    @read_only_model_function
+    def getEstimatedRowCount( self ):
+        """The number of rows to display when the collection is shown or
+        refreshed.  Reimplement this method to return a cheap estimate of
+        the number of rows, and count the exact number of rows in the 
+        background.  By default the exact number of rows is returned.
+        """
+        return self.getRowCount()
+
+    def isRowCountEstimated( self ):
+        """:return: True if the number of rows is an estimate, while the
+        exact number of rows is being counted"""
+        locker = QtCore.QMutexLocker( self._mutex )
+        row_count_estimated = self._row_count_estimated
+        locker.unlock()
+        return row_count_estimated
+
+    @QtCore.pyqtSlot()
     def refresh( self ):
         assert object_thread( self )
-        post( self.getRowCount, self._refresh_content )
+        self._post_request( self.getEstimatedRowCount, self._refresh_content, 
+                            key = ( self, 'refresh' ) )
+
+    def post_refresh( self ):
+        """Reload all rows when the gui thread handles its events, this
+        method can be called from any thread"""
+        self._refresh_signal.emit()
 
     @QtCore.pyqtSlot(int)
     def _refresh_content(self, rows ):
         assert object_thread( self )
         locker = QtCore.QMutexLocker(self._mutex)
-        self.display_cache = Fifo( 10 * self.max_number_of_rows )
-        self.edit_cache = Fifo( 10 * self.max_number_of_rows )
-        self.attributes_cache = Fifo( 10 * self.max_number_of_rows )
+        self.cache = self._create_cache( 10 * self.max_number_of_rows )
         self.rows_under_request = set()
         self.unflushed_rows = set()
         # once the cache has been cleared, no updates ought to be accepted
@@ -423,46 +673,123 @@ position in the query.
     def get_collection( self ):
         return self._collection_getter()
 
+    @model_function
+    def get_query( self ):
+        """:return: the query of which the rows are displayed, None since
+            the rows are the objects of a collection"""
+        return None
+
+    @model_function
+    def get_windows( self, yield_per, offset = 0, limit = None, release = True ):
+        """Generator over the objects in the collection, one window of objects
+        at a time.
+
+        :param yield_per: the maximum number of objects in a window
+        :param offset: the row of the first object
+        :param limit: the maximum number of objects, None for all objects 
+            starting at offset
+        :param release: False if the objects should remain in the session,
+            the objects of a collection are never released, since the
+            collection refers to them.
+        :return: a generator of lists of objects
+        """
+        collection = self.get_collection()
+        end = len( collection )
+        if limit != None:
+            end = min( offset + limit, end )
+        for first in range( offset, end, yield_per ):
+            yield collection[first:min( first + yield_per, end )]
+
+    @model_function
+    def get_row_windows( self, first_row, last_row, yield_per = None ):
+        """Generator over the objects displayed in a range of rows, one window
+        of objects at a time.  The objects in the cache are the objects the
+        user sees, so those are used.  The rows that are not in the cache are
+        fetched per run of adjacent rows.
+        
+        :param first_row: the first row of the range
+        :param last_row: the last row of the range, this row is included
+        :param yield_per: the maximum number of objects in a window, if
+            None, the objects are not released once the next window is 
+            requested.
+        :return: a generator of lists of objects
+        """
+        row = first_row
+        window_size = yield_per or ( last_row - first_row + 1 )
+        while row <= last_row:
+            window_rows = range( row, min( row + window_size, last_row + 1 ) )
+            cached_entities = self._get_cached_entities( window_rows )
+            cached_objects = []
+            for window_row in window_rows:
+                if window_row not in cached_entities:
+                    break
+                cached_objects.append( cached_entities[window_row] )
+            if cached_objects:
+                row += len( cached_objects )
+                yield cached_objects
+                continue
+            last_uncached_row = row
+            while last_uncached_row < last_row:
+                try:
+                    self.cache.get_entity_at_row( last_uncached_row + 1 )
+                    break
+                except KeyError:
+                    last_uncached_row += 1
+            for window in self._get_uncached_windows( row, 
+                                                      last_uncached_row, 
+                                                      yield_per ):
+                yield window
+            row = last_uncached_row + 1
+
+    @model_function
+    def _get_uncached_windows( self, first_row, last_row, yield_per ):
+        """Generator over the objects in a range of rows that are not in
+        the cache, see :meth:`get_row_windows`"""
+        collection = self.get_collection()
+        rows = range( first_row, last_row + 1 )
+        window_size = yield_per or len( rows )
+        for i in range( 0, len( rows ), window_size ):
+            yield [ collection[self.map_to_source( row )] for row in rows[i:i+window_size] ]
+
     def handleRowUpdate( self, row ):
         """Handles the update of a row when this row might be out of date"""
         assert object_thread( self )
-        self.display_cache.delete_by_row( row )
-        self.edit_cache.delete_by_row( row )
-        self.attributes_cache.delete_by_row( row )
+        self.cache.delete_by_row( row )
         self.dataChanged.emit( self.index( row, 0 ),
                                self.index( row, self.columnCount() - 1 ) )
 
     @QtCore.pyqtSlot( object, object )
     def handle_entity_update( self, sender, entity ):
         """Handles the entity signal, indicating that the model is out of
-        date"""
+        date.  Deprecated, use :meth:`handle_entities_update`."""
+        self.handle_entities_update( sender, [entity] )
+
+    @QtCore.pyqtSlot( object, object )
+    def handle_entities_update( self, sender, entities ):
+        """Handles the entities signal, indicating that the model is out of
+        date for a list of entities.  The rows of all entities in the cache
+        are updated at once."""
         assert object_thread( self )
-        self.logger.debug( '%s %s received entity update signal' % \
-                     ( self.__class__.__name__, self.admin.get_verbose_name() ) )
-        if sender != self:
+        if sender == self:
+            return
+        rows = []
+        for entity in entities:
             try:
-                row = self.display_cache.get_row_by_entity( entity )
+                row = self.cache.get_row_by_entity( self._cached_entity( entity ) )
             except KeyError:
-                self.logger.debug( 'entity not in cache' )
-                return
-            #
-            # Because the entity is updated, it might no longer be in our
-            # collection, therefore, make sure we don't access the collection
-            # to strip data of the entity
-            #
-            def create_entity_update(row, entity):
-
-                def entity_update():
-                    columns = self._columns
-                    self._add_data(columns, row, entity)
-                    return row
-
-                return entity_update
-
-            post(create_entity_update(row, entity), self._emit_changes)
-        else:
-            self.logger.debug( 'duplicate update' )
-
+                continue
+            rows.append( ( row, entity ) )
+        if not len( rows ):
+            self.logger.debug( 'entities not in cache' )
+            return
+        
+        def entities_update():
+            self._add_rows( self._columns, rows )
+            self._rows_changed( min( row for row, _entity in rows ),
+                                max( row for row, _entity in rows ) )
+            
+        self._post( entities_update )
+        
     @QtCore.pyqtSlot( object, object )
     def handle_entity_delete( self, sender, obj ):
         """Handles the entity signal, indicating that the model is out of
@@ -471,19 +798,11 @@ position in the query.
         self.logger.debug( 'received entity delete signal' )
         if sender != self:
             try:
-                self.display_cache.get_row_by_entity( obj )
+                self.cache.get_row_by_entity( self._cached_entity( obj ) )
             except KeyError:
                 self.logger.debug( 'entity not in cache' )
                 return
-
-            def entity_remove( obj ):
-                self.remove( obj )
-                self.display_cache.delete_by_entity( obj )
-                self.attributes_cache.delete_by_entity( obj )
-                self.edit_cache.delete_by_entity( obj )
-                return self._rows
-
-            post( entity_remove, self._refresh_content, args=(obj,) )
+            self._post( self.remove_object, args=(obj,) )
 
     @QtCore.pyqtSlot( object, object )
     def handle_entity_create( self, sender, entity ):
@@ -501,7 +820,9 @@ position in the query.
         @param rows the new number of rows
         """
         assert object_thread( self )
+        locker = QtCore.QMutexLocker( self._mutex )
         self._rows = rows
+        locker.unlock()
         self.layoutChanged.emit()
 
     def getItemDelegate( self ):
@@ -515,6 +836,22 @@ position in the query.
         """:return: the columns as set by the setColumns method"""
         return self._columns
 
+    @model_function
+    def _get_columns( self ):
+        """:return: the columns, after compiling a new column plan for them"""
+        columns = self._columns_getter()
+        self._set_column_plan( columns )
+        return columns
+
+    @model_function
+    def _set_column_plan( self, columns ):
+        self._columns = columns
+        self._column_plan = ColumnPlan( self.admin, columns )
+
+    @QtCore.pyqtSlot()
+    def _reload_columns( self ):
+        self._post( self._get_columns, self.setColumns )
+
     @QtCore.pyqtSlot(object)
     def setColumns( self, columns ):
         """Callback method to set the columns
@@ -525,6 +862,8 @@ position in the query.
         assert object_thread( self )
         self.logger.debug( 'setColumns' )
         self._columns = columns
+        if self._column_plan.columns is not columns:
+            self._post( self._set_column_plan, args = ( columns, ) )
 
         delegate_manager = delegates.DelegateManager()
         delegate_manager.set_columns_desc( columns )
@@ -634,36 +973,105 @@ position in the query.
         def create_sort(column, order):
 
             def sort():
-                unsorted_collection = [(i,o) for i,o in enumerate(self.get_collection())]
+                collection = self.get_collection()
                 field_name = self._columns[column][0]
-                
-                # handle the case of one of the values being None
-                def compare_none( line_1, line_2 ):
-                    key_1, key_2 = None, None
-                    try:
-                        key_1 = getattr( line_1[1], field_name )
-                    except Exception, e:
-                        logger.error( 'could not get attribute %s from object'%field_name, exc_info = e )
-                    try:
-                        key_2 = getattr( line_2[1], field_name )
-                    except Exception, e:
-                        logger.error( 'could not get attribute %s from object'%field_name, exc_info = e )
-                    if key_1 == None and key_2 == None:
-                        return 0
-                    if key_1 == None:
-                        return -1
-                    if key_2 == None:
-                        return 1
-                    return cmp( key_1, key_2 )
-                    
-                unsorted_collection.sort( cmp = compare_none, reverse = order )
-                for j,(i,_o) in enumerate(unsorted_collection):
+                positions = self._sort_in_database( collection, field_name, order )
+                if positions == None:
+                    positions = self._sort_in_memory( collection, field_name, order )
+                for j, i in enumerate( positions ):
                     self._sort_and_filter[j] = i
-                return len(unsorted_collection)
+                return len( positions )
 
             return sort
 
-        post(create_sort(column, order), self._refresh_content)
+        self._post( create_sort(column, order), self._refresh_content,
+                    key = ( self, 'sort' ) )
+
+    @model_function
+    def _sort_in_database( self, collection, field_name, order ):
+        """Sort a collection that is a query, such as a dynamic relationship,
+        or the list of a relationship of which no object has pending changes,
+        with an order by clause in the database, only the primary keys of the
+        objects are fetched.  As when sorting in memory, NULL values are
+        sorted before all other values.
+        
+        :return: a list with for each sorted row the position of its object in
+            the unsorted collection, or None if the collection cannot be
+            sorted in the database.
+        """
+        from sqlalchemy import orm, sql
+        from sqlalchemy.exc import InvalidRequestError
+        from sqlalchemy.orm.attributes import instance_state
+        mapper = orm.class_mapper( self.admin.entity )
+        try:
+            property = mapper.get_property( field_name )
+        except InvalidRequestError:
+            return None
+        if not isinstance( property, orm.properties.ColumnProperty ):
+            return None
+        primary_key = mapper.primary_key
+        if isinstance( collection, orm.Query ):
+            if collection.session == None:
+                return None
+            query = collection.with_entities( *primary_key )
+            unsorted_keys = query.all()
+            query = query.order_by( None )
+        else:
+            #
+            # the list of a relationship is queried with its parent, this
+            # is only the same list if its objects have no pending changes
+            #
+            adapter = getattr( collection, '_sa_adapter', None )
+            if adapter == None:
+                return None
+            owner = adapter.owner_state.obj()
+            if owner == None or adapter.owner_state.key == None:
+                return None
+            session = orm.object_session( owner )
+            if session == None:
+                return None
+            unsorted_keys = []
+            for obj in collection:
+                state = instance_state( obj )
+                if state.key == None or state.modified:
+                    return None
+                unsorted_keys.append( state.key[1] )
+            query = session.query( self.admin.entity ).with_parent( owner, adapter.attr.key )
+            query = query.with_entities( *primary_key )
+        position_by_key = dict( ( tuple( key ), i ) for i, key in enumerate( unsorted_keys ) )
+        if len( position_by_key ) != len( unsorted_keys ):
+            return None
+        class_attribute = getattr( self.admin.entity, field_name )
+        null_order = sql.case( [ ( class_attribute == None, 0 ) ], else_ = 1 )
+        if order:
+            order_by = [ null_order.desc(), class_attribute.desc() ]
+        else:
+            order_by = [ null_order, class_attribute ]
+        sorted_keys = query.order_by( *( order_by + list( primary_key ) ) ).all()
+        positions = [ position_by_key.get( tuple( key ) ) for key in sorted_keys ]
+        if len( positions ) != len( unsorted_keys ) or None in positions:
+            return None
+        return positions
+
+    @model_function
+    def _sort_in_memory( self, collection, field_name, order ):
+        """Sort a collection in memory, the value of each object is extracted
+        only once and None values are sorted before all other values.
+        
+        :return: a list with for each sorted row the position of its object in
+            the unsorted collection.
+        """
+
+        def sort_key( obj ):
+            value = None
+            try:
+                value = getattr( obj, field_name )
+            except Exception, e:
+                logger.error( 'could not get attribute %s from object'%field_name, exc_info = e )
+            return ( value is not None, value )
+
+        keys = [ sort_key( obj ) for obj in collection ]
+        return sorted( range( len( keys ) ), key = keys.__getitem__, reverse = order )
 
     def data( self, index, role = Qt.DisplayRole):
         """:return: the data at index for the specified role
@@ -686,10 +1094,9 @@ position in the query.
             return QtCore.QVariant()
         if role in (Qt.EditRole, Qt.DisplayRole):
             if role == Qt.EditRole:
-                cache = self.edit_cache
+                data = self._get_row_data( index.row() ).edit
             else:
-                cache = self.display_cache
-            data = self._get_row_data( index.row(), cache )
+                data = self._get_row_data( index.row() ).display
             value = data[index.column()]
             if isinstance( value, DelayedProxy ):
                 value = value()
@@ -710,45 +1117,95 @@ position in the query.
         elif role == Qt.BackgroundRole:
             return QtCore.QVariant(self._get_field_attribute_value(index, 'background_color') or QtCore.QVariant())
         elif role == Qt.UserRole:
-            field_attributes = ProxyDict(self._static_field_attributes[index.column()])
-            dynamic_field_attributes = self._get_row_data( index.row(), self.attributes_cache )[index.column()]
-            if dynamic_field_attributes != ValueLoading:
+            field_attributes = ProxyDict( self._get_static_field_attributes( index.column() ) )
+            dynamic_field_attributes = self._get_row_data( index.row() ).attributes[index.column()]
+            if dynamic_field_attributes != ValueLoading and dynamic_field_attributes:
                 field_attributes.update( dynamic_field_attributes )
             return QtCore.QVariant(field_attributes)
         elif role == Qt.UserRole + 1:
             try:
-                return QtCore.QVariant( self.edit_cache.get_entity_at_row( index.row() ) )
+                return QtCore.QVariant( self.cache.get_entity_at_row( index.row() ) )
             except KeyError:
                 return QtCore.QVariant( ValueLoading )
         return QtCore.QVariant()
 
+    def _get_static_field_attributes( self, column ):
+        """:return: the static field attributes of a column, these should
+        not be modified.  The column plan is compiled in the model thread,
+        until it is compiled for the columns set last, the static field 
+        attributes are taken from the columns themselves."""
+        from camelot.admin.object_admin import DYNAMIC_FIELD_ATTRIBUTES
+        column_plan = self._column_plan
+        if column_plan.columns is self._columns:
+            return column_plan.static_field_attributes[column]
+        if not ( 0 <= column < len( self._columns ) ):
+            return dict()
+        return dict( ( name, value ) for name, value in self._columns[column][1].items()
+                     if name not in DYNAMIC_FIELD_ATTRIBUTES or not callable( value ) )
+
     def _get_field_attribute_value(self, index, field_attribute):
         """Get the values for the static and the dynamic field attributes at once
         :return: the value of the field attribute"""
         try:
-            return self._static_field_attributes[index.column()][field_attribute]
+            return self._get_static_field_attributes( index.column() )[field_attribute]
         except KeyError:
-            value = self._get_row_data( index.row(), self.attributes_cache )[index.column()]
+            value = self._get_row_data( index.row() ).attributes[index.column()]
             if value == ValueLoading:
                 return None
             return value.get(field_attribute, None)
 
+    def get_request_counters( self ):
+        """:return: a dictionary with the counters of the batches of row
+        requests and update requests handled by this proxy, as returned by
+        :meth:`camelot.core.threading.RequestCoalescer.get_counters`"""
+        return { 'rows' : self._row_requests.get_counters(),
+                 'updates' : self._update_request_batches.get_counters() }
+
+    def _post_row_requests( self ):
+        """Post a batch of row requests to the model thread"""
+        self._post_request( self._extend_cache, self._cache_extended )
+
+    def _get_priority( self, background = False ):
+        """The priority of the requests posted by this proxy.  All requests
+        of a proxy get `HIGH_PRIORITY`, since the user is looking at the
+        proxy, so they are handled in the order in which they were posted.
+        Rows requested after an edit, a refresh, a sort or a change of the
+        columns are thus read after it.  Only requests that can be done in the
+        background, such as prefetching rows or counting the exact number of
+        rows, get `LOW_PRIORITY`.
+        
+        :param background: True if the request can be done in the background
+        """
+        if background:
+            return LOW_PRIORITY
+        return HIGH_PRIORITY
+    
+    def _post( self, request, response = None, args = (), key = None ):
+        """Post a request that modifies this proxy or its objects to the 
+        model thread, with the priority of :meth:`_get_priority`"""
+        post( request, response, args = args, priority = self._get_priority(),
+              key = key )
+        
+    def _post_request( self, request, response = None, args = (),
+                       background = False, key = None ):
+        """Post a request that reads the rows of this proxy to the model
+        thread, with the priority of :meth:`_get_priority`.  Requests that
+        modify data should be posted with :meth:`_post`.  Subclasses can
+        overwrite this method to handle these requests in another thread.
+        """
+        post( request, response, args = args, 
+              priority = self._get_priority( background ), key = key )
+
+    def _post_update_requests( self ):
+        """Post a batch of update requests to the model thread"""
+        self._post( self._handle_update_requests )
+
     @model_function
     def _handle_update_requests(self):
         #
-        # wait for a while until the update requests array doesn't change any
-        # more
-        #
-        previous_length = 0
-        locker = QtCore.QMutexLocker(self._mutex)
-        while previous_length != len(self._update_requests):
-            previous_length = len(self._update_requests)
-            locker.unlock()
-            QThread.msleep(5)
-            locker.relock()
-        #
         # Copy the update requests and clear the list of requests
         #
+        locker = QtCore.QMutexLocker(self._mutex)
         update_requests = [u for u in self._update_requests]
         self._update_requests = []
         locker.unlock()
@@ -759,13 +1216,14 @@ position in the query.
         grouped_requests = collections.defaultdict( list )
         for flushed, row, column, value in update_requests:
             grouped_requests[row].append( (flushed, column, value) )
+        #
+        # don't use _get_object, but only update objects which are in the
+        # cache, otherwise it is not sure that the object updated is the
+        # one that was edited
+        #
+        cached_entities = self._get_cached_entities( grouped_requests.keys() )
         for row, request_group in grouped_requests.items():
-            #
-            # don't use _get_object, but only update objects which are in the
-            # cache, otherwise it is not sure that the object updated is the
-            # one that was edited
-            #
-            o = self.edit_cache.get_entity_at_row( row )
+            o = cached_entities.get( row, None )
             if not o:
                 # the object might have been deleted from the collection while the editor
                 # was still open
@@ -873,7 +1331,7 @@ position in the query.
             self.unflushed_rows.add( index.row() )
             self._update_requests.append( (flushed, index.row(), index.column(), value) )
             locker.unlock()
-            post( self._handle_update_requests )
+            self._update_request_batches.request()
 
         return True
 
@@ -886,6 +1344,13 @@ position in the query.
             bottom_right = self.index( row, column_count - 1 )
             self.dataChanged.emit( top_left, bottom_right )
 
+    def _emit_rows_changes( self, first_row, last_row ):
+        assert object_thread( self )
+        column_count = self.columnCount()
+        top_left = self.index( first_row, 0 )
+        bottom_right = self.index( last_row, column_count - 1 )
+        self.dataChanged.emit( top_left, bottom_right )
+
     def flags( self, index ):
         """Returns the item flags for the given index"""
         assert object_thread( self )
@@ -896,61 +1361,149 @@ position in the query.
             flags = flags | Qt.ItemIsDropEnabled
         return flags
 
-    def _add_data(self, columns, row, obj):
+    def _add_data(self, columns, row, obj, emit_changes=True):
         """Add data from object o at a row in the cache
         :param columns: the columns of which to strip data
         :param row: the row in the cache into which to add data
         :param obj: the object from which to strip the data
+        :param emit_changes: emit a signal that the row has changed, set
+            this to `False` when the change of a whole range of rows is
+            signaled at once with :meth:`_rows_changed`
         """
         if not self.admin.is_deleted( obj ):
-            row_data = strip_data_from_object( obj, columns )
-            dynamic_field_attributes = list(self.admin.get_dynamic_field_attributes( obj, (c[0] for c in columns)))
-            static_field_attributes = self.admin.get_static_field_attributes( (c[0] for c in columns) )
-            unicode_row_data = stripped_data_to_unicode( row_data, obj, static_field_attributes, dynamic_field_attributes )
+            column_plan = self._get_column_plan( columns )
+            row_data = column_plan.get_values( obj )
+            dynamic_field_attributes = list(self.admin.get_dynamic_field_attributes( obj, column_plan.field_names ))
+            unicode_row_data = column_plan.format_rows( [row_data], [obj], [dynamic_field_attributes] )[0]
         else:
             row_data = [None] * len(columns)
             dynamic_field_attributes =  [{'editable':False}] * len(columns)
-            static_field_attributes = self.admin.get_static_field_attributes( (c[0] for c in columns) )
             unicode_row_data = [u''] * len(columns)
+        self._store_row( row, obj, CachedRow( row_data,
+                                              unicode_row_data,
+                                              dynamic_field_attributes ),
+                         emit_changes )
+
+    @read_only_model_function
+    def _get_column_plan( self, columns ):
+        """:return: the :class:`ColumnPlan` for columns, this is the plan
+        compiled when the columns were set, unless other columns are
+        requested"""
+        column_plan = self._column_plan
+        if column_plan.columns is not columns:
+            column_plan = ColumnPlan( self.admin, columns )
+        return column_plan
+
+    @model_function
+    def _add_rows( self, columns, rows ):
+        """Add the data of a block of objects in the cache, the dynamic field
+        attributes of all objects in the block are evaluated at once, and
+        the values are formatted column by column.  The change of the rows
+        is not signaled.
+        :param columns: the columns of which to strip data
+        :param rows: a list of `(row, obj)` tuples
+        """
+        for row, obj, cached_row in self._strip_rows( columns, rows ):
+            self._store_row( row, obj, cached_row, False )
+
+    @read_only_model_function
+    def _strip_rows( self, columns, rows ):
+        """Strip the data of a block of objects, without putting it in the
+        cache
+        :param columns: the columns of which to strip data
+        :param rows: a list of `(row, obj)` tuples
+        :return: a list of `(row, obj, cached_row)` tuples, with cached_row
+            a :class:`CachedRow`
+        """
+        column_plan = self._get_column_plan( columns )
+        deleted = [ self.admin.is_deleted( obj ) for _row, obj in rows ]
+        objects = [ obj for (_row, obj), is_deleted in zip( rows, deleted ) if not is_deleted ]
+        attributes = [ list( object_attributes ) for object_attributes in \
+                       self.admin.get_dynamic_field_attributes_batch( objects, column_plan.field_names ) ]
+        values = [ column_plan.get_values( obj ) for obj in objects ]
+        unicode_values = column_plan.format_rows( values, objects, attributes )
+        rows_data = iter( zip( values, unicode_values, attributes ) )
+        stripped_rows = []
+        for (row, obj), is_deleted in zip( rows, deleted ):
+            if is_deleted:
+                stripped_rows.append( ( row, obj, CachedRow( [None] * len( columns ),
+                                                             [u''] * len( columns ),
+                                                             [{'editable':False}] * len( columns ) ) ) )
+            else:
+                stripped_rows.append( ( row, obj, CachedRow( *rows_data.next() ) ) )
+        return stripped_rows
+
+    def _store_row( self, row, obj, cached_row, emit_changes=True ):
+        """Put the data of a row in the cache
+        :param row: the row in the cache into which to add data
+        :param obj: the object displayed in the row
+        :param cached_row: a :class:`CachedRow` with the data of the row
+        :param emit_changes: emit a signal that the row has changed
+        """
         locker = QtCore.QMutexLocker( self._mutex )
-        self.edit_cache.add_data( row, obj, row_data )
-        self.display_cache.add_data( row, obj, unicode_row_data )
-        self.attributes_cache.add_data(row, obj, dynamic_field_attributes )
+        self.cache.add_data( row, obj, cached_row )
         locker.unlock()
         #
         # it might be that the CollectionProxy is deleted on the QT side of
         # the application
         #
-        if not is_deleted( self ):
+        if emit_changes and not is_deleted( self ):
             self.row_changed_signal.emit( row )
 
+    def _rows_changed( self, first_row, last_row ):
+        """Signal the gui that the rows from first_row up to and including
+        last_row have changed."""
+        if last_row >= first_row and not is_deleted( self ):
+            self.rows_changed_signal.emit( first_row, last_row )
+
+    @model_function
+    def _get_cached_entity( self, row ):
+        """:return: the object displayed in a row of the cache, raises a
+        KeyError if the row is not in the cache"""
+        return self._get_cached_entities( [ row ] )[row]
+
+    @model_function
+    def _get_cached_entities( self, rows ):
+        """:param rows: a list of rows
+        :return: a dictionary mapping each of the rows that is in the cache
+            to the object displayed in that row"""
+        entities = dict()
+        for row in rows:
+            try:
+                entities[row] = self.cache.get_entity_at_row( row )
+            except KeyError:
+                pass
+        return entities
+
+    def _cached_entity( self, entity ):
+        """:return: the object under which an entity is stored in the cache,
+        this is the entity itself, unless the cache stores only a reference
+        to the entity"""
+        return entity
+
     def _skip_row(self, row, obj):
         """:return: True if the object obj is already in the cache, but at a
         different row then row.  If this is the case, this object should not
         be put in the cache at row, and this row should be skipped alltogether.
         """
         try:
-            return self.edit_cache.get_row_by_entity(obj)!=row
+            return self.cache.get_row_by_entity(obj)!=row
         except KeyError:
             pass
         return False
 
-    def _offset_and_limit_rows_to_get( self ):
-        """From the current set of rows to get, find the first
-        continuous range of rows that should be fetched.
-        :return: (offset, limit)
+    def _ranges_to_get( self ):
+        """From the current set of rows to get, find all ranges of rows that
+        should be fetched.  Ranges that are separated by less than
+        `max_number_of_rows` rows are merged into a single range, since
+        fetching some additional rows is cheaper than an additional query.
+        :return: a list of (offset, limit) tuples, sorted by offset
         """
-        offset, limit, previous_length, i = 0, 0, 0, 0
         #
-        # wait for a while until the rows under request don't change any
-        # more
+        # the gui thread posts the requests for rows in batches, so
+        # there is no need to wait for more rows to be requested
         #
         locker = QtCore.QMutexLocker(self._mutex)
-        while previous_length != len(self.rows_under_request):
-            previous_length = len(self.rows_under_request)
-            locker.unlock()
-            QThread.msleep(5)
-            locker.relock()
         #
         # now filter out all rows that have been put in the cache
         # the gui thread didn't know about
@@ -958,49 +1511,127 @@ position in the query.
         rows_to_get = self.rows_under_request
         rows_already_there = set()
         for row in rows_to_get:
-            if self.edit_cache.has_data_at_row(row):
+            if self.cache.has_data_at_row(row):
                 rows_already_there.add(row)
         rows_to_get.difference_update( rows_already_there )
-        rows_to_get = list(rows_to_get)
-        locker.unlock()        
-        #
-        # see if there is anything left to do
-        #
-        try:
-            if len(rows_to_get):
-                rows_to_get.sort()
-                offset = rows_to_get[0]
-                #
-                # find first discontinuity
-                #
-                for i in range(offset, rows_to_get[-1]+1):
-                    if rows_to_get[i-offset] != i:
-                        break
-                limit = i - offset + 1
-        except IndexError, e:
-            logger.error('index error with rows_to_get %s'%unicode(rows_to_get), exc_info=e)
-            raise e
-        return (offset, limit)
+        rows_to_get = sorted( rows_to_get )
+        locker.unlock()
+        ranges = []
+        for row in rows_to_get:
+            if ranges and row - ( ranges[-1][0] + ranges[-1][1] ) < self.max_number_of_rows:
+                ranges[-1] = ( ranges[-1][0], row - ranges[-1][0] + 1 )
+            else:
+                ranges.append( ( row, 1 ) )
+        if len( ranges ) == 1:
+            self._track_scrolling( *ranges[0] )
+        elif len( ranges ) > 1:
+            # the user jumps around, or several views are on this proxy,
+            # so there is no direction to fetch ahead in
+            self._requested_range = None
+            self._scroll_direction = 0
+            self._scroll_distance = 0
+        return ranges
+
+    def _track_scrolling( self, offset, limit ):
+        """Keep track of the direction in which and the distance over which
+        the user scrolls, by comparing the requested rows with those requested
+        before.
+        """
+        if self._requested_range != None:
+            distance = offset - self._requested_range[0]
+            self._scroll_direction = cmp( distance, 0 )
+            self._scroll_distance = abs( distance )
+        self._requested_range = ( offset, limit )
+
+    def _prefetch_range( self ):
+        """:return: a tuple (offset, limit) with the rows to fetch ahead of
+        the requested rows, or None if no rows should be fetched ahead.
+
+        The faster the user scrolls, the more rows are fetched ahead, but
+        never more than half of the cache, to keep the requested rows in the
+        cache.
+        """
+        if not ( self.prefetch_screens and self._scroll_direction ):
+            return None
+        offset, limit = self._requested_range
+        screen = max( self.max_number_of_rows, limit )
+        prefetch_rows = min( max( screen, 2 * self._scroll_distance ),
+                             self.prefetch_screens * screen,
+                             self.cache.max_entries / 2 )
+        if self._scroll_direction > 0:
+            first_row = offset + limit
+            last_row = min( first_row + prefetch_rows, self._rows )
+        else:
+            last_row = offset
+            first_row = max( last_row - prefetch_rows, 0 )
+        if last_row <= first_row:
+            return None
+        return ( first_row, last_row - first_row )
+
+    @read_only_model_function
+    def _prefetch( self, offset, limit, direction ):
+        """Fetch rows ahead of the requested rows into the cache, unless the
+        user has changed direction or has already scrolled past these rows.
+        """
+        if direction != self._scroll_direction:
+            return
+        requested_offset, requested_limit = self._requested_range
+        if direction > 0 and requested_offset >= offset + limit:
+            return
+        if direction < 0 and requested_offset + requested_limit <= offset:
+            return
+        rows_to_get = [ row for row in range( offset, offset + limit ) if not self.cache.has_data_at_row( row ) ]
+        if rows_to_get:
+            self._fill_cache( rows_to_get[0], rows_to_get[-1] - rows_to_get[0] + 1 )
+
+    @read_only_model_function
+    def _extend_cache( self ):
+        """Extend the cache around all the ranges of rows under request, and
+        schedule the fetching of rows ahead of the rows under request
+        :return: the list of (offset, limit) ranges that were filled
+        """
+        ranges = self._ranges_to_get()
+        self._fill_ranges( ranges )
+        if ranges:
+            prefetch_range = self._prefetch_range()
+            if prefetch_range != None:
+                self._post_request( self._prefetch, 
+                                    args = prefetch_range + ( self._scroll_direction, ),
+                                    background = True,
+                                    key = ( self, 'prefetch' ) )
+        return ranges
+
+    @read_only_model_function
+    def _fill_ranges( self, ranges ):
+        """Put the data of several ranges of rows in the cache
+        :param ranges: a list of `(offset, limit)` tuples
+        """
+        for offset, limit in ranges:
+            self._fill_cache( offset, limit )
 
     @model_function
-    def _extend_cache( self ):
-        """Extend the cache around the rows under request"""
-        offset, limit = self._offset_and_limit_rows_to_get()
-        if limit:
-            columns = self._columns
-            collection = self.get_collection()
-            skipped_rows = 0
-            for i in range(offset, min(offset + limit + 1, self._rows)):
-                object_found = False
-                while not object_found:
-                    unsorted_row = self._sort_and_filter[i]
-                    obj = collection[unsorted_row+skipped_rows]
-                    if self._skip_row(i, obj):
-                        skipped_rows = skipped_rows + 1
-                    else:
-                        self._add_data(columns, i, obj)
-                        object_found = True
-        return ( offset, limit )
+    def _fill_cache( self, offset, limit ):
+        """Put the data of the rows from offset to offset + limit in the
+        cache"""
+        columns = self._columns
+        collection = self.get_collection()
+        skipped_rows = 0
+        last_row = min(offset + limit + 1, self._rows)
+        # the objects to add, and the row at which they will be added
+        rows, row_by_object = [], dict()
+        for i in range(offset, last_row):
+            object_found = False
+            while not object_found:
+                unsorted_row = self._sort_and_filter[i]
+                obj = collection[unsorted_row+skipped_rows]
+                if self._skip_row(i, obj) or row_by_object.get(obj, i) != i:
+                    skipped_rows = skipped_rows + 1
+                else:
+                    rows.append( (i, obj) )
+                    row_by_object[obj] = i
+                    object_found = True
+        self._add_rows( columns, rows )
+        self._rows_changed( offset, last_row - 1 )
 
     @model_function
     def _get_object( self, sorted_row_number ):
@@ -1010,7 +1641,7 @@ position in the query.
         try:
             # first try to get the primary key out of the cache, if it's not
             # there, query the collection_getter
-            return self.edit_cache.get_entity_at_row( sorted_row_number )
+            return self._get_cached_entity( sorted_row_number )
         except KeyError:
             pass
         try:
@@ -1019,23 +1650,22 @@ position in the query.
             pass
         return None
 
-    @QtCore.pyqtSlot(tuple)
-    def _cache_extended( self, interval ):
-        offset, limit = interval
+    @QtCore.pyqtSlot(object)
+    def _cache_extended( self, ranges ):
         locker = QtCore.QMutexLocker(self._mutex)
-        self.rows_under_request.difference_update( set( range( offset, offset + limit + 1) ) )
+        for offset, limit in ranges:
+            self.rows_under_request.difference_update( set( range( offset, offset + limit + 1) ) )
         locker.unlock()
 
-    def _get_row_data( self, row, cache ):
+    def _get_row_data( self, row ):
         """Get the data which is to be visualized at a certain row of the
         table, if needed, post a refill request the cache to get the object
         and its neighbours in the cache, meanwhile, return an empty object
         :param row: the row of the table for which to get the data
-        :param cache: the cache out of which to get row data
-        :return: row_data
+        :return: a :class:`CachedRow`
         """
         try:
-            data = cache.get_data_at_row( row )
+            data = self.cache.get_data_at_row( row )
             #
             # check if data is None, then the cache was a copy of previous
             # cache, and the data should be refetched
@@ -1048,15 +1678,22 @@ position in the query.
                 locker = QtCore.QMutexLocker(self._mutex)
                 self.rows_under_request.add( row )
                 locker.unlock()
-                post( self._extend_cache, self._cache_extended )
-            return empty_row_data
+                self._row_requests.request()
+            return empty_cached_row
 
     @model_function
     def remove( self, o ):
         collection = self.get_collection()
         if o in collection:
             collection.remove( o )
+            locker = QtCore.QMutexLocker( self._mutex )
             self._rows -= 1
+            locker.unlock()
+
+    @model_function
+    def _in_collection( self, o ):
+        """:return: True if removing o would remove a row"""
+        return o in self.get_collection()
 
     @model_function
     def append( self, o ):
@@ -1072,6 +1709,76 @@ position in the query.
     def _rows_inserted( self, _first, _last ):
         self.endInsertRows()
         
+    @QtCore.pyqtSlot( int, int )
+    def _rows_about_to_be_removed( self, first, last ):
+        self.beginRemoveRows( QtCore.QModelIndex(), first, last )
+        
+    @QtCore.pyqtSlot( int, int )
+    def _rows_removed( self, _first, _last ):
+        self.endRemoveRows()
+        
+    @model_function
+    def is_cached( self, obj ):
+        """:return: True if the row of obj is in the cache"""
+        try:
+            self.cache.get_row_by_entity( self._cached_entity( obj ) )
+        except KeyError:
+            return False
+        return True
+        
+    @model_function
+    def remove_object( self, obj ):
+        """Remove an object from the rows of this proxy, without reloading
+        the other rows.  The data of the rows after the object moves one row
+        up in the cache.  Only when the row of the object is not known, all
+        rows are reloaded.
+        
+        :param obj: the object to remove
+        """
+        try:
+            row = self.cache.get_row_by_entity( self._cached_entity( obj ) )
+        except KeyError:
+            row = None
+        if row == None:
+            rows = self._rows
+            self.remove( obj )
+            if self._rows != rows:
+                self._removals += 1
+                self._refresh_signal.emit()
+            return
+        if not self._in_collection( obj ):
+            return
+        unsorted_row = self._sort_and_filter[row]
+        #
+        # the views should know the row will be removed before the number
+        # of rows changes
+        #
+        self._rows_about_to_be_removed_signal.emit( row, row )
+        self.remove( obj )
+        self._removals += 1
+        locker = QtCore.QMutexLocker( self._mutex )
+        self.cache.remove_row( row )
+        
+        def shift( r ):
+            if r > row:
+                return r - 1
+            return r
+        
+        self.rows_under_request = set( shift( r ) for r in self.rows_under_request if r != row )
+        self.unflushed_rows = set( shift( r ) for r in self.unflushed_rows if r != row )
+        self._update_requests = [ ( flushed, shift( r ), column, value ) for \
+                                  ( flushed, r, column, value ) in self._update_requests if r != row ]
+        locker.unlock()
+        if len( self._sort_and_filter ):
+            sort_and_filter = SortingRowMapper()
+            for sorted_row, source_row in self._sort_and_filter.items():
+                if sorted_row != row:
+                    if source_row > unsorted_row:
+                        source_row -= 1
+                    sort_and_filter[shift( sorted_row )] = source_row
+            self._sort_and_filter = sort_and_filter
+        self._rows_removed_signal.emit( row, row )
+        
     @model_function
     def append_object( self, obj, flush = True ):
         """Append an object to this collection, set the possible defaults and flush
@@ -1097,7 +1804,9 @@ position in the query.
                     pass
         for depending_obj in self.admin.get_depending_objects( obj ):
             self.rsh.sendEntityUpdate( self, depending_obj )
+        locker = QtCore.QMutexLocker( self._mutex )
         self._rows = rows + 1
+        locker.unlock()
         #
         # update the cache, so the object can be retrieved
         #
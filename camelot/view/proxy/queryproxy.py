@@ -24,27 +24,110 @@
 
 """Proxies representing the results of a query"""
 
+import bisect
 import functools
 import logging
 logger = logging.getLogger('camelot.view.proxy.queryproxy')
 
-from collection_proxy import CollectionProxy, strip_data_from_object
-from camelot.view.model_thread import model_function, object_thread, post
+from PyQt4 import QtCore
+
+from collection_proxy import CollectionProxy, CachedRow, \
+     strip_data_from_object
+from camelot.view.proxy import ValueLoading
+from camelot.view.model_thread import model_function, object_thread, \
+                                       read_only_model_function, \
+                                       post_read_only, in_worker_thread
+
+class EntityStub( object ):
+    """Reference to a persistent object by its identity key, used as the
+    object of a row when only the values of the columns of the row have been
+    loaded, instead of the object itself.
+    
+    :param identity_key: the identity key of the object, as returned by
+        :meth:`sqlalchemy.orm.mapper.Mapper.identity_key_from_primary_key`
+    """
+
+    __slots__ = ( 'identity_key', )
+
+    def __init__( self, identity_key ):
+        self.identity_key = identity_key
+
+    @property
+    def primary_key( self ):
+        return self.identity_key[1]
+
+    def __eq__( self, other ):
+        return isinstance( other, EntityStub ) and \
+               self.identity_key == other.identity_key
+
+    def __ne__( self, other ):
+        return not self.__eq__( other )
+
+    def __hash__( self ):
+        return hash( self.identity_key )
+
+    def __unicode__( self ):
+        return u'%s %s'%( self.identity_key[0].__name__,
+                          u','.join( unicode( k ) for k in self.primary_key ) )
 
 class QueryTableProxy(CollectionProxy):
     """The QueryTableProxy contains a limited copy of the data in the SQLAlchemy
     model, which is fetched from the database to be used as the model for a
     QTableView
+
+    the QueryTableProxy has some class attributes that can be overwritten when
+    subclassing it :
+
+    * keyset_pagination : use the values of the sort columns of the last row
+      of a previously fetched range to seek to the next range, instead of
+      letting the database skip all rows before the offset.  This is only
+      possible if all columns used for sorting are not nullable.
+
+    * estimated_row_count_limit : the maximum number of rows counted before
+      the table is displayed.  If the query has more rows, the table is
+      displayed with an estimated number of rows, while the exact number
+      of rows is counted in the background.  None to always count all rows
+      before displaying the table.
+
+    * projected_loading : only select the values of the displayed columns
+      instead of the complete objects, when all columns are plain columns
+      without a custom getter or dynamic field attributes.  The objects
+      themselves are only loaded when they are needed, eg. to open a form
+      or to edit a cell.
+
     """
 
+    keyset_pagination = True
+    estimated_row_count_limit = 1000
+    projected_loading = False
+
     def __init__(self, admin, query_getter, columns_getter,
                  max_number_of_rows=10,
                  cache_collection_proxy=None):
         """@param query_getter: a model_thread function that returns a query, can be None at construction time and set later"""
         logger.debug('initialize query table')
         self._query_getter = query_getter
-        self._sort_decorator = None
         self._mapper = admin.mapper
+        # the default sorting is set before any request is handled, later
+        # sorting is set by the model thread.  the columns used to sort the
+        # query, and the direction of sorting, or None if keyset pagination
+        # is not possible with this sorting
+        self._sort_decorator, self._keyset_columns = self._get_sort_decorator()
+        # the values of the sort columns of the last row of each range
+        # fetched, indexed by row number
+        self._keyset_boundaries = dict()
+        self._keyset_rows = []
+        # the boundaries are set by a worker thread and cleared by the model
+        # thread, each time they are cleared they get a new generation
+        self._keyset_mutex = QtCore.QMutex()
+        self._keyset_generation = 0
+        # the objects of the ranges fetched at once by _fill_ranges, as
+        # a list of (offset, limit, objects) tuples
+        self._fetched_ranges = []
+        # each estimate of the row count gets a new generation, to ignore
+        # exact counts of previous generations
+        self._row_count_generation = 0
+        self._exact_row_count = (None, None)
         #rows appended to the table which have not yet been flushed to the
         #database, and as such cannot be a result of the query
         self._appended_rows = []
@@ -56,11 +139,17 @@ class QueryTableProxy(CollectionProxy):
     def get_query_getter(self):
         if self._query_getter == None:
             return None
-        if self._sort_decorator == None:
-            self._set_sort_decorator()
             
         def sorted_query_getter( query_getter, sort_decorator ):
-            return sort_decorator( query_getter() )
+            query = query_getter()
+            #
+            # the query might have been built in the model thread, a worker
+            # should use the session of its own thread
+            #
+            if in_worker_thread():
+                from camelot.core.orm import Session
+                query = query.with_session( Session() )
+            return sort_decorator( query )
             
         return functools.partial( sorted_query_getter,
                                   self._query_getter,
@@ -70,18 +159,18 @@ class QueryTableProxy(CollectionProxy):
         """Does nothing since all rows returned by a query are flushed"""
         pass
     
-    @model_function
+    @read_only_model_function
     def _clean_appended_rows(self):
-        """Remove those rows from appended rows that have been flushed"""
-        flushed_rows = []
-        for o in self._appended_rows:
-            primary_key = self._mapper.primary_key_from_instance(o)
-            if None not in primary_key:
-                flushed_rows.append(o)
-        for o in flushed_rows:
-            self._appended_rows.remove(o)
+        """Remove those rows from appended rows that have been flushed.  This
+        might be called from a worker thread, so only the state of the
+        objects is used, as their attributes might need to be loaded in the
+        session of the model thread."""
+        from sqlalchemy.orm.attributes import instance_state
+        locker = QtCore.QMutexLocker( self._mutex )
+        self._appended_rows = [ o for o in self._appended_rows if instance_state( o ).key == None ]
+        locker.unlock()
 
-    @model_function
+    @read_only_model_function
     def getRowCount(self):
         self._clean_appended_rows()
         if not self._query_getter:
@@ -89,11 +178,83 @@ class QueryTableProxy(CollectionProxy):
         query = self.get_query_getter()()
         return query.count() + len(self._appended_rows)
 
+    @read_only_model_function
+    def getEstimatedRowCount(self):
+        """Count the rows of the query up to the estimated_row_count_limit.
+        If there are more rows, return this limit and count the exact number
+        of rows in a separate task.
+        """
+        # the row count is requested when the query has changed, so the
+        # boundaries of the previously fetched ranges are no longer valid
+        self._clear_keyset_boundaries()
+        locker = QtCore.QMutexLocker( self._mutex )
+        self._row_count_generation += 1
+        self._row_count_estimated = False
+        generation = self._row_count_generation
+        locker.unlock()
+        limit = self.estimated_row_count_limit
+        if (not self._query_getter) or (limit == None):
+            return self.getRowCount()
+        self._clean_appended_rows()
+        query = self.get_query_getter()()
+        rows = query.limit(limit + 1).count()
+        if rows <= limit:
+            return rows + len(self._appended_rows)
+        self._post_request(self._get_exact_row_count, self._set_exact_row_count, 
+                           args=(generation,), background=True, 
+                           key=(self, 'exact_row_count'))
+        # the exact count might be finished already if the model thread
+        # does not run in a separate thread
+        locker = QtCore.QMutexLocker( self._mutex )
+        try:
+            exact_generation, exact_rows = self._exact_row_count
+            if exact_generation == generation:
+                return exact_rows
+            if generation == self._row_count_generation:
+                self._row_count_estimated = True
+        finally:
+            locker.unlock()
+        return rows + len(self._appended_rows)
+
+    @read_only_model_function
+    def _get_exact_row_count(self, generation):
+        """:return: the exact number of rows, or None if the query has been
+        changed since the count was requested"""
+        locker = QtCore.QMutexLocker( self._mutex )
+        current_generation = self._row_count_generation
+        locker.unlock()
+        if generation != current_generation:
+            return None
+        rows = self.getRowCount()
+        locker = QtCore.QMutexLocker( self._mutex )
+        self._exact_row_count = (generation, rows)
+        locker.unlock()
+        return rows
+
+    @QtCore.pyqtSlot(object)
+    def _set_exact_row_count(self, rows):
+        assert object_thread( self )
+        if rows == None:
+            return
+        locker = QtCore.QMutexLocker( self._mutex )
+        self._row_count_estimated = False
+        locker.unlock()
+        self.setRowCount(rows)
+
     def setQuery(self, query_getter):
         """Set the query and refresh the view"""
         assert object_thread( self )
         self._query_getter = query_getter
         self.refresh()
+
+    @model_function
+    def get_query( self ):
+        """:return: the sorted query of which the rows are displayed, this
+            does not include the rows appended to the query, or None if
+            there is no query"""
+        if not self._query_getter:
+            return None
+        return self.get_query_getter()()
         
     def get_collection(self):
         """In case the collection is requested of a QueryProxy, we will return
@@ -115,6 +276,108 @@ class QueryTableProxy(CollectionProxy):
         if not self._query_getter:
             return []
         return self.get_query_getter()().all()
+
+    @model_function
+    def get_windows( self, yield_per, offset = 0, limit = None, release = True ):
+        """Generator over the objects in the query, one window of objects at a
+        time, to process large queries without loading all objects in the
+        session.
+        
+        When the sorting of the query allows it, the query of each window
+        seeks to the last row of the previous window, instead of skipping
+        all rows before the window.
+        
+        Once the next window is requested, the objects of the previous window
+        are expunged from the session, unless they were in the session before
+        the window was loaded, they have been modified, added or deleted
+        or they are in the cache of this or another proxy.
+        
+        :param yield_per: the maximum number of objects in a window
+        :param offset: the row of the first object
+        :param limit: the maximum number of objects, None for all objects 
+            starting at offset
+        :param release: False if the objects should remain in the session
+        :return: a generator of lists of objects
+        """
+        if not self._query_getter:
+            return
+        query = self.get_query_getter()()
+        keyset_columns = self._keyset_columns
+        if keyset_columns:
+            query = query.add_columns( *[ c for c, _d in keyset_columns ] )
+        key = None
+        while limit == None or limit > 0:
+            window_size = yield_per
+            if limit != None:
+                window_size = min( yield_per, limit )
+            if key != None:
+                window_query = query.filter( self._keyset_clause( key ) )
+            else:
+                window_query = query.offset( offset )
+            # other requests might have loaded objects in the session while
+            # the previous window was processed
+            known_keys = set( query.session.identity_map.keys() )
+            rows = window_query.limit( window_size ).all()
+            if keyset_columns:
+                if rows:
+                    key = tuple( rows[-1][1:] )
+                objects = [ row[0] for row in rows ]
+            else:
+                objects = rows
+            if objects:
+                yield objects
+                if release:
+                    self._release_objects( objects, known_keys )
+            if len( objects ) < window_size:
+                break
+            offset += len( objects )
+            if limit != None:
+                limit -= len( objects )
+
+    @model_function
+    def _get_uncached_windows( self, first_row, last_row, yield_per ):
+        """The rows in the query are fetched with a ranged query, the rows
+        appended after the query are taken from the appended rows"""
+        self._clean_appended_rows()
+        rows_in_query = self._rows - len( self._appended_rows )
+        if first_row < rows_in_query:
+            limit = min( last_row + 1, rows_in_query ) - first_row
+            for window in self.get_windows( yield_per or limit,
+                                            first_row,
+                                            limit,
+                                            release = ( yield_per != None ) ):
+                yield window
+        if last_row >= rows_in_query:
+            first_appended_row = max( first_row, rows_in_query ) - rows_in_query
+            yield self._appended_rows[first_appended_row:last_row - rows_in_query + 1]
+
+    @model_function
+    def _release_objects( self, objects, known_keys ):
+        """Expunge objects that are no longer needed from their session, the
+        objects in the cache of a proxy remain in the session
+        
+        :param objects: the objects to expunge
+        :param known_keys: the identity keys of objects that should remain
+            in the session, because they were not loaded by this proxy
+        """
+        from sqlalchemy import orm
+        from sqlalchemy.orm.attributes import instance_state
+        pending = dict()
+        for obj in objects:
+            state = instance_state( obj )
+            if state.key in known_keys or state.modified:
+                continue
+            proxies = self.rsh.get_subscribers( type( obj ) ) + [ self ]
+            if any( proxy.is_cached( obj ) for proxy in proxies ):
+                continue
+            session = orm.object_session( obj )
+            if session == None:
+                continue
+            if session not in pending:
+                pending[session] = set( id( o ) for o in session.new ).union( 
+                    id( o ) for o in session.deleted )
+            if id( obj ) not in pending[session]:
+                session.expunge( obj )
     
     @model_function
     def _set_sort_decorator( self, column=None, order=None ):
@@ -124,11 +387,23 @@ class QueryTableProxy(CollectionProxy):
         the primary keys of the model.  This to impose a string ordening of
         the rows in the model.
         """
+        sort_decorator, keyset_columns = self._get_sort_decorator( column, order )
+        self._keyset_columns = keyset_columns
+        self._clear_keyset_boundaries()
+        self._sort_decorator = sort_decorator
+        return self._rows
+
+    def _get_sort_decorator( self, column=None, order=None ):
+        """:return: a `(sort_decorator, keyset_columns)` tuple with a function
+        that sorts a query by the given column using the given order, and the
+        columns to use for keyset pagination with this sorting.  This does
+        not modify the proxy, so it can be called in any thread."""
         from sqlalchemy import orm
         from sqlalchemy.exc import InvalidRequestError
         
         class_attributes_to_sort_by, join = [], None
-        mapper = orm.class_mapper(self.admin.entity)
+        keyset_columns = []
+        mapper = self._mapper
         #
         # First sort according the requested column
         #
@@ -169,18 +444,29 @@ class QueryTableProxy(CollectionProxy):
                     class_attributes_to_sort_by.append( class_attribute.desc() )
                 else:
                     class_attributes_to_sort_by.append( class_attribute )
+                keyset_columns.append( ( class_attribute, bool( order ) ) )
                     
         #
         # Next sort according to default sort column if any
         #
         if mapper.order_by:
             class_attributes_to_sort_by.extend( mapper.order_by )
+            keyset_columns.extend( ( c, False ) for c in mapper.order_by )
             
         #
         # In the end, sort according to the primary keys of the model, to enforce
         # a unique order in any case
         #
         class_attributes_to_sort_by.extend( mapper.primary_key )
+        keyset_columns.extend( ( c, False ) for c in mapper.primary_key )
+        
+        #
+        # an outer join might result in NULL values for the sort column
+        #
+        if join:
+            keyset_columns = None
+        else:
+            keyset_columns = self._get_keyset_columns( keyset_columns )
                                 
         def sort_decorator(class_attributes_to_sort_by, join, query):
             if join:
@@ -190,29 +476,147 @@ class QueryTableProxy(CollectionProxy):
             else:
                 return query       
         
-        self._sort_decorator = functools.partial( sort_decorator,
-                                                  class_attributes_to_sort_by, 
-                                                  join )
-        return self._rows
+        return ( functools.partial( sort_decorator,
+                                    class_attributes_to_sort_by, 
+                                    join ),
+                 keyset_columns )
+        
+    def _get_keyset_columns( self, sort_columns ):
+        """Verify if the columns used to sort the query can be used to seek
+        to a range of rows.
+        
+        :param sort_columns: a list of `(column, descending)` tuples with the
+            columns used to sort the query.
+        :return: a list of `(column, descending)` tuples with the sql columns
+            to use for keyset pagination, or `None` if keyset pagination is
+            not possible.
+        """
+        from sqlalchemy import schema, sql
+        from sqlalchemy.orm.attributes import QueryableAttribute
+        if not self.keyset_pagination:
+            return None
+        keyset_columns = []
+        for column, descending in sort_columns:
+            if isinstance( column, sql.expression._UnaryExpression ):
+                if column.modifier == sql.operators.desc_op:
+                    descending = not descending
+                elif column.modifier != sql.operators.asc_op:
+                    return None
+                column = column.element
+            if isinstance( column, QueryableAttribute ):
+                columns = getattr( column.property, 'columns', [] )
+                if len( columns ) != 1:
+                    return None
+                column = columns[0]
+            #
+            # rows with a NULL value in a sort column cannot be found by
+            # comparing the column with the boundary value
+            #
+            if not isinstance( column, schema.Column ) or column.nullable:
+                return None
+            keyset_columns.append( ( column, descending ) )
+        return keyset_columns
+    
+    @read_only_model_function
+    def _clear_keyset_boundaries( self ):
+        """Forget the boundaries of the fetched ranges, they should no longer
+        be used when the query, its sorting or its content has changed."""
+        locker = QtCore.QMutexLocker( self._keyset_mutex )
+        self._keyset_generation += 1
+        self._keyset_boundaries = dict()
+        self._keyset_rows = []
+        locker.unlock()
+        
+    @read_only_model_function
+    def _get_keyset_boundary( self, offset ):
+        """:return: a tuple `(row, key)` with the closest known boundary before
+        offset, `(None, None)` if no such boundary is known"""
+        locker = QtCore.QMutexLocker( self._keyset_mutex )
+        i = bisect.bisect_left( self._keyset_rows, offset )
+        if i > 0:
+            row = self._keyset_rows[i-1]
+            return row, self._keyset_boundaries[row]
+        locker.unlock()
+        return None, None
+    
+    @read_only_model_function
+    def _set_keyset_boundary( self, row, key, generation ):
+        """Store the values of the sort columns at a row, unless the 
+        boundaries were cleared after they got generation"""
+        if None in key:
+            return
+        locker = QtCore.QMutexLocker( self._keyset_mutex )
+        if generation != self._keyset_generation:
+            return
+        if row not in self._keyset_boundaries:
+            bisect.insort( self._keyset_rows, row )
+        self._keyset_boundaries[row] = key
+        locker.unlock()
+        
+    def _keyset_clause( self, key ):
+        """:return: a where clause that selects the rows that sort after the
+        row with values key for the sort columns"""
+        from sqlalchemy import sql
+        clauses = []
+        for i, (column, descending) in enumerate( self._keyset_columns ):
+            conditions = [ c == v for (c, _d), v in zip( self._keyset_columns[:i], key[:i] ) ]
+            if descending:
+                conditions.append( column < key[i] )
+            else:
+                conditions.append( column > key[i] )
+            clauses.append( sql.and_( *conditions ) )
+        return sql.or_( *clauses )
         
     def sort( self, column, order ):
         """Overwrites the :meth:`QAbstractItemModel.sort` method
         """
         assert object_thread( self )
-        post( functools.update_wrapper( functools.partial( self._set_sort_decorator, column, order ), self._set_sort_decorator ), 
-              self._refresh_content )
+        # the sorting is set by the model thread, while the rows are
+        # read by a worker
+        self._post( functools.update_wrapper( functools.partial( self._set_sort_decorator, column, order ), self._set_sort_decorator ), 
+                    self._refresh_content, key = ( self, 'sort' ) )
 
     def append(self, o):
         """Add an object to this collection, used when inserting a new
         row, overwrite this method for specific behaviour in subclasses"""
         primary_key = self._mapper.primary_key_from_instance(o)
         if None in primary_key:
-            self._appended_rows.append(o)
+            locker = QtCore.QMutexLocker( self._mutex )
+            self._appended_rows = self._appended_rows + [o]
+            locker.unlock()
+        self._clear_keyset_boundaries()
 
     def remove(self, o):
         if o in self._appended_rows:
-            self._appended_rows.remove(o)
+            locker = QtCore.QMutexLocker( self._mutex )
+            self._appended_rows = [ a for a in self._appended_rows if a is not o ]
+            locker.unlock()
+        locker = QtCore.QMutexLocker( self._mutex )
         self._rows = self._rows - 1
+        locker.unlock()
+        self._clear_keyset_boundaries()
+
+    @QtCore.pyqtSlot( object, object )
+    def handle_entities_update( self, sender, entities ):
+        """The values of the sort columns of the updated entities might have
+        changed, and with them the rows of the query, so the boundaries of
+        the fetched ranges are forgotten, even when the update was made
+        by this proxy."""
+        self._post( self._clear_keyset_boundaries )
+        super( QueryTableProxy, self ).handle_entities_update( sender, entities )
+        
+    @QtCore.pyqtSlot( object, object )
+    def handle_entity_create( self, sender, entity ):
+        """A created entity might be a row of the query, so the boundaries
+        of the fetched ranges are forgotten."""
+        if isinstance( entity, self._mapper.class_ ):
+            self._post( self._clear_keyset_boundaries )
+        super( QueryTableProxy, self ).handle_entity_create( sender, entity )
+
+    def _in_collection(self, o):
+        """A row is removed for each object removed, since the query
+        is not executed to verify if it contains the object"""
+        return True
 
     @model_function
     def getData(self):
@@ -221,16 +625,256 @@ class QueryTableProxy(CollectionProxy):
             for _i,o in enumerate(self.get_query_getter()().all()):
                 yield strip_data_from_object(o, self._columns)
 
+    @read_only_model_function
+    def _get_range_query( self, offset, limit ):
+        """:return: the query for the rows in a certain range of the 
+        collection, using the closest known keyset boundary before offset"""
+        query = self.get_query_getter()()
+        boundary_row, boundary_key = None, None
+        if self._keyset_columns:
+            boundary_row, boundary_key = self._get_keyset_boundary( offset )
+        if boundary_key != None:
+            query = query.filter( self._keyset_clause( boundary_key ) )
+            return query.offset( offset - boundary_row - 1 ).limit( limit )
+        return query.offset( offset ).limit( limit )
+
+    @read_only_model_function
+    def _get_projected_columns( self ):
+        """:return: a list with the mapped column of each displayed field, 
+        or None if the rows cannot be loaded by selecting these columns only
+        """
+        from sqlalchemy import orm
+        from sqlalchemy.exc import InvalidRequestError
+        from camelot.admin.object_admin import ObjectAdmin, \
+             DYNAMIC_FIELD_ATTRIBUTES
+        from camelot.admin.entity_admin import EntityAdmin
+        if not self.projected_loading or not self._columns:
+            return None
+        if self._mapper.inherits is not None or \
+           self._mapper.polymorphic_on is not None:
+            return None
+        #
+        # the dynamic field attributes can only be evaluated without an
+        # object if they are not customized
+        #
+        for method_name in ( 'get_dynamic_field_attributes',
+                             'get_dynamic_field_attributes_batch' ):
+            dynamic_attributes_function = getattr( getattr( type( self.admin ), method_name ), 'im_func', None )
+            if dynamic_attributes_function not in ( getattr( ObjectAdmin, method_name ).im_func,
+                                                    getattr( EntityAdmin, method_name ).im_func ):
+                return None
+        projected_columns = []
+        for field_name, field_attributes in self._columns:
+            if 'getter' in self.admin.field_attributes.get( field_name, {} ):
+                return None
+            for name, value in field_attributes.items():
+                if name in DYNAMIC_FIELD_ATTRIBUTES and callable( value ):
+                    return None
+            try:
+                property = self._mapper.get_property( field_name )
+            except InvalidRequestError:
+                return None
+            if not isinstance( property, orm.properties.ColumnProperty ):
+                return None
+            if len( property.columns ) != 1:
+                return None
+            projected_columns.append( property.columns[0] )
+        return projected_columns
+
+    @read_only_model_function
+    def _get_projected_range( self, offset, limit, projected_columns ):
+        """Get the values of the projected columns in a certain range of the
+        collection, without loading the objects themselves
+        :return: a list of tuples `(stub, values)`, with stub an 
+            :class:`EntityStub` for the object in the row, and values a list
+            with the value of each projected column
+        """
+        primary_key = list( self._mapper.primary_key )
+        keyset_columns = [ c for c, _d in self._keyset_columns or [] ]
+        generation = self._keyset_generation
+        query = self._get_range_query( offset, limit )
+        query = query.with_entities( *( primary_key + projected_columns + keyset_columns ) )
+        rows = query.all()
+        key_length = len( primary_key )
+        values_length = key_length + len( projected_columns )
+        if rows and keyset_columns:
+            self._set_keyset_boundary( offset + len( rows ) - 1,
+                                       tuple( rows[-1][values_length:] ),
+                                       generation )
+        identity_key = self._mapper.identity_key_from_primary_key
+        return [ ( EntityStub( identity_key( list( row[:key_length] ) ) ),
+                   list( row[key_length:values_length] ) ) for row in rows ]
+
+    @read_only_model_function
+    def _strip_projected_row( self, columns, row, stub, values ):
+        """Format the values of the projected columns of a row, without
+        putting them in the cache
+        :param columns: the columns of which the values were selected
+        :param row: the row in the cache into which to add data
+        :param stub: the :class:`EntityStub` of the object in the row
+        :param values: the values of the columns
+        :return: a `(row, stub, cached_row)` tuple, as returned by
+            :meth:`_strip_rows`
+        """
+        column_plan = self._get_column_plan( columns )
+        dynamic_field_attributes = [ dict() for _c in columns ]
+        unicode_values = column_plan.format_rows( [values], [stub], [dynamic_field_attributes] )[0]
+        return ( row, stub, CachedRow( values,
+                                       unicode_values,
+                                       dynamic_field_attributes ) )
+
+    def _post_request( self, request, response = None, args = (),
+                       background = False, key = None ):
+        """The requests that read the rows of the query are handled by a
+        worker thread, if there is a pool of worker threads.  All requests of
+        this proxy go to the same worker, so they are handled in order."""
+        post_read_only( request, response, args = args, 
+                        priority = self._get_priority( background ),
+                        key = key, affinity = self )
+
+    @model_function
+    def _get_cached_entities( self, rows ):
+        """Load the objects in the rows of which only a stub is in the cache,
+        and replace the stubs with the objects.  Rows of which the object no
+        longer exists are left out."""
+        entities = super( QueryTableProxy, self )._get_cached_entities( rows )
+        stubs = dict( ( row, entity ) for row, entity in entities.items() \
+                      if isinstance( entity, EntityStub ) )
+        if stubs:
+            objects = self._load_stubs( stubs.values() )
+            for row, stub in stubs.items():
+                obj = objects.get( stub.identity_key, None )
+                if obj == None:
+                    del entities[row]
+                    continue
+                self._store_row( row, obj, self.cache.get_data_at_row( row ), False )
+                entities[row] = obj
+        return entities
+
     @model_function
+    def _load_stubs( self, stubs, chunk_size = 500 ):
+        """Load the objects referred to by stubs in the session of the model
+        thread, with a query per chunk of primary keys for the objects that 
+        are not yet in the session.
+        
+        :param stubs: a list of :class:`EntityStub` objects
+        :param chunk_size: the number of objects loaded with a single query
+        :return: a dictionary mapping identity keys to objects, the keys of
+            objects that no longer exist are missing
+        """
+        from sqlalchemy.orm.attributes import instance_state
+        from camelot.core.orm import Session, primary_key_clause
+        session = Session()
+        objects, missing_keys = dict(), []
+        for stub in stubs:
+            obj = session.identity_map.get( stub.identity_key, None )
+            if obj != None:
+                objects[stub.identity_key] = obj
+            else:
+                missing_keys.append( stub.primary_key )
+        for i in range( 0, len( missing_keys ), chunk_size ):
+            clause = primary_key_clause( self._mapper, missing_keys[i:i+chunk_size] )
+            query = session.query( self.admin.entity ).filter( clause )
+            options = self._get_load_options()
+            if options:
+                query = query.options( *options )
+            for obj in query.all():
+                objects[instance_state( obj ).key] = obj
+        return objects
+
+    def _cached_entity( self, entity ):
+        """When an entity is not in the cache, its stub might be"""
+        from sqlalchemy.orm.attributes import instance_state
+        try:
+            self.cache.get_row_by_entity( entity )
+            return entity
+        except KeyError:
+            pass
+        try:
+            identity_key = instance_state( entity ).key
+        except AttributeError:
+            return entity
+        if identity_key == None:
+            return entity
+        return EntityStub( identity_key )
+
+    @read_only_model_function
+    def _get_eager_load_paths( self ):
+        """:return: the paths of the many to one relations that should be
+        loaded together with the objects in the list.  These are the many to
+        one fields in the list, and the many to one relations of the dotted
+        paths in `list_search`.
+        """
+        from sqlalchemy import orm
+        from sqlalchemy.exc import InvalidRequestError
+        paths = []
+        for field_name, field_attributes in self._columns:
+            if field_attributes.get( 'direction' ) == 'manytoone':
+                paths.append( field_name )
+        for search_path in getattr( self.admin, 'list_search', [] ):
+            mapper = self._mapper
+            relations = []
+            for name in search_path.split( '.' )[:-1]:
+                try:
+                    property = mapper.get_property( name )
+                except InvalidRequestError:
+                    break
+                if not isinstance( property, orm.properties.RelationshipProperty ):
+                    break
+                #
+                # to many relations are not displayed, and loading them
+                # would multiply the rows of the query
+                #
+                if property.direction != orm.interfaces.MANYTOONE:
+                    break
+                relations.append( name )
+                mapper = property.mapper
+            if relations:
+                paths.append( '.'.join( relations ) )
+        #
+        # remove the paths that are part of a longer path
+        #
+        paths = set( paths )
+        return sorted( path for path in paths if not [ other for other in paths if other.startswith( path + '.' ) ] )
+
+    @read_only_model_function
     def _get_collection_range( self, offset, limit ):
         """Get the objects in a certain range of the collection
         :return: an iterator over the objects in the collection, starting at 
         offset, until limit
+        
+        If the boundary of a range fetched before is known, the query seeks
+        to that boundary and skips only the rows between the boundary and
+        the offset.
         """
+        for fetched_offset, fetched_limit, objects in self._fetched_ranges:
+            if fetched_offset <= offset and offset + limit <= fetched_offset + fetched_limit:
+                return objects[offset-fetched_offset:offset-fetched_offset+limit]
+        generation = self._keyset_generation
+        query = self._get_range_query( offset, limit )
+        options = self._get_load_options()
+        if options:
+            query = query.options( *options )
+        
+        if not self._keyset_columns:
+            return query.all()
+        #
+        # fetch the values of the sort columns together with the objects, to
+        # be able to seek to the next range
+        #
+        query = query.add_columns( *[ c for c, _d in self._keyset_columns ] )
+        rows = query.all()
+        if rows:
+            self._set_keyset_boundary( offset + len( rows ) - 1, 
+                                       tuple( rows[-1][1:] ), generation )
+        return [ row[0] for row in rows ]
+    
+    @read_only_model_function
+    def _get_load_options( self ):
+        """:return: the query options to load the objects displayed in the
+        list with all the data needed for the list"""
         from sqlalchemy import orm
         from sqlalchemy.exc import InvalidRequestError
-        
-        query = self.get_query_getter()().offset(offset).limit(limit)
         #
         # undefer all columns displayed in the list, to reduce the number
         # of queries
@@ -252,61 +896,231 @@ class QueryTableProxy(CollectionProxy):
             if property and isinstance(property, orm.properties.ColumnProperty):
                 columns_to_undefer.append( field_name )
                 
-        if columns_to_undefer:
-            options = [ orm.undefer( field_name ) for field_name in columns_to_undefer ]
-            query = query.options( *options )
-                
-        return query.all()
+        options = [ orm.undefer( field_name ) for field_name in columns_to_undefer ]
+        #
+        # load the related objects displayed in the list together with the
+        # objects themselves, instead of a query per row
+        #
+        options.extend( orm.joinedload_all( path ) for path in self._get_eager_load_paths() )
+        return options
+    
+    @read_only_model_function
+    def _fill_ranges( self, ranges ):
+        """Put the data of several ranges of rows in the cache.  When there
+        is more than one range, the primary keys of all ranges are selected
+        with a single union query, and the objects not yet in the session
+        are loaded with a single query on their primary keys.  This requires
+        the keyset columns, to sort the rows of the union query."""
+        if len( ranges ) > 1 and self._query_getter and \
+           self._keyset_columns and \
+           len( self._mapper.primary_key ) == 1 and \
+           self._get_projected_columns() == None:
+            self._fetched_ranges = self._get_collection_ranges( ranges )
+        try:
+            super( QueryTableProxy, self )._fill_ranges( ranges )
+        finally:
+            self._fetched_ranges = []
+            
+    @read_only_model_function
+    def _get_collection_ranges( self, ranges ):
+        """Get the objects in several ranges of the collection at once
+        :param ranges: a list of `(offset, limit)` tuples
+        :return: a list of `(offset, limit, objects)` tuples
+        """
+        from sqlalchemy import sql
+        from camelot.core.orm import Session
+        session = Session()
+        mapper = self._mapper
+        primary_key_column = mapper.primary_key[0]
+        keyset_columns = [ c for c, _d in self._keyset_columns ]
+        selected_columns = [ primary_key_column ] + keyset_columns
+        generation = self._keyset_generation
+        #
+        # each range is a subquery, to apply its own order and limit, the
+        # union is sorted on the index of the range and the keyset columns,
+        # since the rows of a union have no order of their own
+        #
+        selects = []
+        for i, (offset, limit) in enumerate( ranges ):
+            range_query = self._get_range_query( offset, limit )
+            range_query = range_query.with_entities( *[ c.label( 'c%i'%j ) for j, c in enumerate( selected_columns ) ] )
+            subquery = range_query.subquery()
+            selects.append( sql.select( [ sql.literal( i ).label( 'range_index' ) ] + list( subquery.c ) ) )
+        order_by = [ sql.literal_column( 'range_index' ) ]
+        for j, (_c, descending) in enumerate( self._keyset_columns ):
+            order_by_column = sql.literal_column( 'c%i'%( j + 1 ) )
+            if descending:
+                order_by_column = order_by_column.desc()
+            order_by.append( order_by_column )
+        keys_by_range = [ [] for _range in ranges ]
+        for row in session.execute( sql.union_all( *selects ).order_by( *order_by ) ):
+            keys_by_range[row[0]].append( tuple( row[1:] ) )
+        #
+        # load the objects that are not yet in the session
+        #
+        objects_by_key = dict()
+        missing_keys = []
+        for keys in keys_by_range:
+            for key in keys:
+                identity_key = mapper.identity_key_from_primary_key( ( key[0], ) )
+                obj = session.identity_map.get( identity_key )
+                if obj != None:
+                    objects_by_key[key[0]] = obj
+                else:
+                    missing_keys.append( key[0] )
+        if missing_keys:
+            query = session.query( self.admin.entity ).filter( primary_key_column.in_( missing_keys ) )
+            options = self._get_load_options()
+            if options:
+                query = query.options( *options )
+            for obj in query.all():
+                objects_by_key[mapper.primary_key_from_instance( obj )[0]] = obj
+        fetched_ranges = []
+        for (offset, limit), keys in zip( ranges, keys_by_range ):
+            objects = [ objects_by_key[key[0]] for key in keys if key[0] in objects_by_key ]
+            if len( objects ) != len( keys ):
+                # an object was deleted in between, fetch this range again
+                continue
+            if keys:
+                self._set_keyset_boundary( offset + len( keys ) - 1, keys[-1][1:],
+                                           generation )
+            fetched_ranges.append( ( offset, limit, objects ) )
+        return fetched_ranges
                     
+    @read_only_model_function
+    def _fill_cache(self, offset, limit):
+        """Put the data of the rows from offset to offset + limit in the
+        cache.
+        
+        This might run in a worker thread, in which case only the data of 
+        the objects loaded in the session of the worker is stripped here.
+        The rows of objects of the session of the model thread, such as
+        the objects already in the cache and the appended rows, are 
+        stripped by the model thread, which stores all rows in the cache.
+        """
+        if not self._query_getter:
+            return
+        removals = self._removals
+        columns = self._columns
+        #
+        # try to move the offset further by looking if the
+        # objects are already in the cache.
+        #
+        # this has the advantage that we might not need a query,
+        # and more important, that objects remain at the same row
+        # while their position in the query might have been changed
+        # since the previous query.
+        #
+        # the objects to add, and the row at which they will be added, the
+        # rows of which the object is known only to the model thread
+        rows_to_add, row_by_object, model_rows = [], dict(), []
+        rows_in_cache = 0
+        for row in range(offset, offset + limit):
+            try:
+                cached_obj =  self.cache.get_entity_at_row(row)
+                if isinstance( cached_obj, EntityStub ):
+                    break
+                model_rows.append( row )
+                row_by_object[cached_obj] = row
+                rows_in_cache += 1
+            except KeyError:
+                break
+        #
+        # query the remaining rows
+        #
+        stripped_rows = []
+        query_offset = offset + rows_in_cache
+        query_limit = limit - rows_in_cache
+        if query_limit > 0:
+            projected_columns = self._get_projected_columns()
+            if projected_columns != None:
+                rows = self._get_projected_range( query_offset, query_limit,
+                                                  projected_columns )
+            else:
+                rows = [ ( obj, None ) for obj in self._get_collection_range( query_offset,
+                                                                              query_limit ) ]
+            for i, (obj, values) in enumerate( rows ):
+                row = i + query_offset
+                try:
+                    previous_obj = self.cache.get_entity_at_row(row)
+                    if previous_obj != self._cached_entity(obj):
+                        continue
+                except KeyError:
+                    pass
+                if self._skip_row(row, obj) == False and \
+                   row_by_object.get(obj, row) == row:
+                    if values != None:
+                        stripped_rows.append( self._strip_projected_row( columns, row, obj, values ) )
+                    else:
+                        rows_to_add.append( (row, obj) )
+                        row_by_object[obj] = row
+        locker = QtCore.QMutexLocker( self._mutex )
+        total_rows = self._rows
+        rows_in_query = (total_rows - len(self._appended_rows))
+        locker.unlock()
+        # Verify if rows that have not yet been flushed have been 
+        # requested
+        if offset+limit >= rows_in_query:
+            model_rows.extend( range(max(rows_in_query, offset), min(offset+limit, total_rows)) )
+        stripped_rows.extend( self._strip_rows( columns, rows_to_add ) )
+        if in_worker_thread():
+            #
+            # only the stubs of the objects of the worker are stored in the 
+            # cache, the object is loaded in the session of the model thread
+            # when it is requested.
+            #
+            stripped_rows = [ ( row, self._cached_entity( obj ), cached_row ) for \
+                              ( row, obj, cached_row ) in stripped_rows ]
+            self._post( self._store_rows, args = ( columns, offset, limit, removals,
+                                                   stripped_rows, model_rows ) )
+        else:
+            self._store_rows( columns, offset, limit, removals, 
+                              stripped_rows, model_rows )
+
     @model_function
-    def _extend_cache(self):
-        """Extend the cache around the rows under request"""
-        if self._query_getter:
-            offset, limit = self._offset_and_limit_rows_to_get()
-            if limit:
-                columns = self._columns
-                #
-                # try to move the offset further by looking if the
-                # objects are already in the cache.
-                #
-                # this has the advantage that we might not need a query,
-                # and more important, that objects remain at the same row
-                # while their position in the query might have been changed
-                # since the previous query.
-                #
-                rows_in_cache = 0
-                for row in range(offset, offset + limit):
-                    try:
-                        cached_obj =  self.edit_cache.get_entity_at_row(row)                        
-                        self._add_data( columns, row, cached_obj)
-                        rows_in_cache += 1
-                    except KeyError:
-                        break
-                #
-                # query the remaining rows
-                #
-                query_offset = offset + rows_in_cache
-                query_limit = limit - rows_in_cache
-                if query_limit > 0:
-                    for i, obj in enumerate( self._get_collection_range(query_offset, 
-                                                                        query_limit) ):
-                        row = i + query_offset
-                        try:
-                            previous_obj = self.edit_cache.get_entity_at_row(row)
-                            if previous_obj != obj:
-                                continue
-                        except KeyError:
-                            pass
-                        if self._skip_row(row, obj) == False:
-                            self._add_data(columns, row, obj)
-                rows_in_query = (self._rows - len(self._appended_rows))
-                # Verify if rows that have not yet been flushed have been 
-                # requested
-                if offset+limit >= rows_in_query:
-                    for row in range(max(rows_in_query, offset), min(offset+limit, self._rows)):
-                        obj = self._get_object(row)
-                        self._add_data(columns, row, obj)                
-            return (offset, limit)
+    def _store_rows( self, columns, offset, limit, removals, stripped_rows, 
+                     model_rows ):
+        """Store the rows filled by :meth:`_fill_cache` in the cache, unless
+        rows have been removed since the rows were filled, as they would end
+        up in the wrong place.  The rows are then signaled as changed, to
+        have them requested again.
+        :param removals: the number of removals when the filling started
+        :param stripped_rows: the `(row, obj, cached_row)` tuples that were
+            stripped
+        :param model_rows: the rows to strip in the model thread
+        """
+        if removals == self._removals:
+            for row, obj, cached_row in stripped_rows:
+                self._store_row( row, obj, cached_row, False )
+            rows = [ ( row, self._get_object( row ) ) for row in model_rows ]
+            self._add_rows( columns, [ ( row, obj ) for row, obj in rows if obj != None ] )
+        self._rows_changed( offset, min(offset+limit, self._rows) - 1 )
+
+    def data( self, index, role = QtCore.Qt.DisplayRole ):
+        """Rows of which only the values of the columns were loaded have an
+        :class:`EntityStub` in the cache instead of their object.  For those
+        rows, Qt.UserRole+1 returns ValueLoading, while the object is loaded
+        in the model thread, after which the row is signaled as changed."""
+        if role == QtCore.Qt.UserRole + 1 and index.isValid():
+            try:
+                entity = self.cache.get_entity_at_row( index.row() )
+            except KeyError:
+                entity = None
+            if isinstance( entity, EntityStub ):
+                row = index.row()
+                self._post( self._resolve_stub, args = ( row, ), 
+                            key = ( id( self ), '_resolve_stub', row ) )
+                return QtCore.QVariant( ValueLoading )
+        return super( QueryTableProxy, self ).data( index, role )
+
+    @model_function
+    def _resolve_stub( self, row ):
+        """Replace the stub in a row of the cache with its object"""
+        try:
+            self._get_cached_entity( row )
+        except KeyError:
+            return
+        self._rows_changed( row, row )
 
     @model_function
     def _get_object(self, row):
@@ -320,7 +1134,7 @@ class QueryTableProxy(CollectionProxy):
             # first try to get the primary key out of the cache, if it's not
             # there, query the collection_getter
             try:
-                return self.edit_cache.get_entity_at_row(row)
+                return self._get_cached_entity(row)
             except KeyError:
                 pass
             # momentary hack for list error that prevents forms to be closed
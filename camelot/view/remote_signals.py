@@ -29,14 +29,164 @@ to each other or messages for the users.
 
 As a messaging server, Apache active MQ was tested in combination
 with the stomp library (http://docs.codehaus.org/display/STOMP/Python)
+
+The changes made to the database are exchanged with other applications
+through a :class:`NotificationBackend`, such as the
+:class:`UdpNotificationBackend`.
 """
 
+import collections
+import inspect
+import json
 import logging
 import re
+import socket
+import uuid
+import weakref
 
 LOGGER = logging.getLogger('remote_signals')
 
-from PyQt4 import QtCore
+from PyQt4 import QtCore, QtNetwork
+from sqlalchemy import event, orm
+
+from camelot.core.threading import RequestCoalescer
+from camelot.core.utils import is_deleted
+from camelot.view.model_thread import model_function, post
+
+class NotificationBackend( QtCore.QObject ):
+    """Base class for a backend that publishes the changes made to the
+    database by this application to other applications, and receives the
+    changes made by them.
+    
+    A change is a tuple `(entity, primary_key, change_type)`, with the name
+    of the entity class, a list with the values of the primary key and one
+    of `'create'`, `'update'` or `'delete'`.
+    
+    The changes received should be emitted through the
+    `changes_received_signal`, as a list of changes.
+    """
+    
+    changes_received_signal = QtCore.pyqtSignal( object )
+    
+    def publish( self, changes ):
+        """Publish a list of changes to the other applications, this method
+        can be called from any thread.
+        """
+        raise NotImplementedError
+    
+    def close( self ):
+        """Stop publishing and receiving changes"""
+        pass
+    
+class UdpNotificationBackend( NotificationBackend ):
+    """Exchanges changes as json datagrams over udp, without the need of a
+    messaging server.  All applications that should notify each other use
+    the same port.
+    
+    :param port: the udp port on which changes are received, when `0`,
+        a free port is bound and the bound port is available as the `port`
+        attribute
+    :param address: the address to which the changes are sent, use a
+        broadcast address to notify applications on other hosts.
+        
+    The class has these attributes :
+    
+    * max_changes_per_datagram : the maximum number of changes sent in a
+      single datagram
+    """
+    
+    max_changes_per_datagram = 200
+    
+    def __init__( self, port, address = '127.0.0.1', parent = None ):
+        super( UdpNotificationBackend, self ).__init__( parent )
+        self.port = port
+        self.address = address
+        # to recognize and ignore our own datagrams
+        self.client_id = uuid.uuid4().hex
+        self._socket = socket.socket( socket.AF_INET, socket.SOCK_DGRAM )
+        self._socket.setsockopt( socket.SOL_SOCKET, socket.SO_BROADCAST, 1 )
+        self._receiver = QtNetwork.QUdpSocket( self )
+        self._receiver.bind( port,
+                             QtNetwork.QUdpSocket.ShareAddress | \
+                             QtNetwork.QUdpSocket.ReuseAddressHint )
+        self.port = self._receiver.localPort()
+        self._receiver.readyRead.connect( self._read_datagrams )
+        
+    def publish( self, changes ):
+        for i in range( 0, len( changes ), self.max_changes_per_datagram ):
+            try:
+                datagram = json.dumps( { 'client' : self.client_id,
+                                         'changes' : changes[i:i+self.max_changes_per_datagram] } )
+                self._socket.sendto( datagram, ( self.address, self.port ) )
+            except ( TypeError, ValueError, socket.error ), e:
+                LOGGER.warn( 'could not publish changes', exc_info = e )
+                
+    @QtCore.pyqtSlot()
+    def _read_datagrams( self ):
+        while self._receiver.hasPendingDatagrams():
+            size = self._receiver.pendingDatagramSize()
+            datagram, _host, _port = self._receiver.readDatagram( size )
+            self.receive( datagram )
+            
+    def receive( self, datagram ):
+        """Handle a datagram received from another application
+        
+        :param datagram: a string with the json encoded changes
+        """
+        try:
+            message = json.loads( datagram )
+            if message['client'] == self.client_id:
+                return
+            changes = [ ( unicode( entity ), list( primary_key ), unicode( change_type ) ) \
+                        for entity, primary_key, change_type in message['changes'] ]
+        except ( TypeError, ValueError, KeyError ), e:
+            LOGGER.warn( 'could not decode received changes', exc_info = e )
+            return
+        if len( changes ):
+            self.changes_received_signal.emit( changes )
+        
+    def close( self ):
+        self._receiver.close()
+        self._socket.close()
+        
+#
+# The changes flushed by each session that are not yet committed
+#
+_session_changes = weakref.WeakKeyDictionary()
+
+def get_change( obj, change_type ):
+    """:return: the change tuple of type change_type for obj"""
+    key = orm.object_mapper( obj ).identity_key_from_instance( obj )
+    return ( unicode( key[0].__name__ ), list( key[1] ), change_type )
+
+def _collect_session_changes( session, flush_context ):
+    changes = _session_changes.setdefault( session, [] )
+    for obj in session.new:
+        changes.append( get_change( obj, 'create' ) )
+    for obj in session.dirty:
+        if session.is_modified( obj ):
+            changes.append( get_change( obj, 'update' ) )
+    for obj in session.deleted:
+        changes.append( get_change( obj, 'delete' ) )
+        
+def _publish_session_changes( session ):
+    changes = _session_changes.pop( session, None )
+    if changes:
+        get_signal_handler().publish_changes( changes )
+        
+def _discard_session_changes( session ):
+    _session_changes.pop( session, None )
+    
+_session_listeners_installed_ = []
+    
+def install_session_listeners():
+    """Listen to the flushes and commits of all sessions, to publish the
+    changes to the notification backend of the signal handler"""
+    if not len( _session_listeners_installed_ ):
+        event.listen( orm.Session, 'after_flush', _collect_session_changes )
+        event.listen( orm.Session, 'after_commit', _publish_session_changes )
+        event.listen( orm.Session, 'after_rollback', _discard_session_changes )
+        _session_listeners_installed_.append( True )
 
 class SignalHandler(QtCore.QObject):
     """The signal handler connects multiple collection proxy classes to
@@ -47,31 +197,102 @@ class SignalHandler(QtCore.QObject):
     
     A couple of the methods of this thread are protected by a QMutex through
     the synchronized decorator.  It appears that python/qt deadlocks when the
-    entity_update_signal is connected to and emitted at the same time.  This
+    entity signals are connected to and emitted at the same time.  This
     can happen when the user closes a window that is still building up (the
     CollectionProxies are being constructed and they connect to the signal
     handler).
     
     These deadlock issues are resolved in recent PyQt, so comment out the 
     mutex stuff. (2011-08-12)
+    
+    Entity updates are not signaled one by one.  The updated entities are
+    collected per sender and per class, and at the next iteration of the
+    event loop each batch is handed to the objects that subscribed to the
+    class of the entities through :meth:`connect_signals`, with a queued call
+    of their `handle_entities_update` slot.  For code that still connects to
+    the deprecated `entity_update_signal`, it is emitted for each entity of a
+    batch when the batch is handed to the subscribers.
+    
+    When a :class:`NotificationBackend` is set, the committed changes are
+    published to other applications, and the objects changed by other 
+    applications are reloaded.  When other applications create objects,
+    the objects subscribed to their class are refreshed.  The created classes
+    are collected during `remote_create_delay`, so the subscribers are
+    refreshed once for the objects created in multiple batches of changes.
+    
+    The class has these attributes :
+    
+    * remote_delay : the number of milliseconds during which changes received
+      from other applications are collected before they are applied
+    
+    * remote_create_delay : the number of milliseconds during which the 
+      classes of the objects created by other applications are collected
+      before their subscribers are refreshed
      """
 
+    # deprecated, updates are signaled with entities_update_signal
     entity_update_signal = QtCore.pyqtSignal(object, object)
     entity_delete_signal = QtCore.pyqtSignal(object, object)
     entity_create_signal = QtCore.pyqtSignal(object, object)
+    entities_update_signal = QtCore.pyqtSignal(object, object)
+    _flush_updates_signal = QtCore.pyqtSignal()
+    _remote_creates_signal = QtCore.pyqtSignal(object)
     
     entity_update_pattern = r'^/topic/Camelot.Entity.(?P<entity>.*).update$' 
     
+    remote_delay = 200
+    remote_create_delay = 1000
+    
     def __init__(self):
         super(SignalHandler, self).__init__()
         self.update_expression = re.compile(self.entity_update_pattern)
+        self._mutex = QtCore.QMutex()
+        # the updated entities that are not yet signaled, per sender and class
+        self._pending_updates = collections.OrderedDict()
+        # the objects subscribed to the updates of a class
+        self._subscribers = collections.defaultdict( weakref.WeakSet )
+        self._flush_updates_signal.connect( self.flush_updates, QtCore.Qt.QueuedConnection )
+        self._notification_backend = None
+        # the changes received from other applications that are not applied
+        self._remote_changes = []
+        self._remote_batches = RequestCoalescer( self._apply_remote_changes,
+                                                 delay = self.remote_delay,
+                                                 max_batch_size = 1000,
+                                                 parent = self )
+        # the classes of which other applications created objects, for which
+        # the subscribers are not yet refreshed
+        self._remote_creates = set()
+        self._remote_create_batches = RequestCoalescer( self._refresh_created_entities,
+                                                        delay = self.remote_create_delay,
+                                                        max_batch_size = 1000,
+                                                        parent = self )
+        self._remote_creates_signal.connect( self._collect_remote_creates,
+                                             QtCore.Qt.QueuedConnection )
             
-    def connect_signals(self, obj):
-        """Connect the SignalHandlers its signals to the slots of obj, while
-        the mutex is locked"""
-        self.entity_update_signal.connect( obj.handle_entity_update, QtCore.Qt.QueuedConnection )
+    def connect_signals(self, obj, entity=object):
+        """Connect the SignalHandlers its signals to the slots of obj, and
+        subscribe obj to the updates of entity.
+        
+        :param entity: the class of which obj wants to receive updates, obj
+            receives the updates of the subclasses of entity as well.  By
+            default obj receives all updates.
+        """
         self.entity_delete_signal.connect( obj.handle_entity_delete, QtCore.Qt.QueuedConnection )
         self.entity_create_signal.connect( obj.handle_entity_create, QtCore.Qt.QueuedConnection )   
+        locker = QtCore.QMutexLocker( self._mutex )
+        self._subscribers[entity].add( obj )
+        locker.unlock()
+        
+    def get_subscribers(self, entity):
+        """:return: a list with the objects subscribed to the updates of
+        class entity.  This method can be called from any thread."""
+        subscribers = set()
+        locker = QtCore.QMutexLocker( self._mutex )
+        for cls in inspect.getmro( entity ):
+            if cls in self._subscribers:
+                subscribers.update( self._subscribers[cls] )
+        locker.unlock()
+        return list( subscribers )
         
     def send_entity_update(self, sender, entity, scope='local'):
         """Call this method to inform the whole application an entity has 
@@ -81,8 +302,132 @@ class SignalHandler(QtCore.QObject):
     def sendEntityUpdate(self, sender, entity, scope='local'):
         """Call this method to inform the whole application an entity has 
         changed"""
-        # deprecated
-        self.entity_update_signal.emit( sender, entity )
+        self.sendEntitiesUpdate( sender, [entity], scope )
+        
+    def sendEntitiesUpdate(self, sender, entities, scope='local'):
+        """Call this method to inform the whole application a list of
+        entities has changed.  The entities are signaled together with the
+        other entities updated before the next iteration of the event loop.
+        This method can be called from any thread."""
+        # only objects in the gui can ignore their own updates
+        if not isinstance( sender, QtCore.QObject ):
+            sender = None
+        locker = QtCore.QMutexLocker( self._mutex )
+        schedule_flush = ( len( self._pending_updates ) == 0 )
+        for entity in entities:
+            key = ( sender, type( entity ) )
+            pending = self._pending_updates.get( key, None )
+            if pending == None:
+                pending = self._pending_updates[key] = collections.OrderedDict()
+            pending[id( entity )] = entity
+        locker.unlock()
+        if schedule_flush and len( entities ):
+            self._flush_updates_signal.emit()
+            
+    @QtCore.pyqtSlot()
+    def flush_updates(self):
+        """Signal the updated entities to the subscribed objects, with a
+        single call per sender and class"""
+        locker = QtCore.QMutexLocker( self._mutex )
+        pending_updates = self._pending_updates
+        self._pending_updates = collections.OrderedDict()
+        locker.unlock()
+        for ( sender, entity_class ), pending in pending_updates.items():
+            entities = pending.values()
+            self.entities_update_signal.emit( sender, entities )
+            for entity in entities:
+                self.entity_update_signal.emit( sender, entity )
+            for subscriber in self.get_subscribers( entity_class ):
+                if not is_deleted( subscriber ):
+                    QtCore.QMetaObject.invokeMethod( subscriber, 
+                                                     'handle_entities_update',
+                                                     QtCore.Qt.QueuedConnection,
+                                                     QtCore.Q_ARG( object, sender ),
+                                                     QtCore.Q_ARG( object, entities ) )
+        
+    def set_notification_backend(self, backend):
+        """Publish the changes committed to the database through backend,
+        and apply the changes received from it.
+        
+        :param backend: a :class:`NotificationBackend`
+        """
+        install_session_listeners()
+        self._notification_backend = backend
+        backend.changes_received_signal.connect( self.handle_remote_changes )
+        
+    def publish_changes(self, changes):
+        """Publish a list of changes to the other applications, if there is
+        a notification backend.  This method can be called from any thread."""
+        backend = self._notification_backend
+        if backend != None and len( changes ):
+            backend.publish( changes )
+            
+    @QtCore.pyqtSlot( object )
+    def handle_remote_changes(self, changes):
+        """Collect the changes received from other applications, to apply
+        them in a single batch"""
+        self._remote_changes.extend( changes )
+        self._remote_batches.request( len( changes ) )
+        
+    def _apply_remote_changes(self):
+        changes, self._remote_changes = self._remote_changes, []
+        post( self.refresh_changed_entities, args = ( changes, ) )
+        
+    @model_function
+    def refresh_changed_entities(self, changes):
+        """Reload the objects changed by other applications that are in the
+        session, and signal them to the views.  Objects that are not in the
+        session are not displayed, and objects with local changes are left
+        alone.  Created objects are not yet displayed, so their classes are
+        collected to refresh the objects subscribed to them.
+        
+        :param changes: a list of changes
+        """
+        from camelot.core.orm import Session, entities, refresh_objects
+        session = Session()
+        groups = collections.defaultdict( dict )
+        created_entities = set()
+        for entity_name, primary_key, change_type in changes:
+            entity = entities.get( entity_name, None )
+            if entity == None:
+                LOGGER.debug( 'change of unknown entity %s'%entity_name )
+                continue
+            mapper = orm.class_mapper( entity )
+            if change_type == 'create':
+                created_entities.add( entity )
+                continue
+            key = mapper.identity_key_from_primary_key( tuple( primary_key ) )
+            obj = session.identity_map.get( key )
+            if obj == None or obj in session.deleted or session.is_modified( obj ):
+                continue
+            groups[key[0]][key[1]] = obj
+        for identity_class, objects in groups.items():
+            for refreshed, expunged in refresh_objects( session,
+                                                        identity_class,
+                                                        objects ):
+                self.sendEntitiesUpdate( None, refreshed )
+                for obj in expunged:
+                    self.sendEntityDelete( None, obj )
+        if len( created_entities ):
+            self._remote_creates_signal.emit( created_entities )
+            
+    @QtCore.pyqtSlot( object )
+    def _collect_remote_creates(self, created_entities):
+        self._remote_creates.update( created_entities )
+        self._remote_create_batches.request( len( created_entities ) )
+        
+    def _refresh_created_entities(self):
+        """Refresh the objects subscribed to the classes of which objects
+        were created by other applications, or to one of their subclasses,
+        once per object"""
+        created_entities, self._remote_creates = self._remote_creates, set()
+        subscribers = set()
+        for entity in created_entities:
+            for mapper in orm.class_mapper( entity ).polymorphic_iterator():
+                subscribers.update( self.get_subscribers( mapper.class_ ) )
+        for subscriber in subscribers:
+            if not is_deleted( subscriber ):
+                subscriber.refresh()
         
     def sendEntityDelete(self, sender, entity, scope='local'):
         """Call this method to inform the whole application an entity is 
@@ -409,11 +409,67 @@ class ListActionsCase( test_model.ExampleModelCase ):
     def test_export_spreadsheet( self ):
         import xlrd
         export_spreadsheet = list_action.ExportSpreadsheet()
-        for step in export_spreadsheet.model_run( self.context ):
-            if isinstance( step, action_steps.OpenFile ):
-                # see if the generated file can be parsed
-                filename = step.get_path()
-                xlrd.open_workbook( filename )
+        steps = list( export_spreadsheet.model_run( self.context ) )
+        filename = steps[-1].get_path()
+        self.assertTrue( filename.endswith( '.xls' ) )
+        # see if the generated file can be parsed
+        sheet = xlrd.open_workbook( filename ).sheet_by_index( 0 )
+        # a title, an empty row, the header and the rows of the collection
+        self.assertEqual( sheet.nrows, 3 + len( self.context.get_collection() ) )
+        self.assertEqual( sheet.cell_value( 2, 1 ),
+                          unicode( self.context.admin.get_field_attributes( 'title' )['name'] ) )
+        self.assertEqual( sheet.cell_value( 3, 1 ), self.context.obj.title )
+
+    def test_export_large_spreadsheet( self ):
+        from camelot.view.export_utils import get_streaming_writer_class
+        export_spreadsheet = list_action.ExportSpreadsheet()
+        # tables with more rows than max_xls_rows are written row by row
+        export_spreadsheet.max_xls_rows = 0
+        steps = list( export_spreadsheet.model_run( self.context ) )
+        filename = steps[-1].get_path()
+        self.assertTrue( filename.endswith( get_streaming_writer_class().suffix ) )
+        self.assertTrue( os.path.getsize( filename ) > 0 )
+        # as are tables of which the rows are not yet counted
+        export_spreadsheet.max_xls_rows = 65000
+        self.context.collection_count_estimated = True
+        steps = list( export_spreadsheet.model_run( self.context ) )
+        self.assertTrue( steps[-1].get_path().endswith( get_streaming_writer_class().suffix ) )
+        
+    def test_write_rows( self ):
+        import csv
+        from camelot.view import export_utils
+        export_spreadsheet = list_action.ExportSpreadsheet()
+        columns = [ ( field, dict( attributes ) ) for field, attributes in \
+                    self.context.admin.get_columns() ]
+        movie = self.context.obj
+        # without openpyxl, the rows are written to a csv file
+        get_streaming_writer_class = export_utils.get_streaming_writer_class
+        export_utils.get_streaming_writer_class = lambda:export_utils.CsvWriter
+        try:
+            steps = list( export_spreadsheet.write_rows( self.context, columns ) )
+        finally:
+            export_utils.get_streaming_writer_class = get_streaming_writer_class
+        filename = steps[-1].get_path()
+        self.assertTrue( filename.endswith( '.csv' ) )
+        rows = list( csv.reader( open( filename, 'rb' ) ) )
+        self.assertEqual( len( rows ), 1 + len( self.context.get_collection() ) )
+        self.assertEqual( [ cell.decode( 'utf-8' ) for cell in rows[0] ],
+                          [ unicode( attributes['name'] ) for _field, attributes in columns ] )
+        self.assertEqual( rows[1][1].decode( 'utf-8' ), movie.title )
+        if movie.releasedate != None:
+            self.assertEqual( rows[1][2], movie.releasedate.isoformat() )
+        # with openpyxl, the rows are written to an xlsx file
+        try:
+            import openpyxl
+        except ImportError:
+            return
+        steps = list( export_spreadsheet.write_rows( self.context, columns ) )
+        filename = steps[-1].get_path()
+        self.assertTrue( filename.endswith( '.xlsx' ) )
+        sheet = openpyxl.load_workbook( filename ).worksheets[0]
+        rows = [ [ cell.value for cell in row ] for row in sheet.rows ]
+        self.assertEqual( len( rows ), 1 + len( self.context.get_collection() ) )
+        self.assertEqual( rows[1][1], movie.title )
 
     def test_match_names( self ):
         from camelot.view.import_utils import RowData, ColumnMapping
@@ -464,6 +520,131 @@ class ListActionsCase( test_model.ExampleModelCase ):
                 self.grab_widget( dialog ) 
                 generator.send( ('rating', lambda:3) )
                 
+    def test_bulk_replace_field_contents( self ):
+        from camelot.view.proxy.queryproxy import QueryTableProxy
+        from camelot.view.remote_signals import get_signal_handler, \
+             NotificationBackend
+        from camelot_example.model import Movie
+        movie_admin = self.app_admin.get_related_admin( Movie )
+        model_context = list_action.ListActionModelContext()
+        model_context._model = QueryTableProxy( movie_admin,
+                                                query_getter = lambda:Movie.query,
+                                                columns_getter = movie_admin.get_columns )
+        model_context.admin = movie_admin
+        model_context.collection_count = Movie.query.count()
+        model_context.selection_count = model_context.collection_count
+        replace = list_action.ReplaceFieldContents()
+        # relations are not replaced with an update statement
+        self.assertEqual( replace.get_bulk_column( model_context, 'director' ), None )
+        column = replace.get_bulk_column( model_context, 'rating' )
+        self.assertNotEqual( column, None )
+        movie = Movie.query.first()
+        movie.rating = 1
+        # the rows are selected once, and only if all rows are in the query
+        model_context.collection_count += 1
+        self.assertEqual( replace.get_bulk_rows( model_context, column ), None )
+        model_context.collection_count -= 1
+        rows = replace.get_bulk_rows( model_context, column )
+        self.assertEqual( len( rows ), model_context.collection_count )
+        self.assertTrue( ( movie.id, 1 ) in rows )
+        replace.bulk_chunk_size = 2
+        # the updated rows are published to other applications
+        signal_handler = get_signal_handler()
+        published = []
+        backend = NotificationBackend()
+        backend.publish = published.extend
+        signal_handler._notification_backend = backend
+        try:
+            list( replace.bulk_replace( model_context, 'rating', column, 2, rows ) )
+        finally:
+            signal_handler._notification_backend = None
+        self.assertTrue( ( u'Movie', [ movie.id ], u'update' ) in published )
+        # the objects in the session are reloaded
+        self.assertEqual( movie.rating, 2 )
+        self.assertEqual( set( m.rating for m in Movie.query.all() ), set( [2] ) )
+        # a partial selection is replaced object by object
+        model_context.selection_count = model_context.collection_count - 1
+        self.assertEqual( replace.get_bulk_column( model_context, 'rating' ), None )
+        # while the rows are counted, not all rows can be selected
+        model_context.selection_count = model_context.collection_count
+        model_context.collection_count_estimated = True
+        self.assertFalse( model_context.is_collection_selected() )
+        self.assertEqual( replace.get_bulk_column( model_context, 'rating' ), None )
+        model_context.collection_count_estimated = False
+        # a customized flush needs the objects, they are replaced one by one
+        
+        class FlushAdmin( type( movie_admin ) ):
+            
+            def flush( self, obj ):
+                super( FlushAdmin, self ).flush( obj )
+            
+        # as do depending objects
+        
+        class DependingAdmin( type( movie_admin ) ):
+            
+            def get_depending_objects( self, obj ):
+                return []
+            
+        model_context.admin = DependingAdmin( self.app_admin, Movie )
+        self.assertEqual( replace.get_bulk_column( model_context, 'rating' ), None )
+        model_context.admin = FlushAdmin( self.app_admin, Movie )
+        self.assertEqual( replace.get_bulk_column( model_context, 'rating' ), None )
+        generator = replace.model_run( model_context )
+        for step in generator:
+            if isinstance( step, action_steps.ChangeField ):
+                generator.send( ( 'rating', lambda:4 ) )
+        self.assertEqual( set( m.rating for m in Movie.query.all() ), set( [4] ) )
+        
+    def test_bulk_delete_selection( self ):
+        from camelot.view.proxy.queryproxy import QueryTableProxy
+        from camelot_example.model import Movie, VisitorReport
+        movie = Movie.query.first()
+        for i in range( 5 ):
+            VisitorReport( movie = movie, visitors = i )
+        VisitorReport.query.session.flush()
+        report_admin = self.app_admin.get_related_admin( VisitorReport )
+        model_context = list_action.ListActionModelContext()
+        model_context._model = QueryTableProxy( report_admin,
+                                                query_getter = lambda:VisitorReport.query,
+                                                columns_getter = report_admin.get_columns )
+        model_context.admin = report_admin
+        model_context.collection_count = VisitorReport.query.count()
+        model_context.selection_count = model_context.collection_count
+        delete = list_action.DeleteSelection()
+        delete.bulk_threshold = 1
+        delete.bulk_chunk_size = 2
+        self.assertTrue( delete.can_delete_in_bulk( model_context ) )
+        # the rows are removed from other views that display them
+        other_proxy = QueryTableProxy( report_admin,
+                                       query_getter = lambda:VisitorReport.query,
+                                       columns_getter = report_admin.get_columns )
+        rows = other_proxy.rowCount()
+        other_proxy._fill_cache( 0, rows )
+        self.assertTrue( len( other_proxy.cache ) > 0 )
+        list( delete.bulk_delete( model_context ) )
+        self.assertEqual( VisitorReport.query.count(), 0 )
+        # each view is reloaded once
+        self.process()
+        self.assertEqual( len( other_proxy.cache ), 0 )
+        self.assertEqual( other_proxy.rowCount(), 0 )
+        # movies cascade the delete to their visitor reports
+        movie_admin = self.app_admin.get_related_admin( Movie )
+        model_context.admin = movie_admin
+        self.assertFalse( delete.can_delete_in_bulk( model_context ) )
+        # a foreign key without a relationship prevents a bulk delete
+        from sqlalchemy import schema, types
+        report_table = VisitorReport.table
+        table = schema.Table( 'visitor_report_reference', report_table.metadata,
+                              schema.Column( 'id', types.Integer, primary_key = True ),
+                              schema.Column( 'report_id', types.Integer,
+                                             schema.ForeignKey( report_table.c.id ) ) )
+        model_context.admin = report_admin
+        try:
+            self.assertFalse( delete.can_delete_in_bulk( model_context ) )
+        finally:
+            report_table.metadata.remove( table )
+        self.assertTrue( delete.can_delete_in_bulk( model_context ) )
+        
     def test_drag_and_drop( self ):
         from camelot.view.proxy.queryproxy import QueryTableProxy
         
@@ -491,12 +672,22 @@ class ListActionsCase( test_model.ExampleModelCase ):
         open_new_view_action.gui_run( self.gui_context )
         
     def test_duplicate_selection( self ):
-        query = self.context.admin.entity.query
-        pre_duplication = query.count()
+        from camelot.view.proxy.queryproxy import QueryTableProxy
+        from camelot_example.model import Movie
+        movie_admin = self.app_admin.get_related_admin( Movie )
+        model_context = list_action.ListActionModelContext()
+        model_context._model = QueryTableProxy( movie_admin,
+                                                query_getter = lambda:Movie.query,
+                                                columns_getter = movie_admin.get_columns )
+        model_context.admin = movie_admin
+        pre_duplication = Movie.query.count()
+        model_context.collection_count = pre_duplication
+        model_context.selection_count = pre_duplication
         duplicate_selection_action = list_action.DuplicateSelection()
-        duplicate_selection_action.model_run( self.context )   
-        post_duplication = query.count()
-        #self.assertEqual( pre_duplication + 1, post_duplication )
+        # the copies appended to the query are not duplicated themselves
+        list( duplicate_selection_action.model_run( model_context ) )
+        post_duplication = Movie.query.count()
+        self.assertEqual( pre_duplication * 2, post_duplication )
         
     def test_delete_selection( self ):
         session = orm.object_session( self.context.obj )
@@ -613,8 +804,11 @@ class ApplicationActionsCase( test_model.ExampleModelCase ):
         #
         # refresh the session through the action
         #
+        refresh_action.chunk_size = 2
         list( refresh_action.model_run( self.context ) )
         self.assertEqual( p2.last_name, u'dirty' )
+        self.assertTrue( p1 in session )
+        self.assertFalse( p6 in session )
         
     def test_backup_and_restore( self ):
         backup_action = application_action.Backup()
@@ -668,6 +862,19 @@ class ApplicationActionsCase( test_model.ExampleModelCase ):
         runtime_info = application_action.RuntimeInfo()
         list( runtime_info.model_run( self.context ) )
         
+    def test_task_statistics( self ):
+        import json
+        task_statistics = application_action.TaskStatistics()
+        steps = list( task_statistics.model_run( self.context ) )
+        self.assertTrue( u'Live tasks' in unicode( steps[-1].document.toPlainText() ) )
+        export_task_statistics = application_action.ExportTaskStatistics()
+        steps = list( export_task_statistics.model_run( self.context ) )
+        self.assertTrue( 'live_tasks' in json.load( open( steps[-1].get_path() ) ) )
+        # both actions are available through their shortcut
+        hidden_actions = [ type( action ) for action in self.app_admin.hidden_actions ]
+        self.assertTrue( application_action.ExportTaskStatistics in hidden_actions )
+        self.assertTrue( export_task_statistics.shortcut != task_statistics.shortcut )
+        
     def test_segmentation_fault( self ):
         segmentation_fault = application_action.SegmentationFault()
         list( segmentation_fault.model_run( self.context ) )         
@@ -111,6 +111,43 @@ class ObjectAdminCase( ModelThreadTestCase ):
         a_admin.is_persistent( a )
         a_admin.copy( a )
         
+    def test_dynamic_field_attributes_batch( self ):
+        
+        class A( object ):
+            
+            def __init__( self, x ):
+                self.x = x
+                
+            class Admin( ObjectAdmin ):
+                list_display = ['x']
+                field_attributes = {'x':{'editable':lambda o:o.x > 1,
+                                         'tooltip':'static'}}
+                
+        a_admin = self.app_admin.get_related_admin( A )
+        objects = [ A( 1 ), A( 2 ) ]
+        batch = a_admin.get_dynamic_field_attributes_batch( objects, ['x'] )
+        self.assertEqual( batch, [ [{'editable':False}], [{'editable':True}] ] )
+        for obj, attributes in zip( objects, batch ):
+            self.assertEqual( list( a_admin.get_dynamic_field_attributes( obj, ['x'] ) ),
+                              attributes )
+        
+        #
+        # a reimplementation of get_dynamic_field_attributes is used
+        # for each object
+        #
+        class B( A ):
+            
+            class Admin( A.Admin ):
+                
+                def get_dynamic_field_attributes( self, obj, field_names ):
+                    for attributes in super( B.Admin, self ).get_dynamic_field_attributes( obj, field_names ):
+                        attributes['editable'] = False
+                        yield attributes
+                
+        b_admin = self.app_admin.get_related_admin( B )
+        batch = b_admin.get_dynamic_field_attributes_batch( [ B( 2 ) ], ['x'] )
+        self.assertEqual( batch, [ [{'editable':False}] ] )
+        
 class EntityAdminCase( ModelThreadTestCase ):
     """Test the EntityAdmin
     """
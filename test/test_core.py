@@ -1,6 +1,7 @@
 import unittest
 
 from camelot.core.memento import memento_change, memento_types
+from camelot.core.threading import RequestCoalescer
 from camelot.test import ModelThreadTestCase
 
 memento_id_counter = 0
@@ -92,3 +93,146 @@ class AutoReloadCase( ModelThreadTestCase ):
         pass
         #from camelot.core.auto_reload import auto_reload
         #auto_reload.source_changed( None )
+
+class TaskHandlerCase( ModelThreadTestCase ):
+    """Test the handling of tasks by the model thread"""
+    
+    def test_tasks_done( self ):
+        from PyQt4 import QtCore
+        from camelot.view.model_thread.signal_slot_model_thread import \
+             Task, TaskHandler, count_live_tasks
+        
+        class Queue( list ):
+            
+            def pop( self ):
+                if len( self ):
+                    return list.pop( self, 0 )
+        
+        results = []
+        queue = Queue( [ Task( results.append, args = ( i, ) ) for i in range( 5 ) ] )
+        self.assertTrue( count_live_tasks() >= 5 )
+        task_handler = TaskHandler( queue )
+        task_handler.max_tasks_done = 2
+        task_handler.handle_task()
+        self.assertEqual( results, range( 5 ) )
+        # the tasks done are kept alive until they have been deleted
+        self.assertEqual( task_handler.count_tasks_done(), 5 )
+        QtCore.QCoreApplication.sendPostedEvents( None, QtCore.QEvent.DeferredDelete )
+        task_handler._release_tasks_done()
+        self.assertEqual( task_handler.count_tasks_done(), 0 )
+        
+    def test_task_receiver( self ):
+        from PyQt4 import QtCore
+        from camelot.view.model_thread.signal_slot_model_thread import Task
+        receiver = QtCore.QObject()
+        task = Task( lambda:None, receiver = receiver )
+        self.assertFalse( task.cancelled() )
+        # a queued task does not keep its receiver alive
+        del receiver
+        self.assertTrue( task.cancelled() )
+
+    def test_priority_and_key( self ):
+        from camelot.view.model_thread import HIGH_PRIORITY, LOW_PRIORITY
+        from camelot.view.model_thread.signal_slot_model_thread import \
+             SignalSlotModelThread
+        
+        results = []
+        
+        def request( i ):
+            results.append( i )
+            
+        model_thread = SignalSlotModelThread( setup_thread = None )
+        model_thread.post( request, args = ( 1, ) )
+        model_thread.post( request, args = ( 2, ), priority = LOW_PRIORITY )
+        model_thread.post( request, args = ( 3, ), priority = HIGH_PRIORITY )
+        model_thread.post( request, args = ( 4, ), key = 'search' )
+        model_thread.post( request, args = ( 5, ), key = 'search' )
+        task = model_thread.pop()
+        while task != None:
+            task.execute()
+            task = model_thread.pop()
+        # the task with key 'search' was superseded by the last one
+        self.assertEqual( results, [ 3, 1, 5, 2 ] )
+
+    def test_task_statistics( self ):
+        import json
+        from camelot.view.model_thread.signal_slot_model_thread import Task
+        from camelot.view.model_thread.task_statistics import TaskStatistics, \
+             task_statistics
+        
+        statistics = TaskStatistics()
+        statistics.slow_task_threshold = 0.5
+        statistics.record_queue_depth( 3 )
+        statistics.record_task( 'fast', 0.1, 0.2, 1 )
+        statistics.record_task( 'fast', 0.3, 0.1, 2 )
+        statistics.record_task( 'slow', 0.0, 1.0, 10 )
+        summary = json.loads( statistics.to_json() )
+        self.assertEqual( summary['tasks']['fast']['count'], 2 )
+        self.assertEqual( summary['tasks']['fast']['statements'], 3 )
+        self.assertAlmostEqual( summary['tasks']['fast']['maximum_wait_time'], 0.3 )
+        self.assertEqual( [ t['name'] for t in summary['slow_tasks'] ], [ 'slow' ] )
+        self.assertEqual( summary['queue_depths'][0][1], 3 )
+        # executed tasks are recorded in the statistics of the model threads
+        task_statistics.clear()
+        Task( lambda:None, name = 'instrumented' ).execute()
+        self.assertTrue( 'instrumented' in task_statistics.get_statistics()['tasks'] )
+        
+    def test_worker_threads( self ):
+        from camelot.view import model_thread
+        # without a pool, read only requests go to the model thread
+        self.assertEqual( model_thread.get_worker_thread( self ),
+                          model_thread.get_model_thread() )
+        workers = model_thread.construct_worker_threads( 3 )
+        try:
+            self.assertEqual( len( workers ), 3 )
+            # requests with the same affinity go to the same worker
+            worker = model_thread.get_worker_thread( self )
+            self.assertTrue( worker in workers )
+            self.assertEqual( worker, model_thread.get_worker_thread( self ) )
+            self.assertFalse( model_thread.in_worker_thread() )
+        finally:
+            model_thread.stop_worker_threads()
+        self.assertEqual( model_thread.get_worker_thread( self ),
+                          model_thread.get_model_thread() )
+
+    def test_start_worker_threads( self ):
+        from camelot.view import model_thread
+        results = []
+        exceptions = []
+        
+        def request():
+            results.append( model_thread.in_worker_thread() )
+            results.append( model_thread.in_model_or_worker_thread() )
+            
+        workers = model_thread.construct_worker_threads( 1 )
+        worker = workers[0]
+        try:
+            worker.setup_exception_signal.connect( exceptions.append )
+            worker.start()
+            model_thread.post_read_only( request )
+            worker.wait_on_work()
+        finally:
+            model_thread.stop_worker_threads()
+        worker.wait()
+        # the worker was set up without exceptions and handled the request
+        self.assertEqual( exceptions, [] )
+        self.assertEqual( results, [ True, True ] )
+
+class RequestCoalescerCase( unittest.TestCase ):
+    
+    def test_max_batch_size( self ):
+        flushes = []
+        coalescer = RequestCoalescer( lambda:flushes.append( True ),
+                                      max_batch_size = 3 )
+        for i in range( 7 ):
+            coalescer.request()
+        self.assertEqual( len( flushes ), 2 )
+        coalescer.flush()
+        self.assertEqual( len( flushes ), 3 )
+        # flushing without requests does nothing
+        coalescer.flush()
+        self.assertEqual( len( flushes ), 3 )
+        counters = coalescer.get_counters()
+        self.assertEqual( counters['batches'], 3 )
+        self.assertEqual( counters['requests'], 7 )
+        self.assertEqual( counters['largest_batch'], 3 )
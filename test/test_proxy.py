@@ -2,13 +2,17 @@ from PyQt4.QtCore import Qt
 from PyQt4 import QtCore
 
 from camelot_example.fixtures import load_movie_fixtures
-from camelot.model.party import Person
-from camelot.view.proxy.collection_proxy import CollectionProxy
-from camelot.view.proxy.queryproxy import QueryTableProxy
+from camelot.model.party import Party, Person
+from camelot.view.proxy.collection_proxy import CollectionProxy, \
+     strip_data_from_object
+from camelot.view.proxy.queryproxy import QueryTableProxy, EntityStub
 from camelot.admin.application_admin import ApplicationAdmin
 from camelot.core.orm import Session
 from camelot.core.utils import variant_to_pyobject
 from camelot.test import ModelThreadTestCase
+from camelot.view.model_thread.task_statistics import count_statements, \
+     install_statement_counter
+from camelot.view.proxy import ValueLoading
 
 class ProxyCase( ModelThreadTestCase ):
 
@@ -59,6 +63,125 @@ class CollectionProxyCase( ProxyCase ):
         self._set_data( 0, 0, 'Foo' )
         self.assertEqual( person1.first_name, 'Foo' )
         
+    def test_column_plan( self ):
+        columns = self.proxy.getColumns()
+        column_plan = self.proxy._column_plan
+        self.assertTrue( column_plan.columns is columns )
+        self.assertEqual( column_plan.get_values( self.collection[0] ),
+                          strip_data_from_object( self.collection[0], columns ) )
+        # a new plan is compiled when other columns are set
+        self.proxy.setColumns( columns[:1] )
+        self.assertEqual( len( self.proxy._column_plan.field_names ), 1 )
+        # the user data of a cell is a copy of the field attributes
+        self._load_data()
+        index = self.proxy.index( 0, 0 )
+        field_attributes = variant_to_pyobject( self.proxy.data( index, Qt.UserRole ) )
+        field_attributes['editable'] = 'modified'
+        self.assertNotEqual( self.proxy._column_plan.static_field_attributes[0].get( 'editable' ),
+                             'modified' )
+        # until the plan is compiled, the columns themselves are used
+        self.proxy._columns = columns
+        self.assertEqual( self.proxy._get_static_field_attributes( 1 )['name'],
+                          columns[1][1]['name'] )
+        self.assertEqual( self.proxy._get_static_field_attributes( len( columns ) ), {} )
+        
+    def test_fetch_ranges( self ):
+        rows = self.proxy.rowCount()
+        self.assertTrue( rows > 4 )
+        self.proxy._max_number_of_rows = 2
+        self.proxy.rows_under_request.update( [0, 1, rows - 1] )
+        self.assertEqual( self.proxy._ranges_to_get(), [(0, 2), (rows - 1, 1)] )
+        # both ranges are fetched at once
+        ranges = self.proxy._extend_cache()
+        self.assertEqual( len( ranges ), 2 )
+        self.assertTrue( self.proxy.cache.has_data_at_row( 0 ) )
+        self.assertTrue( self.proxy.cache.has_data_at_row( rows - 1 ) )
+        self.proxy._cache_extended( ranges )
+        self.assertFalse( self.proxy.rows_under_request )
+
+    def test_edit_before_row_request( self ):
+        from camelot.view import model_thread
+        from camelot.view.model_thread.signal_slot_model_thread import \
+             SignalSlotModelThread
+        self._load_data()
+        queue = SignalSlotModelThread( setup_thread = None )
+        model_thread._model_thread_.insert( 0, queue )
+        try:
+            self._set_data( 0, 0, 'Foo' )
+            self.proxy._update_request_batches.flush()
+            self.proxy.rows_under_request.add( 0 )
+            self.proxy._row_requests.request()
+            self.proxy._row_requests.flush()
+        finally:
+            model_thread._model_thread_.remove( queue )
+        names = []
+        task = queue.pop()
+        while task != None:
+            names.append( task._name )
+            task = queue.pop()
+        # the edit is applied before the row is read again
+        self.assertEqual( names[0], '_handle_update_requests' )
+        self.assertTrue( names[1].startswith( '_extend_cache' ) )
+
+    def test_remove_object( self ):
+        self._load_data()
+        rows = self.proxy.rowCount()
+        person = self.collection[1]
+        next_person = self.collection[2]
+        # the views are informed before the number of rows changes
+        rows_before_removal = []
+        self.proxy._rows_about_to_be_removed_signal.connect( 
+            lambda first, last:rows_before_removal.append( self.proxy._rows ),
+            Qt.DirectConnection )
+        self.proxy.remove_object( person )
+        self.assertEqual( rows_before_removal, [ rows ] )
+        self.assertEqual( self.proxy.rowCount(), rows - 1 )
+        self.assertFalse( person in self.collection )
+        # the other rows remain in the cache, moved up after the removed row
+        self.assertFalse( self.proxy.is_cached( person ) )
+        self.assertEqual( self.proxy.cache.get_row_by_entity( next_person ), 1 )
+        self.assertTrue( self.proxy.cache.has_data_at_row( 0 ) )
+        self.assertTrue( self.proxy.cache.has_data_at_row( 1 ) )
+        
+    def test_sort( self ):
+        # a list is sorted in memory
+        self.assertEqual( self.proxy._sort_in_database( self.collection, 'first_name', Qt.DescendingOrder ), None )
+        positions = self.proxy._sort_in_memory( self.collection, 'first_name', Qt.DescendingOrder )
+        names = [ self.collection[i].first_name for i in positions ]
+        self.assertEqual( names, sorted( names, reverse = True ) )
+        # a query is sorted in the database
+        query = Session().query( Person )
+        objects = query.all()
+        positions = self.proxy._sort_in_database( query, 'first_name', Qt.DescendingOrder )
+        names = [ objects[i].first_name for i in positions ]
+        self.assertEqual( names, sorted( names, reverse = True ) )
+        # NULL values are sorted as in memory
+        objects[0].middle_name = u'A'
+        objects[1].middle_name = None
+        query.session.flush()
+        for order in ( Qt.AscendingOrder, Qt.DescendingOrder ):
+            database_positions = self.proxy._sort_in_database( query, 'middle_name', order )
+            memory_positions = self.proxy._sort_in_memory( objects, 'middle_name', order )
+            self.assertEqual( [ objects[i].middle_name for i in database_positions ],
+                              [ objects[i].middle_name for i in memory_positions ] )
+        # the list of a relationship is sorted in the database, unless it has
+        # pending changes
+        from camelot_example.model import Movie, VisitorReport
+        movie = Movie.query.first()
+        for visitors in ( 2, 1, 3 ):
+            VisitorReport( movie = movie, visitors = visitors )
+        query.session.flush()
+        report_admin = self.app_admin.get_related_admin( VisitorReport )
+        report_proxy = CollectionProxy( report_admin,
+                                        collection_getter = lambda:movie.visitor_reports,
+                                        columns_getter = report_admin.get_columns )
+        reports = movie.visitor_reports
+        positions = report_proxy._sort_in_database( reports, 'visitors', Qt.AscendingOrder )
+        visitors = [ reports[i].visitors for i in positions ]
+        self.assertEqual( visitors, sorted( visitors ) )
+        VisitorReport( movie = movie, visitors = 0 )
+        self.assertEqual( report_proxy._sort_in_database( reports, 'visitors', Qt.AscendingOrder ), None )
+        
 class QueryProxyCase( ProxyCase ):
     """Test the functionality of the QueryProxy to perform CRUD operations on 
     stand alone data"""
@@ -69,6 +192,68 @@ class QueryProxyCase( ProxyCase ):
                                              query_getter = lambda:Person.query, 
                                              columns_getter = self.person_admin.get_columns )
 
+    def test_publish_and_apply_changes( self ):
+        from camelot.view.remote_signals import get_signal_handler, \
+             NotificationBackend
+        
+        class RecordingBackend( NotificationBackend ):
+            
+            def __init__( self ):
+                super( RecordingBackend, self ).__init__()
+                self.published = []
+                
+            def publish( self, changes ):
+                self.published.extend( changes )
+        
+        signal_handler = get_signal_handler()
+        backend = RecordingBackend()
+        signal_handler.set_notification_backend( backend )
+        try:
+            person = Person( first_name = u'Remote', last_name = u'Change' )
+            Person.query.session.flush()
+            self.assertTrue( ( u'Party', [ person.id ], 'create' ) in backend.published )
+            # a change made by another application reloads the object
+            person_table = Person.table
+            Person.query.session.execute( person_table.update().where( person_table.c.party_id == person.id ).values( first_name = u'Other' ) )
+            signal_handler.refresh_changed_entities( [ ( u'Party', [ person.id ], u'update' ) ] )
+            self.assertEqual( person.first_name, u'Other' )
+            # the changes received are applied in the model thread
+            from camelot.view import model_thread
+            from camelot.view.model_thread.signal_slot_model_thread import \
+                 SignalSlotModelThread
+            Person.query.session.execute( person_table.update().where( person_table.c.party_id == person.id ).values( first_name = u'Another' ) )
+            thread = SignalSlotModelThread( setup_thread = None )
+            model_thread._model_thread_.insert( 0, thread )
+            try:
+                signal_handler.handle_remote_changes( [ ( u'Party', [ person.id ], u'update' ) ] )
+                signal_handler._remote_batches.flush()
+                task = thread.pop()
+                while task != None:
+                    task.execute()
+                    task = thread.pop()
+            finally:
+                model_thread._model_thread_.remove( thread )
+            self.assertEqual( person.first_name, u'Another' )
+        finally:
+            signal_handler._notification_backend = None
+        # a row created by another application appears in the proxies
+        # subscribed to its class
+        rows = self.proxy.rowCount()
+        batches = signal_handler._remote_create_batches.batches
+        self.process()
+        person = Person( first_name = u'Remote', last_name = u'Create' )
+        Person.query.session.flush()
+        self.assertEqual( self.proxy.rowCount(), rows )
+        signal_handler.refresh_changed_entities( [ ( u'Party', [ person.id ], u'create' ) ] )
+        signal_handler.refresh_changed_entities( [ ( u'Party', [ person.id + 1 ], u'create' ) ] )
+        QtCore.QCoreApplication.processEvents()
+        # the creates of both batches are collected in a single refresh
+        self.assertEqual( signal_handler._remote_creates, set( [ Party ] ) )
+        signal_handler._remote_create_batches.flush()
+        self.assertEqual( signal_handler._remote_create_batches.batches, batches + 1 )
+        self.process()
+        self.assertEqual( self.proxy.rowCount(), rows + 1 )
+        
     def test_insert_after_sort( self ):
         from camelot.view.proxy.queryproxy import QueryTableProxy
         from camelot.model.party import Person
@@ -128,3 +313,248 @@ class QueryProxyCase( ProxyCase ):
         self.assertTrue( self.proxy._get_object( rows - 1 ) )        
         self.assertFalse( self.proxy._get_object( rows ) )
         self.assertFalse( self.proxy._get_object( rows + 1 ) )
+        
+    def test_keyset_pagination( self ):
+        objects = self.proxy.get_query_getter()().all()
+        rows = len( objects )
+        self.assertTrue( rows > 3 )
+        self.assertTrue( self.proxy._keyset_columns )
+        self.assertEqual( self.proxy._get_collection_range( 0, 2 ), objects[0:2] )
+        # the next ranges seek to the boundary of the first range
+        self.assertTrue( 1 in self.proxy._keyset_boundaries )
+        self.assertEqual( self.proxy._get_collection_range( 2, 1 ), objects[2:3] )
+        self.assertEqual( self.proxy._get_collection_range( 4, rows ), objects[4:] )
+        # after sorting, the boundaries are no longer valid
+        self.proxy._set_sort_decorator( 1, Qt.DescendingOrder )
+        self.assertFalse( self.proxy._keyset_boundaries )
+        # boundaries found before they were cleared are not stored
+        generation = self.proxy._keyset_generation
+        self.proxy._clear_keyset_boundaries()
+        self.proxy._set_keyset_boundary( 1, ( u'Foo', ), generation )
+        self.assertFalse( self.proxy._keyset_boundaries )
+        # updated, created and appended objects might change the rows
+        for change in [ lambda:self.proxy.handle_entities_update( None, objects[:1] ),
+                        lambda:self.proxy.handle_entity_create( None, objects[0] ),
+                        lambda:self.proxy.append( objects[0] ) ]:
+            self.proxy._get_collection_range( 0, 2 )
+            self.assertTrue( self.proxy._keyset_boundaries )
+            change()
+            self.assertFalse( self.proxy._keyset_boundaries )
+
+    def test_store_rows_after_removal( self ):
+        self._load_data()
+        rows = self.proxy.rowCount()
+        removals = self.proxy._removals
+        first = self.proxy._get_object( 0 )
+        last = self.proxy._get_object( rows - 1 )
+        stripped_rows = self.proxy._strip_rows( self.proxy._columns, [ ( rows - 1, last ) ] )
+        self.proxy.remove_object( first )
+        self.assertEqual( self.proxy.cache.get_row_by_entity( last ), rows - 2 )
+        # rows stripped before the removal are not stored
+        self.proxy._store_rows( self.proxy._columns, rows - 1, 1, removals, 
+                                stripped_rows, [] )
+        self.assertFalse( self.proxy.cache.has_data_at_row( rows - 1 ) )
+
+    def test_collection_ranges( self ):
+        objects = self.proxy.get_query_getter()().all()
+        rows = len( objects )
+        self.assertTrue( rows > 3 )
+        # the keys of all ranges are selected with one union query
+        fetched_ranges = self.proxy._get_collection_ranges( [(0, 2), (rows - 1, 1)] )
+        self.assertEqual( fetched_ranges, [ (0, 2, objects[0:2]),
+                                            (rows - 1, 1, objects[-1:]) ] )
+        self.assertTrue( 1 in self.proxy._keyset_boundaries )
+        # the rows are sorted per range, in the order of the ranges
+        fetched_ranges = self.proxy._get_collection_ranges( [(rows - 1, 1), (0, 3)] )
+        self.assertEqual( fetched_ranges, [ (rows - 1, 1, objects[-1:]),
+                                            (0, 3, objects[0:3]) ] )
+        # filling the cache uses the fetched ranges
+        self.proxy._fill_ranges( [(0, 2), (rows - 1, 1)] )
+        self.assertFalse( self.proxy._fetched_ranges )
+        self.assertEqual( self.proxy.cache.get_entity_at_row( 1 ), objects[1] )
+        self.assertEqual( self.proxy.cache.get_entity_at_row( rows - 1 ), objects[-1] )
+
+    def test_windows( self ):
+        from sqlalchemy.orm.attributes import instance_state
+        objects = self.proxy.get_query_getter()().all()
+        self.assertTrue( len( objects ) > 3 )
+        windows = list( self.proxy.get_windows( 2 ) )
+        self.assertTrue( max( len( window ) for window in windows ) <= 2 )
+        self.assertEqual( sum( windows, [] ), objects )
+        self.assertEqual( sum( self.proxy.get_windows( 2, 1, 3 ), [] ), objects[1:4] )
+        # the objects of a range of rows, partly in the cache
+        self.proxy._fill_cache( 2, 1 )
+        row_objects = [ self.proxy._get_object( row ) for row in range( 1, 4 ) ]
+        self.assertEqual( sum( self.proxy.get_row_windows( 1, 3 ), [] ), row_objects )
+        windows = list( self.proxy.get_row_windows( 1, 3, 2 ) )
+        self.assertTrue( max( len( window ) for window in windows ) <= 2 )
+        self.assertEqual( sum( windows, [] ), row_objects )
+        # objects that were in the session before are not released
+        obj = objects[0]
+        self.proxy._release_objects( [obj], set( [instance_state( obj ).key] ) )
+        self.assertTrue( obj in self.proxy.get_query_getter()().session )
+        # nor are objects in the cache of another proxy
+        other_proxy = QueryTableProxy( self.person_admin, 
+                                       query_getter = lambda:Person.query, 
+                                       columns_getter = self.person_admin.get_columns )
+        self._load_data( other_proxy )
+        obj = other_proxy._get_object( 0 )
+        self.assertFalse( self.proxy.is_cached( obj ) )
+        self.proxy._release_objects( [obj], set() )
+        self.assertTrue( obj in self.proxy.get_query_getter()().session )
+        
+    def test_estimated_row_count( self ):
+        rows = self.proxy.getRowCount()
+        self.assertTrue( rows > 1 )
+        self.proxy.estimated_row_count_limit = 1
+        self.proxy.refresh()
+        self.process()
+        self.assertEqual( self.proxy.rowCount(), rows )
+        self.assertFalse( self.proxy.isRowCountEstimated() )
+        # counts of a previous query are ignored
+        generation = self.proxy._row_count_generation
+        self.assertEqual( self.proxy._get_exact_row_count( generation ), rows )
+        self.assertEqual( self.proxy._get_exact_row_count( generation - 1 ), None )
+        
+    def test_prefetch( self ):
+        rows = self.proxy.rowCount()
+        self.assertTrue( rows > 3 )
+        self.proxy._track_scrolling( 0, 1 )
+        self.proxy._track_scrolling( 1, 1 )
+        offset, limit = self.proxy._prefetch_range()
+        self.assertEqual( offset, 2 )
+        self.assertTrue( 0 < limit <= rows - 2 )
+        # changing direction cancels the prefetch
+        self.proxy._track_scrolling( 0, 1 )
+        self.proxy._prefetch( offset, limit, 1 )
+        self.assertFalse( self.proxy.cache.has_data_at_row( offset ) )
+        self.proxy._track_scrolling( 1, 1 )
+        self.proxy._prefetch( offset, limit, 1 )
+        self.assertTrue( self.proxy.cache.has_data_at_row( offset ) )
+
+    def test_request_batches( self ):
+        self.assertTrue( self.proxy.rowCount() > 3 )
+        self._load_data()
+        counters = self.proxy.get_request_counters()['rows']
+        self.assertTrue( counters['batches'] < counters['requests'] )
+
+    def test_projected_loading( self ):
+        from camelot_example.model import Movie
+        movie_admin = self.app_admin.get_related_admin( Movie )
+        
+        def columns_getter():
+            return [ ( field_name, movie_admin.get_field_attributes( field_name ) )
+                     for field_name in ( 'title', 'short_description' ) ]
+            
+        proxy = QueryTableProxy( movie_admin,
+                                 query_getter = lambda:Movie.query,
+                                 columns_getter = columns_getter )
+        proxy.projected_loading = True
+        self.assertEqual( len( proxy._get_projected_columns() ), 2 )
+        self._load_data( proxy )
+        self.assertTrue( isinstance( proxy.cache.get_entity_at_row( 0 ), EntityStub ) )
+        title = self._data( 0, 0, proxy )
+        # the object of a row with a stub is loaded in the model thread
+        index = proxy.index( 1, 0 )
+        self.assertEqual( variant_to_pyobject( proxy.data( index, Qt.UserRole + 1 ) ),
+                          ValueLoading )
+        self.process()
+        self.assertTrue( isinstance( variant_to_pyobject( proxy.data( index, Qt.UserRole + 1 ) ),
+                                     Movie ) )
+        # the object is loaded when needed
+        movie = proxy._get_object( 0 )
+        self.assertTrue( isinstance( movie, Movie ) )
+        self.assertEqual( movie.title, title )
+        self.assertEqual( proxy.cache.get_entity_at_row( 0 ), movie )
+        # the stubs of a window of rows are resolved with a single query
+        proxy = QueryTableProxy( movie_admin,
+                                 query_getter = lambda:Movie.query,
+                                 columns_getter = columns_getter )
+        proxy.projected_loading = True
+        self._load_data( proxy )
+        rows = proxy.rowCount()
+        session = Session()
+        session.flush()
+        session.expunge_all()
+        install_statement_counter()
+        statements = count_statements()
+        movies = sum( proxy.get_row_windows( 0, rows - 1 ), [] )
+        self.assertEqual( count_statements() - statements, 1 )
+        self.assertEqual( len( movies ), rows )
+        self.assertTrue( all( isinstance( movie, Movie ) for movie in movies ) )
+        self.assertEqual( proxy.cache.get_entity_at_row( rows - 1 ), movies[-1] )
+        # a custom dynamic field attribute requires the object
+        proxy = QueryTableProxy( movie_admin,
+                                 query_getter = lambda:Movie.query,
+                                 columns_getter = movie_admin.get_columns )
+        proxy.projected_loading = True
+        self.assertEqual( proxy._get_projected_columns(), None )
+        # as does a customized batch evaluation of the dynamic field attributes
+        
+        class BatchAdmin( type( movie_admin ) ):
+            
+            def get_dynamic_field_attributes_batch( self, objects, field_names ):
+                return super( BatchAdmin, self ).get_dynamic_field_attributes_batch( objects,
+                                                                                     field_names )
+            
+        batch_admin = BatchAdmin( self.app_admin, Movie )
+        proxy = QueryTableProxy( batch_admin,
+                                 query_getter = lambda:Movie.query,
+                                 columns_getter = columns_getter )
+        proxy.projected_loading = True
+        self.assertEqual( proxy._get_projected_columns(), None )
+
+    def test_eager_load_paths( self ):
+        from camelot_example.model import Movie
+        movie_admin = self.app_admin.get_related_admin( Movie )
+        
+        def columns_getter():
+            return [ ( field_name, movie_admin.get_field_attributes( field_name ) )
+                     for field_name in ( 'title', 'director', 'cast' ) ]
+            
+        proxy = QueryTableProxy( movie_admin,
+                                 query_getter = lambda:Movie.query,
+                                 columns_getter = columns_getter )
+        # the director is both displayed and in the search path
+        self.assertEqual( proxy._get_eager_load_paths(), ['director'] )
+        self._load_data( proxy )
+        self.assertTrue( proxy._get_object( 0 ) )
+
+    def test_fill_cache_in_worker( self ):
+        from camelot.view import model_thread
+        # the query is built in the model thread, as a table view does
+        query = Session().query( Person )
+        proxy = QueryTableProxy( self.person_admin,
+                                 query_getter = lambda:query,
+                                 columns_getter = self.person_admin.get_columns )
+        rows = proxy.getRowCount()
+        self.assertTrue( rows > 1 )
+        worker_sessions = []
+
+        def fill_cache():
+            worker_query = proxy.get_query_getter()()
+            worker_sessions.append( worker_query.session is Session() )
+            proxy._fill_cache( 0, rows )
+
+        workers = model_thread.construct_worker_threads( 1 )
+        worker = workers[0]
+        exceptions = []
+        try:
+            worker.setup_exception_signal.connect( exceptions.append )
+            worker.start()
+            model_thread.post_read_only( fill_cache, affinity = proxy )
+            worker.wait_on_work()
+        finally:
+            model_thread.stop_worker_threads()
+        worker.wait()
+        self.process()
+        self.assertEqual( exceptions, [] )
+        # the worker used its own session instead of the one of the query
+        self.assertEqual( worker_sessions, [ True ] )
+        # the rows refer to the objects in the session of the model thread
+        for row in range( rows ):
+            self.assertTrue( proxy.cache.has_data_at_row( row ) )
+        self.assertTrue( isinstance( proxy.cache.get_entity_at_row( 0 ), EntityStub ) )
+        obj = proxy._get_object( 0 )
+        self.assertTrue( obj in query.session )
+        self.assertEqual( obj, proxy.get_query_getter()().first() )
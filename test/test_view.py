@@ -8,8 +8,10 @@ import time
 
 from camelot.core.utils import ugettext_lazy as _
 from camelot.core.files.storage import StoredFile, StoredImage, Storage
-from camelot.test import ModelThreadTestCase, EntityViewsTest
+from camelot.test import ModelThreadTestCase, EntityViewsTest, get_application
 from camelot.view.art import ColorScheme
+from camelot.view.lru import LruCache
+from camelot.view.proxy.collection_proxy import create_formatter
 
 from PyQt4 import QtGui, QtCore
 from PyQt4.QtGui import *
@@ -1144,3 +1146,148 @@ class SnippetsTest(ModelThreadTestCase):
         editor.set_value(proxy)
         self.process()
         self.grab_widget(editor)
+
+class SignalHandlerCase( unittest.TestCase ):
+    
+    def setUp( self ):
+        get_application()
+        
+    def test_coalesced_updates( self ):
+        from camelot.view.remote_signals import SignalHandler
+        
+        class A( object ):
+            pass
+        
+        class B( A ):
+            pass
+        
+        class Subscriber( QtCore.QObject ):
+            
+            def __init__( self ):
+                super( Subscriber, self ).__init__()
+                self.updates = []
+                
+            @QtCore.pyqtSlot( object, object )
+            def handle_entities_update( self, sender, entities ):
+                self.updates.append( entities )
+                
+            def handle_entity_delete( self, sender, entity ):
+                pass
+            
+            def handle_entity_create( self, sender, entity ):
+                pass
+            
+        signal_handler = SignalHandler()
+        a_subscriber = Subscriber()
+        b_subscriber = Subscriber()
+        signal_handler.connect_signals( a_subscriber, A )
+        signal_handler.connect_signals( b_subscriber, B )
+        single_updates = []
+        signal_handler.entity_update_signal.connect( lambda sender, entity:single_updates.append( entity ) )
+        entities = [ A(), A() ]
+        for entity in entities + entities:
+            signal_handler.sendEntityUpdate( None, entity )
+        signal_handler.flush_updates()
+        # the deprecated signal is still emitted for each entity
+        self.assertEqual( single_updates, entities )
+        # the subscribers are called through the event loop
+        self.assertEqual( a_subscriber.updates, [] )
+        QtCore.QCoreApplication.processEvents()
+        # the updates are signaled once per batch, without duplicates, and
+        # only to the subscribers of the class or its base classes
+        self.assertEqual( a_subscriber.updates, [ entities ] )
+        self.assertEqual( b_subscriber.updates, [] )
+        signal_handler.sendEntitiesUpdate( None, [ B() ] )
+        signal_handler.flush_updates()
+        QtCore.QCoreApplication.processEvents()
+        self.assertEqual( len( a_subscriber.updates ), 2 )
+        self.assertEqual( len( b_subscriber.updates ), 1 )
+        
+    def test_udp_notification_backend( self ):
+        import json
+        from camelot.view.remote_signals import UdpNotificationBackend
+        backend = UdpNotificationBackend( 0 )
+        self.assertNotEqual( backend.port, 0 )
+        received = []
+        backend.changes_received_signal.connect( received.append )
+        changes = [ ( u'Party', [1], u'update' ), ( u'Party', [2], u'delete' ) ]
+        backend.receive( json.dumps( { 'client' : 'other', 'changes' : changes } ) )
+        self.assertEqual( received, [ changes ] )
+        # our own changes and invalid datagrams are ignored
+        backend.receive( json.dumps( { 'client' : backend.client_id, 'changes' : changes } ) )
+        backend.receive( 'garbage' )
+        self.assertEqual( len( received ), 1 )
+        backend.close()
+
+class FormatterCase( unittest.TestCase ):
+    
+    def test_choices( self ):
+        formatter = create_formatter( {'choices':[(1, u'one'), (2, u'two')]} )
+        self.assertEqual( formatter( 1, {} ), u'one' )
+        self.assertEqual( formatter( 3, {} ), 3 )
+        # dynamic choices replace the static choices
+        self.assertEqual( formatter( 1, {'choices':[(1, u'een')]} ), u'een' )
+        
+    def test_dates( self ):
+        import datetime
+        formatter = create_formatter( {'python_type':datetime.date}, 2 )
+        for i in range( 2 ):
+            self.assertEqual( formatter( datetime.date( 2012, 1, 31 ), {} ), u'31/01/2012' )
+            self.assertEqual( formatter( datetime.date( 1800, 1, 31 ), {} ), u'' )
+            self.assertEqual( formatter( None, {} ), u'' )
+            
+    def test_unicode_format( self ):
+        formatter = create_formatter( {'unicode_format':lambda v:u'%.1f'%v} )
+        self.assertEqual( formatter( 1, {} ), u'1.0' )
+        self.assertEqual( formatter( None, {} ), u'' )
+
+class LruCacheCase( unittest.TestCase ):
+    
+    def test_least_recently_used( self ):
+        cache = LruCache( 3 )
+        for row, entity in enumerate( ['a', 'b', 'c'] ):
+            cache.add_data( row, entity, [row] )
+        # revisit the first row, so the second row is the oldest
+        self.assertEqual( cache.get_data_at_row( 0 ), [0] )
+        cache.add_data( 3, 'd', [3] )
+        self.assertEqual( len( cache ), 3 )
+        self.assertFalse( cache.has_data_at_row( 1 ) )
+        self.assertTrue( cache.has_data_at_row( 0 ) )
+        self.assertRaises( KeyError, cache.get_row_by_entity, 'b' )
+        # move an entity to another row
+        cache.add_data( 4, 'a', [4] )
+        self.assertEqual( cache.get_row_by_entity( 'a' ), 4 )
+        self.assertFalse( cache.has_data_at_row( 0 ) )
+        # replace the entity at a row
+        cache.add_data( 4, 'e', [5] )
+        self.assertRaises( KeyError, cache.get_row_by_entity, 'a' )
+        self.assertEqual( cache.get_entity_at_row( 4 ), 'e' )
+        self.assertEqual( cache.delete_by_entity( 'e' ), 4 )
+        self.assertEqual( cache.delete_by_entity( 'e' ), None )
+        self.assertRaises( KeyError, cache.delete_by_row, 4 )
+        
+    def test_max_size( self ):
+        cache = LruCache( 100, max_size = 1000 )
+        for row in range( 100 ):
+            cache.add_data( row, row, [u'x'*10] )
+        self.assertTrue( 0 < len( cache ) < 100 )
+        self.assertTrue( cache.size <= 1000 )
+        self.assertTrue( cache.has_data_at_row( 99 ) )
+        
+    def test_shallow_copy( self ):
+        cache = LruCache( 10 )
+        cache.add_data( 0, 'a', [0] )
+        copied_cache = cache.shallow_copy( 20 )
+        self.assertEqual( copied_cache.get_entity_at_row( 0 ), 'a' )
+        self.assertFalse( copied_cache.has_data_at_row( 0 ) )
+        
+    def test_remove_row( self ):
+        cache = LruCache( 10 )
+        for row, entity in enumerate( ['a', 'b', 'c'] ):
+            cache.add_data( row, entity, [row] )
+        cache.remove_row( 1 )
+        self.assertEqual( len( cache ), 2 )
+        self.assertRaises( KeyError, cache.get_row_by_entity, 'b' )
+        self.assertEqual( cache.get_row_by_entity( 'c' ), 1 )
+        self.assertEqual( cache.get_data_at_row( 1 ), [2] )
+        self.assertFalse( cache.has_data_at_row( 2 ) )